@@ -17,8 +17,29 @@ class LIA_Model(torch.nn.Module):
         
         return wa, alpha, feats
     
+    def get_start_direction_code_single(self, x_start):
+        # Same outputs as get_start_direction_code(x, x, x, x), with one encoder pass instead of four
+        return self.enc.encode_for_inference(x_start)
+
     def render(self, start, direction, feats):
         return self.dec(start, direction, feats)
+
+    def precompute_styles(self, start, fold_demod=False):
+        # Per-avatar affine map from motion code to every layer's style, see Synthesis.precompute_styles
+        return self.dec.precompute_styles(start, fold_demod=fold_demod)
+
+    def render_batch(self, start, directions, feats, batch_size=8, styles=None):
+        """
+        Render a sequence of motion codes `directions` (T x motion_dim) for one source
+        (`start`, `feats` with batch 1), `batch_size` frames per forward pass.
+        Yields the rendered chunks (n x 3 x H x W) in order, so memory stays bounded by `batch_size`.
+        If `styles` (from `precompute_styles(start)`) is given, the folded style path is used.
+        """
+        for i in range(0, directions.size(0), batch_size):
+            if styles is not None:
+                yield self.dec.forward_precomputed(styles, directions[i:i + batch_size], feats)
+            else:
+                yield self.dec(start, directions[i:i + batch_size], feats)
     
     def load_lightning_model(self, lia_pretrained_model_path):
         selfState = self.state_dict()
@@ -1,9 +1,15 @@
 from flask import Flask
 from demo import main,get_arg_parser
+from engine import AvatarEngine
 from flask import request, jsonify
 from flask_cors import CORS 
 from flask import send_file
 import os
+import sys
+
+# workspace.py is shared with the combined servers one level up (backend/models)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from workspace import Workspace
 
 #suppress warning and errors
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
@@ -18,8 +24,27 @@ CORS(app)
 def home(): 
     return 'Hello, from flask'
 
-UPLOAD_FOLDER = './uploads'
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+CKPT_DIR = os.path.join(BASE_DIR, "ckpts")
+# Every request gets its own directory under here, see workspace.Workspace
+WORKSPACE_ROOT = os.path.abspath(os.environ.get("AVATAR_WORKSPACE_ROOT", "workspaces"))
+os.makedirs(WORKSPACE_ROOT, exist_ok=True)
+
+# Load the checkpoints once at server start and reuse them for every request
+engine = AvatarEngine(
+    stage1_checkpoint_path=os.path.join(CKPT_DIR, "stage1.ckpt"),
+    stage2_checkpoint_path=os.path.join(CKPT_DIR, "stage2_audio_only_hubert.ckpt"),
+    infer_type='hubert_audio_only',
+    device='cpu',
+    hubert_model_path=os.path.join(CKPT_DIR, "chinese-hubert-large"),
+    feature_cache_dir=os.path.join(BASE_DIR, "hubert_cache"),
+)
+
+def send_and_cleanup(ws, path, **kwargs):
+    # The workspace is removed once the response body has been streamed to the client
+    response = send_file(path, **kwargs)
+    response.call_on_close(ws.cleanup)
+    return response
 
 @app.route('/run', methods=['POST'])
 def run_inference():
@@ -29,24 +54,14 @@ def run_inference():
     if not image_file or not audio_file:
         return jsonify({'error': 'Both image and audio files are required'}), 400
 
-    image_filename = os.path.splitext(image_file.filename)[0]
-    audio_filename = os.path.splitext(audio_file.filename)[0]
-
-    image_path = os.path.join(UPLOAD_FOLDER, image_file.filename)
-    audio_path = os.path.join(UPLOAD_FOLDER, audio_file.filename)
-    image_file.save(image_path)
-    audio_file.save(audio_path)
-
     infer_type = request.form.get('infer_type', 'hubert_audio_only')
     seed = int(request.form.get('seed', 0))
 
-    parser = get_arg_parser()
-    base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-    ckpt_dir = os.path.join(base_dir, "ckpts")
-    output_dir = os.path.join(base_dir, "output")
+    ws = Workspace(WORKSPACE_ROOT)
+    image_path = ws.save(image_file, "image")
+    audio_path = ws.save(audio_file, "audio")
 
-    stage1_ckpt = os.path.join(ckpt_dir, "stage1.ckpt")
-    stage2_ckpt = os.path.join(ckpt_dir, "stage2_audio_only_hubert.ckpt")  
+    parser = get_arg_parser()
 
     args_list = [
         "--test_image_path", image_path,
@@ -54,25 +69,25 @@ def run_inference():
         "--infer_type", infer_type,
         "--seed", str(seed), 
         "--device", "cpu",
-        "--stage1_checkpoint_path", stage1_ckpt,
-        "--stage2_checkpoint_path", stage2_ckpt,
-        "--result_path", output_dir
+        "--result_path", ws.dir
     ]
 
     try:
         args = parser.parse_args(args_list)
-        main(args)
+        main(args, engine=engine)
     except Exception as e:
+        ws.cleanup()
         return jsonify({'error': str(e)}), 500
 
-    # Construct the known output video name
-    output_filename = f"{image_filename}-{audio_filename}.mp4"
-    output_filepath = os.path.join(output_dir, output_filename)
+    # demo.main names the video after the saved inputs
+    output_filename = "image-audio.mp4"
+    output_filepath = ws.path(output_filename)
 
     if not os.path.exists(output_filepath):
+        ws.cleanup()
         return jsonify({'error': 'Output video not found'}), 500
 
-    return send_file(output_filepath, mimetype='video/mp4', as_attachment=True, download_name=output_filename)
+    return send_and_cleanup(ws, output_filepath, mimetype='video/mp4', as_attachment=True, download_name=output_filename)
 
 
 if __name__ == '__main__':
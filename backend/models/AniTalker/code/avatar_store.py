@@ -0,0 +1,101 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+from safetensors.torch import load_file, save_file
+
+_AVATAR_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+class AvatarProfile:
+    """Everything the renderer needs from a source portrait: the LIA codes, the feature pyramid and the 256px image."""
+    def __init__(self, avatar_id, image_path, start, direction, feats):
+        self.avatar_id = avatar_id
+        self.image_path = image_path
+        self.start = start
+        self.direction = direction
+        self.feats = feats
+
+    def to(self, device):
+        return AvatarProfile(self.avatar_id, self.image_path, self.start.to(device), self.direction.to(device),
+                             [feat.to(device) for feat in self.feats])
+
+
+class AvatarStore:
+    """
+    Encoded portraits, saved under an avatar ID so a returning avatar skips
+    preprocessing (crop / enhancement) and the LIA encoder entirely.
+
+    Each profile lives on disk as `<id>.safetensors` (start, direction, feats.*)
+    next to `<id>.png`, the preprocessed image it was encoded from. The last
+    `max_cached` profiles used are also kept in memory.
+    """
+    def __init__(self, root, max_cached=32):
+        self.root = os.path.abspath(root)
+        self.max_cached = max_cached
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def make_id(image_path, *parts):
+        """ID of a portrait: a hash of the uploaded bytes plus how it was preprocessed (e.g. 'crop', 'enhance')."""
+        h = hashlib.blake2b(digest_size=16)
+        for part in parts:
+            h.update(str(part).encode())
+            h.update(b'\0')
+        with open(image_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def _tensor_path(self, avatar_id):
+        return os.path.join(self.root, f'{avatar_id}.safetensors')
+
+    def image_path(self, avatar_id):
+        return os.path.join(self.root, f'{avatar_id}.png')
+
+    def _remember(self, profile):
+        with self.lock:
+            self.cache[profile.avatar_id] = profile
+            self.cache.move_to_end(profile.avatar_id)
+            while len(self.cache) > self.max_cached:
+                self.cache.popitem(last=False)
+
+    def __contains__(self, avatar_id):
+        return bool(_AVATAR_ID_RE.match(avatar_id)) and (avatar_id in self.cache or os.path.exists(self._tensor_path(avatar_id)))
+
+    def get(self, avatar_id, device='cpu'):
+        if not _AVATAR_ID_RE.match(avatar_id):
+            return None
+        with self.lock:
+            profile = self.cache.get(avatar_id)
+            if profile is not None:
+                self.cache.move_to_end(avatar_id)
+                return profile
+
+        if not os.path.exists(self._tensor_path(avatar_id)):
+            return None
+        tensors = load_file(self._tensor_path(avatar_id), device=str(device))
+        feats = [tensors[f'feats.{i}'] for i in range(sum(name.startswith('feats.') for name in tensors))]
+        profile = AvatarProfile(avatar_id, self.image_path(avatar_id), tensors['start'], tensors['direction'], feats)
+        self._remember(profile)
+        return profile
+
+    def put(self, avatar_id, image_path, start, direction, feats, image_size=256):
+        """Save the encoding of `image_path` and return it as an AvatarProfile."""
+        Image.open(image_path).convert('RGB').resize((image_size, image_size)).save(self.image_path(avatar_id), format='PNG')
+
+        tensors = {'start': start.detach().cpu().contiguous(), 'direction': direction.detach().cpu().contiguous()}
+        for i, feat in enumerate(feats):
+            tensors[f'feats.{i}'] = feat.detach().cpu().contiguous()
+        tmp_path = f'{self._tensor_path(avatar_id)}.{threading.get_ident()}.tmp'
+        save_file(tensors, tmp_path)
+        os.replace(tmp_path, self._tensor_path(avatar_id))
+
+        profile = AvatarProfile(avatar_id, self.image_path(avatar_id), start, direction, list(feats))
+        self._remember(profile)
+        return profile
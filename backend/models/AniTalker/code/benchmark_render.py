@@ -0,0 +1,76 @@
+import argparse
+import time
+
+import torch
+
+from LIA_Model import LIA_Model
+from engine import img_preprocessing
+
+# Frames/sec of the LIA renderer: the per-frame loop vs LIA_Model.render_batch at several chunk sizes.
+#
+#   python benchmark_render.py --num_frames 100 --batch_sizes 1 4 8 16
+#   python benchmark_render.py --stage1_checkpoint_path ./ckpts/stage1.ckpt --test_image_path ../test_demos/portraits/monalisa.jpg
+
+
+@torch.no_grad()
+def render_per_frame(lia, start, directions, feats):
+    return torch.cat([lia.render(start, directions[i:i + 1], feats) for i in range(directions.size(0))])
+
+
+@torch.no_grad()
+def render_batched(lia, start, directions, feats, batch_size):
+    return torch.cat(list(lia.render_batch(start, directions, feats, batch_size=batch_size)))
+
+
+def timed(fn, repeats):
+    out, best = None, float('inf')
+    for _ in range(repeats):
+        start_time = time.time()
+        out = fn()
+        best = min(best, time.time() - start_time)
+    return out, best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stage1_checkpoint_path', type=str, default='', help='Path to the checkpoint of Stage1 (random weights if empty)')
+    parser.add_argument('--test_image_path', type=str, default='', help='Path to the portrait (random image if empty)')
+    parser.add_argument('--num_frames', type=int, default=64, help='Number of frames to render')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 4, 8, 16], help='Chunk sizes for render_batch')
+    parser.add_argument('--repeats', type=int, default=2, help='Runs per configuration, the fastest one is reported')
+    parser.add_argument('--threads', type=int, default=0, help='torch CPU threads (0 keeps the default)')
+    parser.add_argument('--image_size', type=int, default=256, help='Size of the image. Do not change.')
+    parser.add_argument('--motion_dim', type=int, default=20, help='Dimension of motion. Do not change.')
+    parser.add_argument('--device', type=str, default='cpu', help='Device for computation')
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    lia = LIA_Model(motion_dim=args.motion_dim, fusion_type='weighted_sum')
+    if args.stage1_checkpoint_path:
+        lia.load_lightning_model(args.stage1_checkpoint_path)
+    lia.to(args.device)
+    lia.eval()
+
+    if args.test_image_path:
+        img = img_preprocessing(args.test_image_path, args.image_size)
+    else:
+        img = torch.rand(1, 3, args.image_size, args.image_size) * 2 - 1
+    img = img.to(args.device)
+
+    with torch.no_grad():
+        start, _, feats = lia.get_start_direction_code_single(img)
+    directions = (torch.randn(args.num_frames, args.motion_dim) * 0.5).to(args.device)
+
+    print(f'device={args.device} threads={torch.get_num_threads()} frames={args.num_frames}')
+    reference, elapsed = timed(lambda: render_per_frame(lia, start, directions, feats), args.repeats)
+    baseline_fps = args.num_frames / elapsed
+    print(f'per-frame loop        : {baseline_fps:7.2f} frames/sec')
+
+    for batch_size in args.batch_sizes:
+        out, elapsed = timed(lambda: render_batched(lia, start, directions, feats, batch_size), args.repeats)
+        fps = args.num_frames / elapsed
+        diff = (out - reference).abs().max().item()
+        print(f'render_batch({batch_size:3d})     : {fps:7.2f} frames/sec  x{fps / baseline_fps:4.2f}  max_abs_diff={diff:.2e}')
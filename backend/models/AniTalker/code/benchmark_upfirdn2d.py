@@ -0,0 +1,73 @@
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from networks.styledecoder import Blur, Downsample, Upsample, ToFlow, upfirdn2d
+
+# Microbenchmark of the FIR resampling used by the renderer: upfirdn2d_native (one single-channel
+# conv over batch * channel images) vs the depthwise path the Upsample / Blur / Downsample modules
+# now take, plus the numpy warping grid of ToFlow vs its cached grid.
+#
+#   python benchmark_upfirdn2d.py --batch 8 --device cuda:0
+
+
+def timed(fn, repeats, device):
+    fn()  # warm up
+    if device.startswith('cuda'):
+        torch.cuda.synchronize()
+    start_time = time.time()
+    for _ in range(repeats):
+        out = fn()
+    if device.startswith('cuda'):
+        torch.cuda.synchronize()
+    return out, (time.time() - start_time) / repeats
+
+
+def numpy_grid(input):
+    # What ToFlow built on every call before the grids were cached
+    xs = np.linspace(-1, 1, input.size(2))
+    xs = np.meshgrid(xs, xs)
+    xs = np.stack(xs, 2)
+    return torch.tensor(xs, requires_grad=False).float().unsqueeze(0).repeat(input.size(0), 1, 1, 1).to(input.device)
+
+
+@torch.no_grad()
+def bench_module(name, module, input, up, down, repeats, device):
+    module = module.to(device)
+    native, native_time = timed(lambda: upfirdn2d(input, module.kernel, up=up, down=down, pad=module.pad), repeats, device)
+    fast, fast_time = timed(lambda: module(input), repeats, device)
+    diff = (native - fast).abs().max().item()
+    print(f'{name:34s} native {native_time * 1e3:8.3f} ms  depthwise {fast_time * 1e3:8.3f} ms  '
+          f'x{native_time / fast_time:5.2f}  max_abs_diff={diff:.2e}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch', type=int, default=8, help='Frames per forward pass (render_batch_size)')
+    parser.add_argument('--repeats', type=int, default=20, help='Timed runs per configuration')
+    parser.add_argument('--device', type=str, default='cpu', help='Device for computation')
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    blur_kernel = [1, 3, 3, 1]
+
+    # (channels, resolution) of the decoder's upsampling levels with channel_multiplier=1
+    for channel, size in [(512, 8), (512, 16), (512, 32), (256, 64), (128, 128)]:
+        x = torch.randn(args.batch, channel, size, size, device=args.device)
+        bench_module(f'Upsample       {channel:3d} x {size:3d}^2', Upsample(blur_kernel), x, 2, 1, args.repeats, args.device)
+        bench_module(f'Downsample     {channel:3d} x {size:3d}^2', Downsample(blur_kernel), x, 1, 2, args.repeats, args.device)
+        # the blur after ModulatedConv2d's transposed conv: 3x3 kernel, factor 2
+        upsampled = torch.randn(args.batch, channel, size * 2 + 1, size * 2 + 1, device=args.device)
+        bench_module(f'Blur (upsample) {channel:3d} x {size * 2 + 1:3d}^2', Blur(blur_kernel, pad=(1, 1), upsample_factor=2),
+                     upsampled, 1, 1, args.repeats, args.device)
+
+    print()
+    for size in [8, 16, 32, 64, 128, 256]:
+        x = torch.randn(args.batch, 3, size, size, device=args.device)
+        to_flow = ToFlow(3, 512).to(args.device)
+        ref, numpy_time = timed(lambda: numpy_grid(x), args.repeats, args.device)
+        out, cached_time = timed(lambda: to_flow.grid(size, x.device, x.dtype), args.repeats, args.device)
+        print(f'ToFlow grid {size:3d}^2                    numpy {numpy_time * 1e3:8.3f} ms  cached {cached_time * 1e3:8.3f} ms  '
+              f'equal={torch.equal(ref, out.expand_as(ref))}')
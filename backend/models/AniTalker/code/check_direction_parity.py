@@ -0,0 +1,75 @@
+import argparse
+import sys
+
+import torch
+
+from LIA_Model import LIA_Model
+
+# Checks the cached-basis inference mode of Direction / Synthesis against the original per-call QR:
+#   1. directions and rendered frames match within --atol,
+#   2. the cached Q is rebuilt after the weight changes (in-place update and load_state_dict).
+#
+#   python check_direction_parity.py --stage1_checkpoint_path ./ckpts/stage1.ckpt
+
+
+@torch.no_grad()
+def compare(name, ref, out, atol):
+    diff = (ref - out).abs().max().item()
+    ok = diff <= atol
+    print(f'{name:28s} max_abs_diff={diff:.3e} {"ok" if ok else "FAIL"}')
+    return ok
+
+
+@torch.no_grad()
+def check_parity(lia, img, alpha, atol):
+    dec = lia.dec
+    start, _, feats = lia.get_start_direction_code_single(img)
+
+    dec.set_inference(False)
+    ref_directions = dec.direction(alpha)
+    ref_frames = dec(start, alpha, feats)
+
+    dec.set_inference(True)
+    ok = compare('directions', ref_directions, dec.direction(alpha), atol)
+    ok &= compare('frames', ref_frames, dec(start, alpha, feats), atol)
+
+    # invalidation: in-place update of the weight
+    cached = dec.direction.cached_basis()
+    dec.direction.weight.mul_(1.5)
+    ok &= not torch.equal(cached, dec.direction.cached_basis())
+    ok &= compare('basis after in-place update', dec.direction.basis(), dec.direction.cached_basis(), atol)
+
+    # invalidation: load_state_dict
+    state = {k: v.clone() for k, v in dec.state_dict().items()}
+    state['direction.weight'] = torch.randn_like(state['direction.weight'])
+    dec.load_state_dict(state)
+    ok &= compare('basis after load_state_dict', dec.direction.basis(), dec.direction.cached_basis(), atol)
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stage1_checkpoint_path', type=str, default='', help='Path to the checkpoint of Stage1 (random weights if empty)')
+    parser.add_argument('--num_frames', type=int, default=8, help='Number of motion codes to compare')
+    parser.add_argument('--atol', type=float, default=1e-4, help='Allowed absolute difference')
+    parser.add_argument('--image_size', type=int, default=256, help='Size of the image. Do not change.')
+    parser.add_argument('--motion_dim', type=int, default=20, help='Dimension of motion. Do not change.')
+    parser.add_argument('--device', type=str, default='cpu', help='Device for computation')
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+
+    lia = LIA_Model(motion_dim=args.motion_dim, fusion_type='weighted_sum')
+    if args.stage1_checkpoint_path:
+        lia.load_lightning_model(args.stage1_checkpoint_path)
+    lia.to(args.device)
+    lia.eval()
+
+    img = (torch.rand(1, 3, args.image_size, args.image_size) * 2 - 1).to(args.device)
+    alpha = (torch.randn(args.num_frames, args.motion_dim) * 0.5).to(args.device)
+
+    if check_parity(lia, img, alpha, args.atol):
+        print('OK: cached-basis Direction matches the per-call QR')
+    else:
+        print('MISMATCH: cached-basis Direction differs from the per-call QR')
+        sys.exit(1)
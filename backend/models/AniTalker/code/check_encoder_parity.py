@@ -0,0 +1,63 @@
+import argparse
+import sys
+
+import torch
+
+from LIA_Model import LIA_Model
+from engine import img_preprocessing
+
+# Checks that the single-pass encoder path (Encoder.encode_for_inference) returns exactly
+# what the original four-pass get_start_direction_code(x, x, x, x) returns.
+#
+#   python check_encoder_parity.py --stage1_checkpoint_path ./ckpts/stage1.ckpt --test_image_path ../test_demos/portraits/monalisa.jpg
+
+
+def max_abs_diff(a, b):
+    return (a.float() - b.float()).abs().max().item()
+
+
+@torch.no_grad()
+def check_parity(lia, img):
+    ref_start, ref_direction, ref_feats = lia.get_start_direction_code(img, img, img, img)
+    start, direction, feats = lia.get_start_direction_code_single(img)
+
+    pairs = [('start', ref_start, start), ('direction', ref_direction, direction)]
+    pairs += [(f'feats[{i}]', ref, out) for i, (ref, out) in enumerate(zip(ref_feats, feats))]
+
+    ok = len(ref_feats) == len(feats)
+    for name, ref, out in pairs:
+        equal = torch.equal(ref, out)
+        ok = ok and equal
+        print(f'{name:10s} shape={tuple(out.shape)} equal={equal} max_abs_diff={max_abs_diff(ref, out):.3e}')
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stage1_checkpoint_path', type=str, default='', help='Path to the checkpoint of Stage1 (random weights if empty)')
+    parser.add_argument('--test_image_path', type=str, default='', help='Path to the portrait (random image if empty)')
+    parser.add_argument('--image_size', type=int, default=256, help='Size of the image. Do not change.')
+    parser.add_argument('--motion_dim', type=int, default=20, help='Dimension of motion. Do not change.')
+    parser.add_argument('--device', type=str, default='cpu', help='Device for computation')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the random weights / image')
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+
+    lia = LIA_Model(motion_dim=args.motion_dim, fusion_type='weighted_sum')
+    if args.stage1_checkpoint_path:
+        lia.load_lightning_model(args.stage1_checkpoint_path)
+    lia.to(args.device)
+    lia.eval()
+
+    if args.test_image_path:
+        img = img_preprocessing(args.test_image_path, args.image_size)
+    else:
+        img = torch.rand(1, 3, args.image_size, args.image_size) * 2 - 1
+    img = img.to(args.device)
+
+    if check_parity(lia, img):
+        print('OK: encode_for_inference is bit-identical to get_start_direction_code')
+    else:
+        print('MISMATCH: encode_for_inference differs from get_start_direction_code')
+        sys.exit(1)
@@ -0,0 +1,82 @@
+import argparse
+import sys
+
+import torch
+
+from LIA_Model import LIA_Model
+from engine import img_preprocessing
+
+# Checks the folded per-avatar style path (Synthesis.precompute_styles / forward_precomputed)
+# against the original per-frame modulation: styles, demodulation factors and rendered frames.
+# The convolution order changes (input scaled by the style instead of a per-sample weight), so
+# the outputs agree within --atol rather than bit for bit.
+#
+#   python check_style_folding_parity.py --stage1_checkpoint_path ./ckpts/stage1.ckpt --test_image_path ../test_demos/portraits/monalisa.jpg
+
+
+@torch.no_grad()
+def compare(name, ref, out, atol):
+    diff = (ref.float() - out.float()).abs().max().item()
+    ok = diff <= atol
+    print(f'{name:28s} max_abs_diff={diff:.3e} {"ok" if ok else "FAIL"}')
+    return ok
+
+
+@torch.no_grad()
+def check_parity(lia, img, alpha, atol):
+    dec = lia.dec
+    start, _, feats = lia.get_start_direction_code_single(img)
+    ref_frames = dec(start, alpha, feats)
+
+    # per-layer styles of the original path: modulation(wa + direction(alpha))
+    latent = start + dec.direction(alpha)
+    convs = dec.modulated_convs()
+    ok = True
+    for fold_demod in (False, True):
+        styles = lia.precompute_styles(start, fold_demod=fold_demod)
+        layer_styles, demods = styles(alpha)
+        for i, (conv, style, demod) in enumerate(zip(convs, layer_styles, demods)):
+            ref_style = conv.modulation(latent)
+            ok &= compare(f'style[{i}]', ref_style, style, atol)
+            if conv.demodulate:
+                weight = conv.scale * conv.weight * ref_style.view(alpha.size(0), 1, conv.in_channel, 1, 1)
+                ref_demod = torch.rsqrt(weight.pow(2).sum([2, 3, 4]) + 1e-8)
+                ok &= compare(f'demod[{i}] fold_demod={fold_demod}', ref_demod, demod, atol)
+        ok &= compare(f'frames fold_demod={fold_demod}', ref_frames, dec.forward_precomputed(styles, alpha, feats), atol)
+        chunks = torch.cat(list(lia.render_batch(start, alpha, feats, batch_size=3, styles=styles)))
+        ok &= compare(f'render_batch fold_demod={fold_demod}', ref_frames, chunks, atol)
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stage1_checkpoint_path', type=str, default='', help='Path to the checkpoint of Stage1 (random weights if empty)')
+    parser.add_argument('--test_image_path', type=str, default='', help='Path to the portrait (random image if empty)')
+    parser.add_argument('--num_frames', type=int, default=8, help='Number of motion codes to compare')
+    parser.add_argument('--atol', type=float, default=1e-3, help='Allowed absolute difference')
+    parser.add_argument('--image_size', type=int, default=256, help='Size of the image. Do not change.')
+    parser.add_argument('--motion_dim', type=int, default=20, help='Dimension of motion. Do not change.')
+    parser.add_argument('--device', type=str, default='cpu', help='Device for computation')
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+
+    lia = LIA_Model(motion_dim=args.motion_dim, fusion_type='weighted_sum')
+    if args.stage1_checkpoint_path:
+        lia.load_lightning_model(args.stage1_checkpoint_path)
+    lia.to(args.device)
+    lia.eval()
+    lia.dec.set_inference(True)
+
+    if args.test_image_path:
+        img = img_preprocessing(args.test_image_path, args.image_size)
+    else:
+        img = torch.rand(1, 3, args.image_size, args.image_size) * 2 - 1
+    img = img.to(args.device)
+    alpha = (torch.randn(args.num_frames, args.motion_dim) * 0.5).to(args.device)
+
+    if check_parity(lia, img, alpha, args.atol):
+        print('OK: folded styles match the per-frame modulation')
+    else:
+        print('MISMATCH: folded styles differ from the per-frame modulation')
+        sys.exit(1)
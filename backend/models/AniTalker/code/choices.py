@@ -145,6 +145,8 @@ class GenerativeType(Enum):
 
     ddpm = 'ddpm'
     ddim = 'ddim'
+    # DPM-Solver++(2M): second order multistep, for sampling in few steps
+    dpmsolver = 'dpmsolver++'
 
 
 class OptimizerType(Enum):
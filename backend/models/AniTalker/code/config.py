@@ -179,20 +179,23 @@ class TrainConfig(BaseConfig):
         # hopefully, this would reduce the disconnection problems with sshfs
         return f'{self.work_cache_dir}/gen_images/{self.name}'
 
-    def _make_diffusion_conf(self, T=None):
+    def _make_diffusion_conf(self, T=None, gen_type=None):
+        if gen_type is None:
+            gen_type = self.beatgans_gen_type
         if self.diffusion_type == 'beatgans':
             # can use T < self.T for evaluation
             # follows the guided-diffusion repo conventions
             # t's are evenly spaced
-            if self.beatgans_gen_type == GenerativeType.ddpm:
+            if gen_type in (GenerativeType.ddpm, GenerativeType.dpmsolver):
+                # dpm-solver: any T, and the first step starts from t = T - 1
                 section_counts = [T]
-            elif self.beatgans_gen_type == GenerativeType.ddim:
+            elif gen_type == GenerativeType.ddim:
                 section_counts = f'ddim{T}'
             else:
                 raise NotImplementedError()
 
             return SpacedDiffusionBeatGansConfig(
-                gen_type=self.beatgans_gen_type,
+                gen_type=gen_type,
                 model_type=self.model_type,
                 betas=get_named_beta_schedule(self.beta_scheduler, self.T),
                 model_mean_type=self.beatgans_model_mean_type,
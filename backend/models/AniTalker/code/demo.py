@@ -1,20 +1,9 @@
-from LIA_Model import LIA_Model
+from engine import AvatarEngine, INFER_TYPES
 import torch
-import numpy as np
 import os
-from PIL import Image
-from tqdm import tqdm
 import argparse
-import numpy as np
-from torchvision import transforms # type: ignore
-from templates import *
-import argparse
-import shutil
-from moviepy.editor import AudioFileClip, VideoFileClip, ImageClip, concatenate_videoclips  # type: ignore
-import librosa # type: ignore
-import python_speech_features # type: ignore
+from moviepy.editor import AudioFileClip, VideoFileClip  # type: ignore
 import importlib.util
-import time
 import sys
 
 def check_package_installed(package_name):
@@ -26,33 +15,6 @@ def check_package_installed(package_name):
         print(f"{package_name} is installed.")
         return True
 
-def frames_to_video(input_path, audio_path, output_path, fps=25):
-    image_files = [os.path.join(input_path, img) for img in sorted(os.listdir(input_path))]
-    clips = [ImageClip(m).set_duration(1/fps) for m in image_files]
-    video = concatenate_videoclips(clips, method="compose")
-
-    audio = AudioFileClip(audio_path)
-    final_video = video.set_audio(audio)
-    final_video.write_videofile(output_path, fps=fps, codec='libx264', audio_codec='aac')
-
-def load_image(filename, size):
-    img = Image.open(filename).convert('RGB')
-    img = img.resize((size, size))
-    img = np.asarray(img)
-    img = np.transpose(img, (2, 0, 1))  # 3 x 256 x 256
-    return img / 255.0
-
-def img_preprocessing(img_path, size):
-    img = load_image(img_path, size)  # [0, 1]
-    img = torch.from_numpy(img).unsqueeze(0).float()  # [0, 1]
-    imgs_norm = (img - 0.5) * 2.0  # [-1, 1]
-    return imgs_norm
-
-def saved_image(img_tensor, img_path):
-    toPIL = transforms.ToPILImage()
-    img = toPIL(img_tensor.detach().cpu().squeeze(0))  # 使用squeeze(0)来移除批次维度
-    img.save(img_path)
-    
 #added
 transformers_427_path = os.path.abspath("../lib_transformers_427")
 def load_transformers(path):
@@ -61,52 +23,14 @@ def load_transformers(path):
     sys.path.pop(0)
     return transformers
 
-def main(args):
-    frames_result_saved_path = os.path.join(args.result_path, 'frames')
-    os.makedirs(frames_result_saved_path, exist_ok=True)
+def main(args, engine=None, progress_callback=None, profile=None):
     test_image_name = os.path.splitext(os.path.basename(args.test_image_path))[0]
     audio_name = os.path.splitext(os.path.basename(args.test_audio_path))[0]
     predicted_video_256_path = os.path.join(args.result_path,  f'{test_image_name}-{audio_name}.mp4')
     predicted_video_512_path = os.path.join(args.result_path,  f'{test_image_name}-{audio_name}_SR.mp4')
- 
-    #======Loading Stage 1 model=========
-    lia = LIA_Model(motion_dim=args.motion_dim, fusion_type='weighted_sum')
-    lia.load_lightning_model(args.stage1_checkpoint_path)
-    lia.to(args.device)
-    #============================
-
-    conf = ffhq256_autoenc()
-    conf.seed = args.seed
-    conf.decoder_layers = args.decoder_layers
-    conf.infer_type = args.infer_type
-    conf.motion_dim = args.motion_dim
-    
-    if args.infer_type == 'mfcc_full_control':
-        conf.face_location=True 
-        conf.face_scale=True
-        conf.mfcc = True
-
-    elif args.infer_type == 'mfcc_pose_only':
-        conf.face_location=False
-        conf.face_scale=False
-        conf.mfcc = True
-
-    elif args.infer_type == 'hubert_pose_only':
-        conf.face_location=False
-        conf.face_scale=False
-        conf.mfcc = False
-
-    elif args.infer_type == 'hubert_audio_only':
-        conf.face_location=False
-        conf.face_scale=False
-        conf.mfcc = False
+    os.makedirs(args.result_path, exist_ok=True)
 
-    elif args.infer_type == 'hubert_full_control':
-        conf.face_location=True
-        conf.face_scale=True
-        conf.mfcc = False
-
-    else:
+    if args.infer_type not in INFER_TYPES:
         print('Type NOT Found!')
         exit(0)
         
@@ -117,167 +41,50 @@ def main(args):
     if not os.path.exists(args.test_audio_path):
         print(f'{args.test_audio_path} does not exist!')
         exit(0)
-    
-    img_source = img_preprocessing(args.test_image_path, args.image_size).to(args.device)
-    one_shot_lia_start, one_shot_lia_direction, feats = lia.get_start_direction_code(img_source, img_source, img_source, img_source)
-
-
-    #======Loading Stage 2 model=========
-    model = LitModel(conf)
-    state = torch.load(args.stage2_checkpoint_path, map_location='cpu')
-    model.load_state_dict(state, strict=True)
-    model.ema_model.eval()
-    model.ema_model.to(args.device);
-    #=================================
-    
-    
-    #======Audio Input=========
-    if conf.infer_type.startswith('mfcc'):
-        # MFCC features
-        wav, sr = librosa.load(args.test_audio_path, sr=16000)
-        input_values = python_speech_features.mfcc(signal=wav, samplerate=sr, numcep=13, winlen=0.025, winstep=0.01)
-        d_mfcc_feat = python_speech_features.base.delta(input_values, 1)
-        d_mfcc_feat2 = python_speech_features.base.delta(input_values, 2)
-        audio_driven_obj = np.hstack((input_values, d_mfcc_feat, d_mfcc_feat2))
-        frame_start, frame_end = 0, int(audio_driven_obj.shape[0]/4)
-        audio_start, audio_end = int(frame_start * 4), int(frame_end * 4) # The video frame is fixed to 25 hz and the audio is fixed to 100 hz
-        
-        audio_driven = torch.Tensor(audio_driven_obj[audio_start:audio_end,:]).unsqueeze(0).float().to(args.device)
-        
-    elif conf.infer_type.startswith('hubert'):
-        # Hubert features
-        if not os.path.exists(args.test_hubert_path):
-            
-            if not check_package_installed('transformers'):
-                print('Please install transformers module first.')
-                exit(0)
-            # hubert_model_path = 'C:/Users/papur/Desktop/AvatarAI Project/final/AvataR/backend/models/AniTalker/ckpts/chinese-hubert-large'
-            hubert_model_path = 'C:/Users/Vivek/OneDrive/Desktop/2-2/Avatar/website/githubSANTOSH/AvataR2/AvataR2/backend/models/AniTalker/ckpts/chinese-hubert-large'
-            # print(os.getcwd())
-            if not os.path.exists(hubert_model_path):
-                print('Please download the hubert weight into the ckpts path first.')
-                exit(0)
-            # print('You did not extract the audio features in advance, extracting online now, which will increase processing delay')
-
-            start_time = time.time()
-
-            # load hubert model
-            from transformers import Wav2Vec2FeatureExtractor, HubertModel
-            audio_model = HubertModel.from_pretrained(hubert_model_path).to(args.device)
-            feature_extractor = Wav2Vec2FeatureExtractor.from_pretrained(hubert_model_path)
-            audio_model.feature_extractor._freeze_parameters()
-            audio_model.eval()
-            
-            # # Load AniTalker transformer version (e.g., 4.27.0)
-            # transformers_427 = load_transformers(transformers_427_path)
 
-            # # Import classes directly from submodules
-            # Wav2Vec2FeatureExtractor_427 = transformers_427.models.wav2vec2.feature_extraction_wav2vec2.Wav2Vec2FeatureExtractor
-            # HubertModel_427 = transformers_427.models.hubert.modeling_hubert.HubertModel
-
-            # # Set paths and device
-            # hubert_model_path = "facebook/hubert-base-ls960"  # or your local path
-            # device = "cpu"
-
-            # # Instantiate model and feature extractor
-            # audio_model = HubertModel_427.from_pretrained(hubert_model_path).to(device)
-            # feature_extractor = Wav2Vec2FeatureExtractor_427.from_pretrained(hubert_model_path)
-
-            # # Optional: Freeze extractor if applicable
-            # if hasattr(audio_model, "feature_extractor") and hasattr(audio_model.feature_extractor, "_freeze_parameters"):
-            #     audio_model.feature_extractor._freeze_parameters()
-
-            # audio_model.eval()
-            
-            
-            
-            # hubert model forward pass
-            audio, sr = librosa.load(args.test_audio_path, sr=16000)
-            input_values = feature_extractor(audio, sampling_rate=16000, padding=True, do_normalize=True, return_tensors="pt").input_values
-            input_values = input_values.to(args.device)
-            ws_feats = []
-            with torch.no_grad():
-                outputs = audio_model(input_values, output_hidden_states=True)
-                for i in range(len(outputs.hidden_states)):
-                    ws_feats.append(outputs.hidden_states[i].detach().cpu().numpy())
-                ws_feat_obj = np.array(ws_feats)
-                ws_feat_obj = np.squeeze(ws_feat_obj, 1)
-                ws_feat_obj = np.pad(ws_feat_obj, ((0, 0), (0, 1), (0, 0)), 'edge') # align the audio length with video frame
-            
-            execution_time = time.time() - start_time
-            print(f"Extraction Audio Feature: {execution_time:.2f} Seconds")
-
-            audio_driven_obj = ws_feat_obj
-        else:
-            print(f'Using audio feature from path: {args.test_hubert_path}')
-            audio_driven_obj = np.load(args.test_hubert_path)
-
-        frame_start, frame_end = 0, int(audio_driven_obj.shape[1]/2)
-        audio_start, audio_end = int(frame_start * 2), int(frame_end * 2) # The video frame is fixed to 25 hz and the audio is fixed to 50 hz
-        
-        audio_driven = torch.Tensor(audio_driven_obj[:,audio_start:audio_end,:]).unsqueeze(0).float().to(args.device)
-    #============================
-    
-    # Diffusion Noise
-    noisyT = th.randn((1,frame_end, args.motion_dim)).to(args.device)
-    
-    #======Inputs for Attribute Control=========
-    if os.path.exists(args.pose_driven_path):
-        pose_obj = np.load(args.pose_driven_path)
-
-       
-        if len(pose_obj.shape) != 2:
-            print('please check your pose information. The shape must be like (T, 3).')
-            exit(0)
-        if pose_obj.shape[1] != 3:
-            print('please check your pose information. The shape must be like (T, 3).')
-            exit(0)
-
-        if pose_obj.shape[0] >= frame_end:
-            pose_obj = pose_obj[:frame_end,:]
-        else:
-            padding = np.tile(pose_obj[-1, :], (frame_end - pose_obj.shape[0], 1))
-            pose_obj = np.vstack((pose_obj, padding))
-            
-        pose_signal = torch.Tensor(pose_obj).unsqueeze(0).to(args.device)/ 90 # 90 is for normalization here
-    else:
-        yaw_signal = torch.zeros(1, frame_end, 1).to(args.device) + args.pose_yaw
-        pitch_signal = torch.zeros(1, frame_end, 1).to(args.device) + args.pose_pitch
-        roll_signal = torch.zeros(1, frame_end, 1).to(args.device) + args.pose_roll
-        pose_signal = torch.cat((yaw_signal, pitch_signal, roll_signal), dim=-1)
-    
-    pose_signal = torch.clamp(pose_signal, -1, 1)
-
-    face_location_signal = torch.zeros(1, frame_end, 1).to(args.device) + args.face_location
-    face_scae_signal = torch.zeros(1, frame_end, 1).to(args.device) + args.face_scale
-    #===========================================
-
-    start_time = time.time()
-
-    #======Diffusion Denosing Process=========
-    generated_directions = model.render(one_shot_lia_start, one_shot_lia_direction, audio_driven, face_location_signal, face_scae_signal, pose_signal, noisyT, args.step_T, control_flag=args.control_flag)
-    #=========================================
-    
-    execution_time = time.time() - start_time
-    print(f"Motion Diffusion Model: {execution_time:.2f} Seconds")
-
-    generated_directions = generated_directions.detach().cpu().numpy()
-    
-    start_time = time.time()
-    #======Rendering images frame-by-frame=========
-    for pred_index in tqdm(range(generated_directions.shape[1])):
-        ori_img_recon = lia.render(one_shot_lia_start, torch.Tensor(generated_directions[:,pred_index,:]).to(args.device), feats)
-        ori_img_recon = ori_img_recon.clamp(-1, 1)
-        wav_pred = (ori_img_recon.detach() + 1) / 2
-        saved_image(wav_pred, os.path.join(frames_result_saved_path, "%06d.png"%(pred_index)))
-    #==============================================
-    
-    execution_time = time.time() - start_time
-    print(f"Renderer Model: {execution_time:.2f} Seconds")
-
-    frames_to_video(frames_result_saved_path, args.test_audio_path, predicted_video_256_path)
-    
-    shutil.rmtree(frames_result_saved_path)
+    #======Loading Stage 1 & Stage 2 models=========
+    # A resident engine can be passed in to skip reloading every checkpoint.
+    if engine is None:
+        engine = AvatarEngine.from_args(args)
+    elif engine.infer_type != args.infer_type:
+        raise ValueError(f'The engine is loaded for {engine.infer_type}, not {args.infer_type}')
+    #===============================================
+
+    if args.seeds and len(args.seeds) > 1:
+        # Several takes denoised as one batch: one video per seed
+        controls = dict(pose_yaw=args.pose_yaw, pose_pitch=args.pose_pitch, pose_roll=args.pose_roll,
+                        face_location=args.face_location, face_scale=args.face_scale,
+                        pose_driven_path=args.pose_driven_path)
+        output_paths = [os.path.join(args.result_path, f'{test_image_name}-{audio_name}_seed{seed}.mp4') for seed in args.seeds]
+        engine.generate_batch(args.test_image_path,
+                              args.test_audio_path,
+                              output_paths,
+                              hubert_path=args.test_hubert_path,
+                              seeds=args.seeds,
+                              controls=[controls],
+                              step_T=args.step_T,
+                              control_flag=args.control_flag,
+                              progress_callback=progress_callback,
+                              profile=profile,
+                              sampler=args.sampler)
+        return
+
+    engine.generate(args.test_image_path,
+                    args.test_audio_path,
+                    predicted_video_256_path,
+                    hubert_path=args.test_hubert_path,
+                    seed=args.seed,
+                    step_T=args.step_T,
+                    control_flag=args.control_flag,
+                    pose_yaw=args.pose_yaw,
+                    pose_pitch=args.pose_pitch,
+                    pose_roll=args.pose_roll,
+                    face_location=args.face_location,
+                    face_scale=args.face_scale,
+                    pose_driven_path=args.pose_driven_path,
+                    progress_callback=progress_callback,
+                    profile=profile,
+                    sampler=args.sampler)
     
     
     # Enhancer
@@ -308,7 +115,10 @@ def get_arg_parser():
     parser.add_argument('--result_path', type=str, default='./results/', help='Type of inference')
     parser.add_argument('--stage1_checkpoint_path', type=str, default='./ckpts/stage1.ckpt', help='Path to the checkpoint of Stage1')
     parser.add_argument('--stage2_checkpoint_path', type=str, default='./ckpts/pose_only.ckpt', help='Path to the checkpoint of Stage2')
+    parser.add_argument('--hubert_model_path', type=str, default='./ckpts/chinese-hubert-large', help='Path to the hubert weight. Not needed for MFCC')
+    parser.add_argument('--hubert_cache_dir', type=str, default=None, help='Directory to cache extracted hubert features in. Not needed for MFCC')
     parser.add_argument('--seed', type=int, default=0, help='seed for generations')
+    parser.add_argument('--seeds', type=int, nargs='+', default=None, help='Several seeds: one video per seed, denoised as one batch')
     parser.add_argument('--control_flag', action='store_true', help='Whether to use control signal or not')
     parser.add_argument('--pose_yaw', type=float, default=0.25, help='range from -1 to 1 (-90 ~ 90 angles)')
     parser.add_argument('--pose_pitch', type=float, default=0, help='range from -1 to 1 (-90 ~ 90 angles)')
@@ -317,10 +127,20 @@ def get_arg_parser():
     parser.add_argument('--pose_driven_path', type=str, default='xxx', help='path to pose numpy, shape is (T, 3). You can check the following code https://github.com/liutaocode/talking_face_preprocessing to extract the yaw, pitch and roll.')
     parser.add_argument('--face_scale', type=float, default=0.5, help='range from 0 to 1 (from small to large)')
     parser.add_argument('--step_T', type=int, default=50, help='Step T for diffusion denoising process')
+    parser.add_argument('--sampler', type=str, default='ddim', choices=['ddpm', 'ddim', 'dpmsolver++'], help='Diffusion sampler. dpmsolver++ needs far fewer steps (step_T 8-15)')
     parser.add_argument('--image_size', type=int, default=256, help='Size of the image. Do not change.')
     parser.add_argument('--device', type=str, default='cuda:0', help='Device for computation')
     parser.add_argument('--motion_dim', type=int, default=20, help='Dimension of motion. Do not change.')
     parser.add_argument('--decoder_layers', type=int, default=2, help='Layer number for the conformer.')
+    parser.add_argument('--render_batch_size', type=int, default=8, help='Frames rendered per forward pass of the renderer')
+    parser.add_argument('--encode_queue_size', type=int, default=4, help='Rendered batches buffered for the video encoder')
+    parser.add_argument('--disable_style_folding', action='store_true', help='Modulate every conv per frame instead of using the folded per-avatar style map')
+    parser.add_argument('--keep_hubert_layers', action='store_true', help='Keep all hubert hidden states instead of blending them with the HAL weights at extraction')
+    parser.add_argument('--hubert_weight_mass', type=float, default=1.0, help='Run hubert only up to the layers holding this share of the HAL weight (1.0 runs every layer)')
+    parser.add_argument('--motion_window', type=int, default=0, help='Diffuse clips longer than this many frames in overlapping windows (0 disables it)')
+    parser.add_argument('--motion_window_overlap', type=int, default=25, help='Frames shared (and crossfaded) by consecutive windows')
+    parser.add_argument('--motion_window_mode', type=str, default='chained', choices=['chained', 'parallel'], help='chained: each window starts from the previous one; parallel: windows are batched')
+    parser.add_argument('--motion_window_batch', type=int, default=4, help='Windows denoised together in parallel mode')
     parser.add_argument('--face_sr', action='store_true', help='Face super-resolution (Optional). Please install GFPGAN first')
     return parser
 
@@ -370,7 +190,10 @@ def run_from_args(args_dict):
     parser.add_argument('--result_path', type=str, help='Type of inference')
     parser.add_argument('--stage1_checkpoint_path', type=str, default='./ckpts/stage1.ckpt', help='Path to the checkpoint of Stage1')
     parser.add_argument('--stage2_checkpoint_path', type=str, default='./ckpts/pose_only.ckpt', help='Path to the checkpoint of Stage2')
+    parser.add_argument('--hubert_model_path', type=str, default='./ckpts/chinese-hubert-large', help='Path to the hubert weight. Not needed for MFCC')
+    parser.add_argument('--hubert_cache_dir', type=str, default=None, help='Directory to cache extracted hubert features in. Not needed for MFCC')
     parser.add_argument('--seed', type=int, default=0, help='seed for generations')
+    parser.add_argument('--seeds', type=int, nargs='+', default=None, help='Several seeds: one video per seed, denoised as one batch')
     parser.add_argument('--control_flag', action='store_true', help='Whether to use control signal or not')
     parser.add_argument('--pose_yaw', type=float, default=0.25, help='range from -1 to 1 (-90 ~ 90 angles)')
     parser.add_argument('--pose_pitch', type=float, default=0, help='range from -1 to 1 (-90 ~ 90 angles)')
@@ -379,10 +202,20 @@ def run_from_args(args_dict):
     parser.add_argument('--pose_driven_path', type=str, default='xxx', help='path to pose numpy, shape is (T, 3). You can check the following code https://github.com/liutaocode/talking_face_preprocessing to extract the yaw, pitch and roll.')
     parser.add_argument('--face_scale', type=float, default=0.5, help='range from 0 to 1 (from small to large)')
     parser.add_argument('--step_T', type=int, default=50, help='Step T for diffusion denoising process')
+    parser.add_argument('--sampler', type=str, default='ddim', choices=['ddpm', 'ddim', 'dpmsolver++'], help='Diffusion sampler. dpmsolver++ needs far fewer steps (step_T 8-15)')
     parser.add_argument('--image_size', type=int, default=256, help='Size of the image. Do not change.')
     parser.add_argument('--device', type=str, default='cuda:0', help='Device for computation')
     parser.add_argument('--motion_dim', type=int, default=20, help='Dimension of motion. Do not change.')
     parser.add_argument('--decoder_layers', type=int, default=2, help='Layer number for the conformer.')
+    parser.add_argument('--render_batch_size', type=int, default=8, help='Frames rendered per forward pass of the renderer')
+    parser.add_argument('--encode_queue_size', type=int, default=4, help='Rendered batches buffered for the video encoder')
+    parser.add_argument('--disable_style_folding', action='store_true', help='Modulate every conv per frame instead of using the folded per-avatar style map')
+    parser.add_argument('--keep_hubert_layers', action='store_true', help='Keep all hubert hidden states instead of blending them with the HAL weights at extraction')
+    parser.add_argument('--hubert_weight_mass', type=float, default=1.0, help='Run hubert only up to the layers holding this share of the HAL weight (1.0 runs every layer)')
+    parser.add_argument('--motion_window', type=int, default=0, help='Diffuse clips longer than this many frames in overlapping windows (0 disables it)')
+    parser.add_argument('--motion_window_overlap', type=int, default=25, help='Frames shared (and crossfaded) by consecutive windows')
+    parser.add_argument('--motion_window_mode', type=str, default='chained', choices=['chained', 'parallel'], help='chained: each window starts from the previous one; parallel: windows are batched')
+    parser.add_argument('--motion_window_batch', type=int, default=4, help='Windows denoised together in parallel mode')
     parser.add_argument('--face_sr', action='store_true', help='Face super-resolution (Optional). Please install GFPGAN first')
 
     args = parser.parse_args([])
@@ -97,6 +97,56 @@ class GaussianDiffusionBeatGans:
                                      np.sqrt(alphas) /
                                      (1.0 - self.alphas_cumprod))
 
+        # schedule arrays looked up per step, copied to each device once as
+        # float32 tensors (see _extract)
+        self.schedule = {
+            name: getattr(self, name)
+            for name in [
+                'alphas_cumprod', 'alphas_cumprod_prev', 'alphas_cumprod_next',
+                'sqrt_alphas_cumprod', 'sqrt_one_minus_alphas_cumprod',
+                'log_one_minus_alphas_cumprod', 'sqrt_recip_alphas_cumprod',
+                'sqrt_recipm1_alphas_cumprod', 'posterior_variance',
+                'posterior_log_variance_clipped', 'posterior_mean_coef1',
+                'posterior_mean_coef2'
+            ]
+        }
+        self.schedule['one_minus_alphas_cumprod'] = 1.0 - self.alphas_cumprod
+        self.schedule['recip_posterior_mean_coef1'] = (
+            1.0 / self.posterior_mean_coef1)
+        self.schedule['posterior_mean_coef2_over_coef1'] = (
+            self.posterior_mean_coef2 / self.posterior_mean_coef1)
+        fixed_large_variance = np.append(self.posterior_variance[1],
+                                         self.betas[1:])
+        self.schedule['fixed_large_variance'] = fixed_large_variance
+        self.schedule['fixed_large_log_variance'] = np.log(
+            fixed_large_variance)
+        self.device_schedules = {}
+
+    def schedule_on(self, device):
+        """
+        The schedule arrays as float32 tensors on `device`, converted on the
+        first call for each device.
+        """
+        device = th.device(device)
+        tensors = self.device_schedules.get(device)
+        if tensors is None:
+            tensors = {
+                # cast on the host: mps has no float64
+                name: th.from_numpy(arr.astype(np.float32)).to(device=device)
+                for name, arr in self.schedule.items()
+            }
+            self.device_schedules[device] = tensors
+        return tensors
+
+    def _extract(self, name, timesteps, broadcast_shape):
+        """
+        _extract_into_tensor for the schedule array `name`, indexing its
+        device-resident tensor instead of copying the numpy array.
+        """
+        return _extract_into_tensor(
+            self.schedule_on(timesteps.device)[name], timesteps,
+            broadcast_shape)
+
     def training_losses(self,
                         model,
                         motion_direction_start: th.Tensor,
@@ -191,10 +241,12 @@ class GaussianDiffusionBeatGans:
                x_start=None,
                clip_denoised=True,
                model_kwargs=None,
-               progress=False):
+               progress=False,
+               callback=None):
         """
         Args:
             x_start: given for the autoencoder
+            callback: if not None, called as callback(step, total_steps) after each denoising step
         """
         if model_kwargs is None:
             model_kwargs = {}
@@ -202,20 +254,34 @@ class GaussianDiffusionBeatGans:
                 model_kwargs['x_start'] = x_start
                 model_kwargs['cond'] = cond
 
+        if 'audio_driven' in model_kwargs and 'condition' not in model_kwargs:
+            # The audio / control condition does not depend on x_t or t: encode it once for all the steps
+            model_kwargs = dict(model_kwargs, condition=self.encode_condition(model, model_kwargs))
+
         if self.conf.gen_type == GenerativeType.ddpm:
             return self.p_sample_loop(model,
                                       shape=shape,
                                       noise=noise,
                                       clip_denoised=clip_denoised,
                                       model_kwargs=model_kwargs,
-                                      progress=progress)
+                                      progress=progress,
+                                      callback=callback)
         elif self.conf.gen_type == GenerativeType.ddim:
             return self.ddim_sample_loop(model,
                                          shape=shape,
                                          noise=noise,
                                          clip_denoised=clip_denoised,
                                          model_kwargs=model_kwargs,
-                                         progress=progress)
+                                         progress=progress,
+                                         callback=callback)
+        elif self.conf.gen_type == GenerativeType.dpmsolver:
+            return self.dpm_solver_sample_loop(model,
+                                               shape=shape,
+                                               noise=noise,
+                                               clip_denoised=clip_denoised,
+                                               model_kwargs=model_kwargs,
+                                               progress=progress,
+                                               callback=callback)
         else:
             raise NotImplementedError()
 
@@ -228,12 +294,12 @@ class GaussianDiffusionBeatGans:
         :return: A tuple (mean, variance, log_variance), all of x_start's shape.
         """
         mean = (
-            _extract_into_tensor(self.sqrt_alphas_cumprod, t, x_start.shape) *
+            self._extract('sqrt_alphas_cumprod', t, x_start.shape) *
             x_start)
-        variance = _extract_into_tensor(1.0 - self.alphas_cumprod, t,
-                                        x_start.shape)
-        log_variance = _extract_into_tensor(self.log_one_minus_alphas_cumprod,
-                                            t, x_start.shape)
+        variance = self._extract('one_minus_alphas_cumprod', t,
+                                 x_start.shape)
+        log_variance = self._extract('log_one_minus_alphas_cumprod', t,
+                                     x_start.shape)
         return mean, variance, log_variance
 
     def q_sample(self, x_start, t, noise=None):
@@ -251,9 +317,9 @@ class GaussianDiffusionBeatGans:
             noise = th.randn_like(x_start)
         assert noise.shape == x_start.shape
         return (
-            _extract_into_tensor(self.sqrt_alphas_cumprod, t, x_start.shape) *
-            x_start + _extract_into_tensor(self.sqrt_one_minus_alphas_cumprod,
-                                           t, x_start.shape) * noise)
+            self._extract('sqrt_alphas_cumprod', t, x_start.shape) *
+            x_start + self._extract('sqrt_one_minus_alphas_cumprod', t,
+                                    x_start.shape) * noise)
 
     def q_posterior_mean_variance(self, x_start, x_t, t):
         """
@@ -264,18 +330,28 @@ class GaussianDiffusionBeatGans:
         """
         assert x_start.shape == x_t.shape
         posterior_mean = (
-            _extract_into_tensor(self.posterior_mean_coef1, t, x_t.shape) *
+            self._extract('posterior_mean_coef1', t, x_t.shape) *
             x_start +
-            _extract_into_tensor(self.posterior_mean_coef2, t, x_t.shape) *
+            self._extract('posterior_mean_coef2', t, x_t.shape) *
             x_t)
-        posterior_variance = _extract_into_tensor(self.posterior_variance, t,
-                                                  x_t.shape)
-        posterior_log_variance_clipped = _extract_into_tensor(
-            self.posterior_log_variance_clipped, t, x_t.shape)
+        posterior_variance = self._extract('posterior_variance', t,
+                                           x_t.shape)
+        posterior_log_variance_clipped = self._extract(
+            'posterior_log_variance_clipped', t, x_t.shape)
         assert (posterior_mean.shape[0] == posterior_variance.shape[0] ==
                 posterior_log_variance_clipped.shape[0] == x_start.shape[0])
         return posterior_mean, posterior_variance, posterior_log_variance_clipped
 
+    def encode_condition(self, model, model_kwargs):
+        with th.no_grad(), autocast(self.conf.fp16):
+            return model.encode_condition(model_kwargs['start'],
+                                          model_kwargs['motion_direction_start'],
+                                          model_kwargs['audio_driven'],
+                                          model_kwargs['face_location'],
+                                          model_kwargs['face_scale'],
+                                          model_kwargs['yaw_pitch_roll'],
+                                          model_kwargs['control_flag'])
+
     def p_mean_variance(self,
                         model,
                         x,
@@ -313,6 +389,7 @@ class GaussianDiffusionBeatGans:
         yaw_pitch_roll = model_kwargs['yaw_pitch_roll']
         motion_direction_start = model_kwargs['motion_direction_start']
         control_flag = model_kwargs['control_flag']
+        condition = model_kwargs.get('condition')
         
         B, C = x.shape[:2]
         assert t.shape == (B, )
@@ -325,7 +402,8 @@ class GaussianDiffusionBeatGans:
                                                 yaw_pitch_roll,
                                                 x,
                                                 self._scale_timesteps(t), 
-                                                control_flag)
+                                                control_flag,
+                                                condition=condition)
         model_output = model_forward
 
         if self.model_var_type in [
@@ -335,18 +413,16 @@ class GaussianDiffusionBeatGans:
                 # for fixedlarge, we set the initial (log-)variance like so
                 # to get a better decoder log likelihood.
                 ModelVarType.fixed_large: (
-                    np.append(self.posterior_variance[1], self.betas[1:]),
-                    np.log(
-                        np.append(self.posterior_variance[1], self.betas[1:])),
+                    'fixed_large_variance',
+                    'fixed_large_log_variance',
                 ),
                 ModelVarType.fixed_small: (
-                    self.posterior_variance,
-                    self.posterior_log_variance_clipped,
+                    'posterior_variance',
+                    'posterior_log_variance_clipped',
                 ),
             }[self.model_var_type]
-            model_variance = _extract_into_tensor(model_variance, t, x.shape)
-            model_log_variance = _extract_into_tensor(model_log_variance, t,
-                                                      x.shape)
+            model_variance = self._extract(model_variance, t, x.shape)
+            model_log_variance = self._extract(model_log_variance, t, x.shape)
 
         def process_xstart(x):
             if denoised_fn is not None:
@@ -381,28 +457,27 @@ class GaussianDiffusionBeatGans:
 
     def _predict_xstart_from_eps(self, x_t, t, eps):
         assert x_t.shape == eps.shape
-        return (_extract_into_tensor(self.sqrt_recip_alphas_cumprod, t,
-                                     x_t.shape) * x_t -
-                _extract_into_tensor(self.sqrt_recipm1_alphas_cumprod, t,
-                                     x_t.shape) * eps)
+        return (self._extract('sqrt_recip_alphas_cumprod', t,
+                              x_t.shape) * x_t -
+                self._extract('sqrt_recipm1_alphas_cumprod', t,
+                              x_t.shape) * eps)
 
     def _predict_xstart_from_xprev(self, x_t, t, xprev):
         assert x_t.shape == xprev.shape
         return (  # (xprev - coef2*x_t) / coef1
-            _extract_into_tensor(1.0 / self.posterior_mean_coef1, t, x_t.shape)
-            * xprev - _extract_into_tensor(
-                self.posterior_mean_coef2 / self.posterior_mean_coef1, t,
-                x_t.shape) * x_t)
+            self._extract('recip_posterior_mean_coef1', t, x_t.shape)
+            * xprev - self._extract(
+                'posterior_mean_coef2_over_coef1', t, x_t.shape) * x_t)
 
     def _predict_xstart_from_scaled_xstart(self, t, scaled_xstart):
-        return scaled_xstart * _extract_into_tensor(
-            self.sqrt_recip_alphas_cumprod, t, scaled_xstart.shape)
+        return scaled_xstart * self._extract(
+            'sqrt_recip_alphas_cumprod', t, scaled_xstart.shape)
 
     def _predict_eps_from_xstart(self, x_t, t, pred_xstart):
-        return (_extract_into_tensor(self.sqrt_recip_alphas_cumprod, t,
-                                     x_t.shape) * x_t -
-                pred_xstart) / _extract_into_tensor(
-                    self.sqrt_recipm1_alphas_cumprod, t, x_t.shape)
+        return (self._extract('sqrt_recip_alphas_cumprod', t,
+                              x_t.shape) * x_t -
+                pred_xstart) / self._extract(
+                    'sqrt_recipm1_alphas_cumprod', t, x_t.shape)
 
     def _predict_eps_from_scaled_xstart(self, x_t, t, scaled_xstart):
         """
@@ -410,8 +485,8 @@ class GaussianDiffusionBeatGans:
             scaled_xstart: is supposed to be sqrt(alphacum) * x_0
         """
         # 1 / sqrt(1-alphabar) * (x_t - scaled xstart)
-        return (x_t - scaled_xstart) / _extract_into_tensor(
-            self.sqrt_one_minus_alphas_cumprod, t, x_t.shape)
+        return (x_t - scaled_xstart) / self._extract(
+            'sqrt_one_minus_alphas_cumprod', t, x_t.shape)
 
     def _scale_timesteps(self, t):
         if self.rescale_timesteps:
@@ -443,7 +518,7 @@ class GaussianDiffusionBeatGans:
         Unlike condition_mean(), this instead uses the conditioning strategy
         from Song et al (2020).
         """
-        alpha_bar = _extract_into_tensor(self.alphas_cumprod, t, x.shape)
+        alpha_bar = self._extract('alphas_cumprod', t, x.shape)
 
         eps = self._predict_eps_from_xstart(x, t, p_mean_var["pred_xstart"])
         eps = eps - (1 - alpha_bar).sqrt() * cond_fn(
@@ -514,6 +589,7 @@ class GaussianDiffusionBeatGans:
         model_kwargs=None,
         device=None,
         progress=False,
+        callback=None,
     ):
         """
         Generate samples from the model.
@@ -532,10 +608,12 @@ class GaussianDiffusionBeatGans:
         :param device: if specified, the device to create the samples on.
                        If not specified, use a model parameter's device.
         :param progress: if True, show a tqdm progress bar.
+        :param callback: if not None, called as callback(step, total_steps)
+                         after each timestep.
         :return: a non-differentiable batch of samples.
         """
         final = None
-        for sample in self.p_sample_loop_progressive(
+        for step, sample in enumerate(self.p_sample_loop_progressive(
                 model,
                 shape,
                 noise=noise,
@@ -545,8 +623,10 @@ class GaussianDiffusionBeatGans:
                 model_kwargs=model_kwargs,
                 device=device,
                 progress=progress,
-        ):
+        )):
             final = sample
+            if callback is not None:
+                callback(step + 1, self.num_timesteps)
         return final["sample"]
 
     def p_sample_loop_progressive(
@@ -635,9 +715,8 @@ class GaussianDiffusionBeatGans:
         # in case we used x_start or x_prev prediction.
         eps = self._predict_eps_from_xstart(x, t, out["pred_xstart"])
 
-        alpha_bar = _extract_into_tensor(self.alphas_cumprod, t, x.shape)
-        alpha_bar_prev = _extract_into_tensor(self.alphas_cumprod_prev, t,
-                                              x.shape)
+        alpha_bar = self._extract('alphas_cumprod', t, x.shape)
+        alpha_bar_prev = self._extract('alphas_cumprod_prev', t, x.shape)
         sigma = (eta * th.sqrt((1 - alpha_bar_prev) / (1 - alpha_bar)) *
                  th.sqrt(1 - alpha_bar / alpha_bar_prev))
         # Equation 12.
@@ -674,11 +753,10 @@ class GaussianDiffusionBeatGans:
         )
         # Usually our model outputs epsilon, but we re-derive it
         # in case we used x_start or x_prev prediction.
-        eps = (_extract_into_tensor(self.sqrt_recip_alphas_cumprod, t, x.shape)
-               * x - out["pred_xstart"]) / _extract_into_tensor(
-                   self.sqrt_recipm1_alphas_cumprod, t, x.shape)
-        alpha_bar_next = _extract_into_tensor(self.alphas_cumprod_next, t,
-                                              x.shape)
+        eps = (self._extract('sqrt_recip_alphas_cumprod', t, x.shape)
+               * x - out["pred_xstart"]) / self._extract(
+                   'sqrt_recipm1_alphas_cumprod', t, x.shape)
+        alpha_bar_next = self._extract('alphas_cumprod_next', t, x.shape)
 
         # Equation 12. reversed  (DDIM paper)  (th.sqrt == torch.sqrt)
         mean_pred = (out["pred_xstart"] * th.sqrt(alpha_bar_next) +
@@ -744,6 +822,7 @@ class GaussianDiffusionBeatGans:
         device=None,
         progress=False,
         eta=0.0,
+        callback=None,
     ):
         """
         Generate samples from the model using DDIM.
@@ -751,7 +830,7 @@ class GaussianDiffusionBeatGans:
         Same usage as p_sample_loop().
         """
         final = None
-        for sample in self.ddim_sample_loop_progressive(
+        for step, sample in enumerate(self.ddim_sample_loop_progressive(
                 model,
                 shape,
                 noise=noise,
@@ -762,8 +841,10 @@ class GaussianDiffusionBeatGans:
                 device=device,
                 progress=progress,
                 eta=eta,
-        ):
+        )):
             final = sample
+            if callback is not None:
+                callback(step + 1, self.num_timesteps)
         return final["sample"]
 
     def ddim_sample_loop_progressive(
@@ -825,6 +906,129 @@ class GaussianDiffusionBeatGans:
                 yield out
                 img = out["sample"]
 
+    def dpm_solver_sample_loop(
+        self,
+        model: Model,
+        shape=None,
+        noise=None,
+        clip_denoised=True,
+        denoised_fn=None,
+        model_kwargs=None,
+        device=None,
+        progress=False,
+        callback=None,
+    ):
+        """
+        Generate samples from the model using DPM-Solver++(2M).
+
+        Same usage as p_sample_loop().
+        """
+        final = None
+        for step, sample in enumerate(self.dpm_solver_sample_loop_progressive(
+                model,
+                shape,
+                noise=noise,
+                clip_denoised=clip_denoised,
+                denoised_fn=denoised_fn,
+                model_kwargs=model_kwargs,
+                device=device,
+                progress=progress,
+        )):
+            final = sample
+            if callback is not None:
+                callback(step + 1, self.num_timesteps)
+        return final["sample"]
+
+    def dpm_solver_sample_loop_progressive(
+        self,
+        model: Model,
+        shape=None,
+        noise=None,
+        clip_denoised=True,
+        denoised_fn=None,
+        model_kwargs=None,
+        device=None,
+        progress=False,
+    ):
+        """
+        Use DPM-Solver++(2M) (Lu et al. 2022, https://arxiv.org/abs/2211.01095)
+        to sample from the model and yield intermediate samples from each
+        timestep.
+
+        The model's eps prediction is turned into a data prediction x_0, and
+        x moves along the diffusion ODE in half-log-SNR lambda = log(alpha /
+        sigma) with a second order multistep update that reuses the x_0 of
+        the previous step, so each step still costs one model evaluation.
+        The first step is first order, and the last one (t = 0 -> clean)
+        returns the x_0 prediction as DDIM does.
+
+        Same usage as p_sample_loop_progressive().
+        """
+        if device is None:
+            device = next(model.parameters()).device
+        if noise is not None:
+            img = noise
+        else:
+            assert isinstance(shape, (tuple, list))
+            img = th.randn(*shape, device=device)
+        indices = list(range(self.num_timesteps))[::-1]
+
+        # alpha_t = sqrt(alphas_cumprod), sigma_t = sqrt(1 - alphas_cumprod),
+        # as python floats so they multiply tensors without changing dtypes
+        alphas = np.sqrt(self.alphas_cumprod).tolist()
+        sigmas = np.sqrt(1.0 - self.alphas_cumprod).tolist()
+        lambdas = [math.log(a / s) for a, s in zip(alphas, sigmas)]
+
+        if progress:
+            # Lazy import so that we don't depend on tqdm.
+            from tqdm.auto import tqdm
+
+            indices = tqdm(indices)
+
+        prev_xstart = None
+        prev_lambda = None
+        for i in indices:
+
+            if isinstance(model_kwargs, list):
+                # index dependent model kwargs
+                # (T-1, ..., 0)
+                _kwargs = model_kwargs[i]
+            else:
+                _kwargs = model_kwargs
+
+            t = th.tensor([i] * len(img), device=device)
+            with th.no_grad():
+                out = self.p_mean_variance(
+                    model,
+                    img,
+                    t,
+                    clip_denoised=clip_denoised,
+                    denoised_fn=denoised_fn,
+                    model_kwargs=_kwargs,
+                )
+                pred_xstart = out["pred_xstart"]
+
+                if i == 0:
+                    sample = pred_xstart
+                else:
+                    s = i - 1
+                    h = lambdas[s] - lambdas[i]
+                    if prev_xstart is None:
+                        xstart = pred_xstart
+                    else:
+                        # D = (1 + 1/2r) x0_i - 1/2r x0_prev, r = h_prev / h
+                        r = (lambdas[i] - prev_lambda) / h
+                        xstart = (1 + 0.5 / r) * pred_xstart - (
+                            0.5 / r) * prev_xstart
+                    sample = (sigmas[s] / sigmas[i]) * img - (
+                        alphas[s] * math.expm1(-h)) * xstart
+
+                prev_xstart = pred_xstart
+                prev_lambda = lambdas[i]
+                out = {"sample": sample, "pred_xstart": pred_xstart, 't': t}
+                yield out
+                img = sample
+
     def _vb_terms_bpd(self,
                       model: Model,
                       x_start,
@@ -954,14 +1158,17 @@ def _extract_into_tensor(arr, timesteps, broadcast_shape):
     """
     Extract values from a 1-D numpy array for a batch of indices.
 
-    :param arr: the 1-D numpy array.
+    :param arr: the 1-D numpy array, or a 1-D float tensor on the device of
+                timesteps.
     :param timesteps: a tensor of indices into the array to extract.
     :param broadcast_shape: a larger shape of K dimensions with the batch
                             dimension equal to the length of timesteps.
     :return: a tensor of shape [batch_size, 1, ...] where the shape has K dims.
     """
 
-    if hasattr(th.backends, 'mps') and th.backends.mps.is_available():
+    if isinstance(arr, th.Tensor):
+        res = arr.index_select(0, timesteps.long())
+    elif hasattr(th.backends, 'mps') and th.backends.mps.is_available():
         arr = arr.astype(np.float32)
         # Convert the numpy array to a tensor and then move to the device
         res = th.from_numpy(arr).to(device=timesteps.device)[timesteps]
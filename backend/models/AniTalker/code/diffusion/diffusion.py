@@ -111,8 +111,14 @@ class SpacedDiffusionBeatGans(GaussianDiffusionBeatGans):
     def _wrap_model(self, model: Model):
         if isinstance(model, _WrappedModel):
             return model
-        return _WrappedModel(model, self.timestep_map, self.rescale_timesteps,
-                             self.original_num_steps)
+        # reuse the wrapper of the last model, so its timestep map tensors stay cached
+        wrapped = getattr(self, '_wrapped_model', None)
+        if wrapped is None or wrapped.model is not model:
+            wrapped = _WrappedModel(model, self.timestep_map,
+                                    self.rescale_timesteps,
+                                    self.original_num_steps)
+            self._wrapped_model = wrapped
+        return wrapped
 
     def _scale_timesteps(self, t):
         # Scaling is done by the wrapped model.
@@ -129,16 +135,23 @@ class _WrappedModel:
         self.timestep_map = timestep_map
         self.rescale_timesteps = rescale_timesteps
         self.original_num_steps = original_num_steps
+        self.map_tensors = {}
 
-    def forward(self,motion_start, motion_direction_start, audio_feats,face_location, face_scale,yaw_pitch_roll, x_t, t, control_flag=False):
+    def map_tensor(self, device, dtype):
+        key = (device, dtype)
+        if key not in self.map_tensors:
+            self.map_tensors[key] = th.tensor(self.timestep_map,
+                                              device=device,
+                                              dtype=dtype)
+        return self.map_tensors[key]
+
+    def forward(self,motion_start, motion_direction_start, audio_feats,face_location, face_scale,yaw_pitch_roll, x_t, t, control_flag=False, condition=None):
         """
         Args:
             t: t's with differrent ranges (can be << T due to smaller eval T) need to be converted to the original t's
             t_cond: the same as t but can be of different values
         """
-        map_tensor = th.tensor(self.timestep_map,
-                               device=t.device,
-                               dtype=t.dtype)
+        map_tensor = self.map_tensor(t.device, t.dtype)
 
         def do(t):
             new_ts = map_tensor[t]
@@ -146,7 +159,7 @@ class _WrappedModel:
                 new_ts = new_ts.float() * (1000.0 / self.original_num_steps)
             return new_ts
 
-        return self.model(motion_start, motion_direction_start, audio_feats,face_location, face_scale,yaw_pitch_roll, x_t,do(t), control_flag=control_flag)
+        return self.model(motion_start, motion_direction_start, audio_feats,face_location, face_scale,yaw_pitch_roll, x_t,do(t), control_flag=control_flag, condition=condition)
 
     def __getattr__(self, name):
         # allow for calling the model's methods
@@ -0,0 +1,542 @@
+import os
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+from tqdm import tqdm
+import librosa # type: ignore
+import python_speech_features # type: ignore
+
+from LIA_Model import LIA_Model
+from feature_cache import FeatureCache
+from video_writer import PipelinedVideoWriter, to_uint8_frames
+from templates import *
+
+# infer_type -> (face_location, face_scale, mfcc)
+INFER_TYPES = {
+    'mfcc_full_control': (True, True, True),
+    'mfcc_pose_only': (False, False, True),
+    'hubert_pose_only': (False, False, False),
+    'hubert_audio_only': (False, False, False),
+    'hubert_full_control': (True, True, False),
+}
+
+
+# How the windows of a long clip are conditioned, see AvatarEngine.sample_motion_windowed
+WINDOW_MODES = ('chained', 'parallel')
+
+
+def window_starts(num_frames, window, overlap):
+    """First frame of every window of `window` frames overlapping by (at least) `overlap`; the last one ends the clip."""
+    if num_frames <= window:
+        return [0]
+    starts = list(range(0, num_frames - window, window - overlap))
+    starts.append(num_frames - window)
+    return starts
+
+
+def crossfade_into(motion, window_motion, start, end):
+    """
+    Write `window_motion` (W x motion_dim) into `motion` at `start`. The frames before `end`
+    (already written by the previous window) are crossfaded linearly into the new window.
+    Returns the new end of the written frames.
+    """
+    overlap = max(end - start, 0)
+    if overlap > 0:
+        ramp = torch.arange(1, overlap + 1, device=motion.device, dtype=motion.dtype).unsqueeze(1) / (overlap + 1)
+        motion[start:end] = motion[start:end] * (1 - ramp) + window_motion[:overlap] * ramp
+    motion[start + overlap:start + window_motion.size(0)] = window_motion[overlap:]
+    return start + window_motion.size(0)
+
+
+def hal_layers_for_mass(weights, mass):
+    """Number of leading HuBERT hidden states whose HAL weights add up to at least `mass` of the total."""
+    cumulative = torch.cumsum(weights / weights.sum(), dim=0)
+    return min(int((cumulative < mass - 1e-6).sum().item()) + 1, weights.numel())
+
+
+def load_image(filename, size):
+    img = Image.open(filename).convert('RGB')
+    img = img.resize((size, size))
+    img = np.asarray(img)
+    img = np.transpose(img, (2, 0, 1))  # 3 x 256 x 256
+    return img / 255.0
+
+
+def img_preprocessing(img_path, size):
+    img = load_image(img_path, size)  # [0, 1]
+    img = torch.from_numpy(img).unsqueeze(0).float()  # [0, 1]
+    imgs_norm = (img - 0.5) * 2.0  # [-1, 1]
+    return imgs_norm
+
+
+class AvatarEngine:
+    """
+    Long-lived AniTalker inference engine.
+
+    The stage1 renderer (LIA), the stage2 motion diffusion model and the HuBERT
+    audio encoder are loaded once and kept in memory, so `generate` only runs
+    the per-video work instead of reloading every checkpoint.
+    """
+    def __init__(self, stage1_checkpoint_path, stage2_checkpoint_path, infer_type='hubert_audio_only', device='cpu',
+                 hubert_model_path='./ckpts/chinese-hubert-large', motion_dim=20, decoder_layers=2, image_size=256, seed=0,
+                 feature_cache_dir=None, feature_cache_max_bytes=4 * 1024 ** 3, render_batch_size=8, encode_queue_size=4,
+                 fold_styles=True, motion_window=0, motion_window_overlap=25, motion_window_mode='chained',
+                 motion_window_batch=4, collapse_hubert_layers=True,
+                 hubert_weight_mass=1.0):
+        if infer_type not in INFER_TYPES:
+            raise ValueError(f'Type NOT Found: {infer_type}')
+
+        self.infer_type = infer_type
+        self.device = device
+        self.motion_dim = motion_dim
+        self.image_size = image_size
+        self.hubert_model_path = hubert_model_path
+        self.render_batch_size = render_batch_size  # frames per LIA forward pass
+        self.encode_queue_size = encode_queue_size  # rendered chunks waiting for the encoder thread
+        self.fold_styles = fold_styles  # render through the per-avatar folded style map
+        # Clips longer than `motion_window` frames are diffused in overlapping windows (0 disables it),
+        # see sample_motion_windowed
+        if motion_window_mode not in WINDOW_MODES:
+            raise ValueError(f'motion_window_mode must be one of {WINDOW_MODES}')
+        if motion_window and not 0 <= motion_window_overlap < motion_window:
+            raise ValueError('motion_window_overlap must be smaller than motion_window')
+        self.motion_window = motion_window
+        self.motion_window_overlap = motion_window_overlap
+        self.motion_window_mode = motion_window_mode
+        self.motion_window_batch = motion_window_batch
+        # HuBERT features of audio already seen, keyed by the 16 kHz waveform and the hubert weights
+        self.feature_cache = FeatureCache(feature_cache_dir, feature_cache_max_bytes) if feature_cache_dir else None
+
+        #======Loading Stage 1 model=========
+        self.lia = LIA_Model(motion_dim=motion_dim, fusion_type='weighted_sum')
+        self.lia.load_lightning_model(stage1_checkpoint_path)
+        self.lia.to(device)
+        self.lia.eval()
+        self.lia.dec.set_inference(True)
+        #============================
+
+        conf = ffhq256_autoenc()
+        conf.seed = seed
+        conf.decoder_layers = decoder_layers
+        conf.infer_type = infer_type
+        conf.motion_dim = motion_dim
+        conf.face_location, conf.face_scale, conf.mfcc = INFER_TYPES[infer_type]
+        self.conf = conf
+
+        #======Loading Stage 2 model=========
+        self.model = LitModel(conf)
+        state = torch.load(stage2_checkpoint_path, map_location='cpu')
+        self.model.load_state_dict(state, strict=True)
+        self.model.ema_model.eval()
+        self.model.ema_model.to(device)
+        # With collapse_hubert_layers the HuBERT hidden states are blended with the learned HAL
+        # weights while extracting, so one (T, 1024) feature map is kept instead of all 25 layers
+        self.hal_weights = None
+        self.full_hal_weights = None
+        if collapse_hubert_layers and infer_type.startswith('hubert'):
+            with torch.no_grad():
+                self.full_hal_weights = self.model.ema_model.hal_weights().float()
+            self.hal_weights = self.full_hal_weights
+        elif hubert_weight_mass < 1.0:
+            raise ValueError('hubert_weight_mass needs collapse_hubert_layers')
+        #=================================
+
+        #======Loading audio encoder=========
+        self.audio_model = None
+        self.feature_extractor = None
+        self.hubert_encoder_layers = None
+        if infer_type.startswith('hubert'):
+            if os.path.exists(hubert_model_path):
+                self.load_audio_model()
+            else:
+                print('Hubert weight not found, only precomputed hubert features can be used.')
+        if self.full_hal_weights is not None:
+            self.set_hubert_weight_mass(hubert_weight_mass)
+        #=================================
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(args.stage1_checkpoint_path,
+                   args.stage2_checkpoint_path,
+                   infer_type=args.infer_type,
+                   device=args.device,
+                   hubert_model_path=args.hubert_model_path,
+                   motion_dim=args.motion_dim,
+                   decoder_layers=args.decoder_layers,
+                   image_size=args.image_size,
+                   seed=args.seed,
+                   feature_cache_dir=getattr(args, 'hubert_cache_dir', None),
+                   render_batch_size=getattr(args, 'render_batch_size', 8),
+                   encode_queue_size=getattr(args, 'encode_queue_size', 4),
+                   fold_styles=not getattr(args, 'disable_style_folding', False),
+                   motion_window=getattr(args, 'motion_window', 0),
+                   motion_window_overlap=getattr(args, 'motion_window_overlap', 25),
+                   motion_window_mode=getattr(args, 'motion_window_mode', 'chained'),
+                   motion_window_batch=getattr(args, 'motion_window_batch', 4),
+                   collapse_hubert_layers=not getattr(args, 'keep_hubert_layers', False),
+                   hubert_weight_mass=getattr(args, 'hubert_weight_mass', 1.0))
+
+    def load_audio_model(self):
+        from transformers import Wav2Vec2FeatureExtractor, HubertModel
+
+        self.audio_model = HubertModel.from_pretrained(self.hubert_model_path).to(self.device)
+        self.feature_extractor = Wav2Vec2FeatureExtractor.from_pretrained(self.hubert_model_path)
+        self.audio_model.feature_extractor._freeze_parameters()
+        self.audio_model.eval()
+        self.hubert_encoder_layers = self.audio_model.encoder.layers
+
+    def set_hubert_weight_mass(self, mass):
+        """
+        Keep only the leading HuBERT hidden states holding `mass` of the HAL weight and renormalize
+        their weights; HuBERT then stops after the last encoder layer that is still needed.
+        Not to be called while another thread extracts features.
+        """
+        num_states = hal_layers_for_mass(self.full_hal_weights, mass)
+        weights = self.full_hal_weights[:num_states]
+        self.hal_weights = weights / weights.sum()
+        if self.hubert_encoder_layers is not None:
+            # Hidden state i is the input of encoder layer i, so num_states layers are run; the
+            # output of the last one only feeds the final hidden state (layer-normed in the large
+            # model), which is dropped unless every layer is kept
+            self.audio_model.encoder.layers = self.hubert_encoder_layers[:num_states]
+        print(f'Hubert: {num_states} of {self.full_hal_weights.numel()} hidden states, '
+              f'{self.full_hal_weights[:num_states].sum().item():.4f} of the HAL weight')
+
+    @torch.no_grad()
+    def encode_image(self, image_path):
+        img_source = img_preprocessing(image_path, self.image_size).to(self.device)
+        return self.lia.get_start_direction_code_single(img_source)
+
+    def extract_audio_features(self, audio_path, hubert_path=None):
+        """
+        Returns the audio condition tensor and the number of video frames it drives.
+        """
+        if self.conf.infer_type.startswith('mfcc'):
+            # MFCC features
+            wav, sr = librosa.load(audio_path, sr=16000)
+            input_values = python_speech_features.mfcc(signal=wav, samplerate=sr, numcep=13, winlen=0.025, winstep=0.01)
+            d_mfcc_feat = python_speech_features.base.delta(input_values, 1)
+            d_mfcc_feat2 = python_speech_features.base.delta(input_values, 2)
+            audio_driven_obj = np.hstack((input_values, d_mfcc_feat, d_mfcc_feat2))
+            frame_start, frame_end = 0, int(audio_driven_obj.shape[0]/4)
+            audio_start, audio_end = int(frame_start * 4), int(frame_end * 4) # The video frame is fixed to 25 hz and the audio is fixed to 100 hz
+
+            audio_driven = torch.Tensor(audio_driven_obj[audio_start:audio_end,:]).unsqueeze(0).float().to(self.device)
+            return audio_driven, frame_end
+
+        # Hubert features
+        if hubert_path and os.path.exists(hubert_path):
+            print(f'Using audio feature from path: {hubert_path}')
+            audio_driven_obj = np.load(hubert_path)
+            if self.hal_weights is not None and audio_driven_obj.ndim == 3:
+                weights = self.hal_weights.cpu().numpy()
+                audio_driven_obj = np.tensordot(weights, audio_driven_obj[:len(weights)], axes=1)
+        else:
+            audio, sr = librosa.load(audio_path, sr=16000)
+            audio_driven_obj = self.extract_hubert_features(audio)
+
+        # (layers, T, 1024), or (T, 1024) when the layers are already blended
+        frame_start, frame_end = 0, int(audio_driven_obj.shape[-2]/2)
+        audio_start, audio_end = int(frame_start * 2), int(frame_end * 2) # The video frame is fixed to 25 hz and the audio is fixed to 50 hz
+
+        audio_driven = torch.Tensor(audio_driven_obj[...,audio_start:audio_end,:]).unsqueeze(0).float().to(self.device)
+        return audio_driven, frame_end
+
+    def extract_hubert_features(self, audio):
+        """
+        All HuBERT hidden states for a 16 kHz waveform, shaped (layers, T, 1024), or their blend
+        with the HAL weights, shaped (T, 1024), when the engine collapses the layers.
+        Served from the feature cache when the same audio was seen before.
+        """
+        cache_key = None
+        if self.feature_cache is not None:
+            key_parts = [os.path.abspath(self.hubert_model_path), 16000]
+            if self.hal_weights is not None:
+                # blended features depend on the stage2 checkpoint too
+                key_parts += ['hal', self.hal_weights.cpu().numpy().tobytes().hex()]
+            cache_key = FeatureCache.make_key(audio, *key_parts)
+            ws_feat_obj = self.feature_cache.get(cache_key)
+            if ws_feat_obj is not None:
+                print('Using cached audio feature')
+                return ws_feat_obj
+
+        if self.audio_model is None:
+            raise FileNotFoundError('Please download the hubert weight into the ckpts path first.')
+
+        start_time = time.time()
+
+        input_values = self.feature_extractor(audio, sampling_rate=16000, padding=True, do_normalize=True, return_tensors="pt").input_values
+        input_values = input_values.to(self.device)
+        with torch.no_grad():
+            outputs = self.audio_model(input_values, output_hidden_states=True)
+            if self.hal_weights is not None:
+                # blend on the device, only the (T, 1024) result is copied to the host
+                weights = self.hal_weights.tolist()
+                hidden_states = outputs.hidden_states[:len(weights)]
+                weighted = hidden_states[0][0].float() * weights[0]
+                for weight, hidden_state in zip(weights[1:], hidden_states[1:]):
+                    weighted.add_(hidden_state[0].float(), alpha=weight)
+                ws_feat_obj = np.pad(weighted.cpu().numpy(), ((0, 1), (0, 0)), 'edge') # align the audio length with video frame
+            else:
+                ws_feats = []
+                for i in range(len(outputs.hidden_states)):
+                    ws_feats.append(outputs.hidden_states[i].detach().cpu().numpy())
+                ws_feat_obj = np.array(ws_feats)
+                ws_feat_obj = np.squeeze(ws_feat_obj, 1)
+                ws_feat_obj = np.pad(ws_feat_obj, ((0, 0), (0, 1), (0, 0)), 'edge') # align the audio length with video frame
+
+        execution_time = time.time() - start_time
+        print(f"Extraction Audio Feature: {execution_time:.2f} Seconds")
+
+        if cache_key is not None:
+            self.feature_cache.put(cache_key, ws_feat_obj)
+        return ws_feat_obj
+
+    def make_control_signals(self, frame_end, pose_yaw=0.25, pose_pitch=0, pose_roll=0, face_location=0.5, face_scale=0.5,
+                             pose_driven_path=None):
+        if pose_driven_path and os.path.exists(pose_driven_path):
+            pose_obj = np.load(pose_driven_path)
+
+            if len(pose_obj.shape) != 2 or pose_obj.shape[1] != 3:
+                raise ValueError('please check your pose information. The shape must be like (T, 3).')
+
+            if pose_obj.shape[0] >= frame_end:
+                pose_obj = pose_obj[:frame_end,:]
+            else:
+                padding = np.tile(pose_obj[-1, :], (frame_end - pose_obj.shape[0], 1))
+                pose_obj = np.vstack((pose_obj, padding))
+
+            pose_signal = torch.Tensor(pose_obj).unsqueeze(0).to(self.device)/ 90 # 90 is for normalization here
+        else:
+            yaw_signal = torch.zeros(1, frame_end, 1).to(self.device) + pose_yaw
+            pitch_signal = torch.zeros(1, frame_end, 1).to(self.device) + pose_pitch
+            roll_signal = torch.zeros(1, frame_end, 1).to(self.device) + pose_roll
+            pose_signal = torch.cat((yaw_signal, pitch_signal, roll_signal), dim=-1)
+
+        pose_signal = torch.clamp(pose_signal, -1, 1)
+
+        face_location_signal = torch.zeros(1, frame_end, 1).to(self.device) + face_location
+        face_scale_signal = torch.zeros(1, frame_end, 1).to(self.device) + face_scale
+        return face_location_signal, face_scale_signal, pose_signal
+
+    def make_noise(self, seeds, frame_end):
+        # One noise per seed, each drawn exactly as a single-sample run with that seed draws it
+        noise = [torch.randn((1, frame_end, self.motion_dim), generator=torch.Generator().manual_seed(seed))
+                 for seed in seeds]
+        return torch.cat(noise).to(self.device)
+
+    @torch.no_grad()
+    def sample_motion(self, start, direction, audio_driven, frame_end, seeds=(0,), controls=None, step_T=50,
+                      control_flag=False, sampler=None, callback=None):
+        """
+        Denoise one motion trajectory per seed / control set as a single batch and return
+        them as an N x frame_end x motion_dim tensor.
+
+        `controls` is a list of `make_control_signals` keyword arguments. A single seed or a
+        single control set is shared by all the samples; the audio condition is always encoded
+        once and broadcast over the batch.
+        """
+        seeds = list(seeds)
+        controls = list(controls) if controls else [{}]
+        num_samples = max(len(seeds), len(controls))
+        if len(seeds) == 1:
+            seeds = seeds * num_samples
+        if len(controls) == 1:
+            controls = controls * num_samples
+        if len(seeds) != num_samples or len(controls) != num_samples:
+            raise ValueError(f'Got {len(seeds)} seeds for {len(controls)} control sets')
+
+        if self.motion_window and frame_end > self.motion_window:
+            motions = [self.sample_motion_windowed(start, direction, audio_driven, frame_end, seed=seed, controls=control,
+                                                   step_T=step_T, control_flag=control_flag, sampler=sampler,
+                                                   callback=callback)
+                       for seed, control in zip(seeds, controls)]
+            return torch.stack(motions)
+
+        noisyT = self.make_noise(seeds, frame_end)
+
+        if all(control == controls[0] for control in controls):
+            face_location_signal, face_scale_signal, pose_signal = self.make_control_signals(frame_end, **controls[0])
+        else:
+            signals = [self.make_control_signals(frame_end, **control) for control in controls]
+            face_location_signal, face_scale_signal, pose_signal = (torch.cat(signal) for signal in zip(*signals))
+
+        return self.model.render(start, direction, audio_driven, face_location_signal, face_scale_signal, pose_signal,
+                                 noisyT, step_T, control_flag=control_flag, gen_type=sampler, callback=callback)
+
+    @torch.no_grad()
+    def sample_motion_windowed(self, start, direction, audio_driven, frame_end, seed=0, controls=None, step_T=50,
+                               control_flag=False, sampler=None, callback=None):
+        """
+        `sample_motion` for one take of a long clip, diffused in windows of `motion_window` frames
+        overlapping by `motion_window_overlap` frames, so the conformers' quadratic memory is
+        bounded by the window instead of the clip. Returns frame_end x motion_dim.
+
+        The noise and control signals are drawn for the whole clip and sliced, so overlapping
+        windows see the same noise. Consecutive windows are crossfaded over their overlap.
+        In 'chained' mode each window starts from the motion code the previous window produced
+        at its first frame (as `motion_direction_start`), so windows run one after the other.
+        In 'parallel' mode every window starts from the portrait's own motion code and up to
+        `motion_window_batch` windows are denoised together as one batch.
+        """
+        window = self.motion_window
+        starts = window_starts(frame_end, window, self.motion_window_overlap)
+        audio_per_frame = audio_driven.size(-2) // frame_end  # 2 for hubert (50 Hz), 4 for mfcc (100 Hz)
+
+        noisyT = self.make_noise([seed], frame_end)
+        signals = self.make_control_signals(frame_end, **(controls or {}))
+
+        def window_inputs(window_start):
+            frames = slice(window_start, window_start + window)
+            audio = audio_driven[..., window_start * audio_per_frame:(window_start + window) * audio_per_frame, :]
+            return audio, [signal[:, frames] for signal in signals], noisyT[:, frames]
+
+        def window_callback(done, runs):
+            # progress over all the `runs` denoising runs, of which `done` have finished
+            if callback is None:
+                return None
+            return lambda step, total: callback(done * total + step, runs * total)
+
+        motion = torch.zeros(frame_end, self.motion_dim, device=self.device)
+        end = 0
+        if self.motion_window_mode == 'chained':
+            for i, window_start in enumerate(starts):
+                window_direction = direction if i == 0 else motion[window_start:window_start + 1].to(direction.dtype)
+                audio, window_signals, noise = window_inputs(window_start)
+                window_motion = self.model.render(start, window_direction, audio, *window_signals, noise, step_T,
+                                                  control_flag=control_flag, gen_type=sampler,
+                                                  callback=window_callback(i, len(starts)))
+                end = crossfade_into(motion, window_motion[0].float(), window_start, end)
+        else:
+            batch = max(self.motion_window_batch, 1)
+            num_batches = -(-len(starts) // batch)
+            for i in range(0, len(starts), batch):
+                inputs = [window_inputs(window_start) for window_start in starts[i:i + batch]]
+                audio = torch.cat([audio for audio, _, _ in inputs])
+                window_signals = [torch.cat(signal) for signal in zip(*[signals for _, signals, _ in inputs])]
+                noise = torch.cat([noise for _, _, noise in inputs])
+                window_motions = self.model.render(start, direction, audio, *window_signals, noise, step_T,
+                                                   control_flag=control_flag, gen_type=sampler,
+                                                   callback=window_callback(i // batch, num_batches))
+                for window_start, window_motion in zip(starts[i:i + batch], window_motions):
+                    end = crossfade_into(motion, window_motion.float(), window_start, end)
+        return motion
+
+    @torch.no_grad()
+    def render_video(self, start, feats, directions, audio, output_path, report=None):
+        """Render the motion codes `directions` (T x motion_dim) of one source into `output_path`, muxed with `audio`."""
+        if report is None:
+            report = lambda stage, step=0, total=0: None
+
+        start_time = time.time()
+        #======Rendering and encoding in batches of frames=========
+        # Frames go straight from the renderer into ffmpeg, which muxes the audio in the same pass.
+        # The pipe writes run on the writer's thread, so rendering and x264 encoding overlap.
+        num_frames = directions.shape[0]
+        directions = torch.as_tensor(directions, dtype=torch.float32).to(self.device)
+        styles = self.lia.precompute_styles(start) if self.fold_styles else None
+        pred_index = 0
+        with PipelinedVideoWriter(output_path, self.image_size, self.image_size, fps=25, audio_path=audio,
+                                  queue_size=self.encode_queue_size) as writer, tqdm(total=num_frames) as pbar:
+            chunk_start = time.time()
+            for ori_img_recon in self.lia.render_batch(start, directions, feats, batch_size=self.render_batch_size,
+                                                       styles=styles):
+                ori_img_recon = ori_img_recon.clamp(-1, 1)
+                wav_pred = (ori_img_recon.detach() + 1) / 2
+                frames = to_uint8_frames(wav_pred)
+                writer.add_render_time(len(frames), time.time() - chunk_start)
+                writer.write(frames)
+                pred_index += len(frames)
+                pbar.update(len(frames))
+                report('render', pred_index, num_frames)
+                chunk_start = time.time()
+            report('encode')
+        #==========================================================
+
+        execution_time = time.time() - start_time
+        print(f"Renderer Model: {execution_time:.2f} Seconds")
+        for stage in writer.stats.values():
+            print(stage)
+
+        return output_path
+
+    def _prepare_inputs(self, image, audio, hubert_path, profile, report):
+        if not os.path.exists(image):
+            raise FileNotFoundError(f'{image} does not exist!')
+        if not os.path.exists(audio):
+            raise FileNotFoundError(f'{audio} does not exist!')
+
+        if profile is not None:
+            profile = profile.to(self.device)
+            one_shot_lia_start, one_shot_lia_direction, feats = profile.start, profile.direction, profile.feats
+        else:
+            one_shot_lia_start, one_shot_lia_direction, feats = self.encode_image(image)
+        report('audio')
+        audio_driven, frame_end = self.extract_audio_features(audio, hubert_path)
+        return one_shot_lia_start, one_shot_lia_direction, feats, audio_driven, frame_end
+
+    @torch.no_grad()
+    def generate(self, image, audio, output_path, hubert_path=None, seed=0, step_T=50, control_flag=False,
+                 pose_yaw=0.25, pose_pitch=0, pose_roll=0, face_location=0.5, face_scale=0.5, pose_driven_path=None,
+                 progress_callback=None, profile=None, sampler=None):
+        """
+        Render a talking-head video for the portrait `image` driven by `audio` and write it to `output_path`.
+        The remaining keyword arguments are the attribute controls of `get_arg_parser`.
+
+        If `profile` (an `avatar_store.AvatarProfile` of `image`) is given, its stored
+        encoding is used instead of running the encoder again.
+
+        `sampler` is a GenerativeType value ('ddim', 'dpmsolver++', ...) overriding the
+        configured one; 'dpmsolver++' gives comparable motion in far fewer steps (8-15).
+
+        `progress_callback(stage, step, total)` is called as the 'audio', 'diffusion', 'render'
+        and 'encode' stages advance.
+        """
+        controls = dict(pose_yaw=pose_yaw, pose_pitch=pose_pitch, pose_roll=pose_roll, face_location=face_location,
+                        face_scale=face_scale, pose_driven_path=pose_driven_path)
+        _, paths = self.generate_batch(image, audio, [output_path], hubert_path=hubert_path, seeds=[seed],
+                                       controls=[controls], step_T=step_T, control_flag=control_flag,
+                                       progress_callback=progress_callback, profile=profile, sampler=sampler)
+        return paths[0]
+
+    @torch.no_grad()
+    def generate_batch(self, image, audio, output_paths=None, hubert_path=None, seeds=(0,), controls=None, step_T=50,
+                       control_flag=False, progress_callback=None, profile=None, sampler=None):
+        """
+        Several takes of the same portrait and audio: one per seed and / or per control set
+        (see `sample_motion`), denoised together as one batch.
+
+        Returns the N x frame_end x motion_dim motion trajectories (numpy) and, if `output_paths`
+        (one per take) is given, renders every take and returns the video paths, else None.
+        """
+        def report(stage, step=0, total=0):
+            if progress_callback is not None:
+                progress_callback(stage, step, total)
+
+        one_shot_lia_start, one_shot_lia_direction, feats, audio_driven, frame_end = self._prepare_inputs(
+            image, audio, hubert_path, profile, report)
+
+        start_time = time.time()
+
+        #======Diffusion Denosing Process=========
+        generated_directions = self.sample_motion(one_shot_lia_start, one_shot_lia_direction, audio_driven, frame_end,
+                                                  seeds=seeds, controls=controls, step_T=step_T,
+                                                  control_flag=control_flag, sampler=sampler,
+                                                  callback=lambda step, total: report('diffusion', step, total))
+        #=========================================
+
+        execution_time = time.time() - start_time
+        print(f"Motion Diffusion Model: {execution_time:.2f} Seconds")
+
+        generated_directions = generated_directions.detach().float().cpu().numpy()
+
+        if output_paths is None:
+            return generated_directions, None
+        if len(output_paths) != len(generated_directions):
+            raise ValueError(f'Got {len(output_paths)} output paths for {len(generated_directions)} takes')
+
+        paths = [self.render_video(one_shot_lia_start, feats, directions, audio, output_path, report)
+                 for directions, output_path in zip(generated_directions, output_paths)]
+        return generated_directions, paths
@@ -0,0 +1,94 @@
+import argparse
+import sys
+import time
+
+import librosa
+import torch
+
+from engine import AvatarEngine, hal_layers_for_mass
+from eval_sampler import sample_motion, trajectory_errors
+
+# Reports the learned HAL weights (softmax over the 25 HuBERT hidden states) of a stage2 checkpoint
+# and, given a portrait and an audio, what truncating HuBERT at a weight-mass threshold costs:
+# the blended feature error, the HuBERT time and the deviation of the motion trajectory (mouth and
+# head movement) from the one driven by the full model, on the same seed and sampler.
+#
+#   python eval_hubert_truncation.py --stage2_checkpoint_path ./ckpts/stage2_audio_only_hubert.ckpt
+#   python eval_hubert_truncation.py --stage2_checkpoint_path ./ckpts/stage2_audio_only_hubert.ckpt \
+#       --test_image_path ../test_demos/portraits/monalisa.jpg --test_audio_path ../test_demos/audios/english_female.wav \
+#       --masses 0.9 0.95 0.99
+#
+# Reported per threshold:
+#   states    hidden states kept (the embedding output plus one per encoder layer)
+#   feat_rel  relative L2 error of the blended (T x 1024) feature
+#   rmse, vel_rmse, vel_cos  as in eval_sampler.py, against the motion of the full model
+#   seconds   wall time of the HuBERT forward
+
+
+def load_hal_weights(stage2_checkpoint_path):
+    state = torch.load(stage2_checkpoint_path, map_location='cpu')
+    weights = state['ema_model.weights'] if 'ema_model.weights' in state else state['model.weights']
+    return torch.softmax(weights.float(), dim=-1)
+
+
+def extract_features(engine, audio):
+    start_time = time.time()
+    features = torch.from_numpy(engine.extract_hubert_features(audio))
+    return features, time.time() - start_time
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--infer_type', type=str, default='hubert_audio_only', help='Type of inference')
+    parser.add_argument('--test_image_path', type=str, default='', help='Path to the portrait (weights only if empty)')
+    parser.add_argument('--test_audio_path', type=str, default='', help='Path to the driven audio (weights only if empty)')
+    parser.add_argument('--stage1_checkpoint_path', type=str, default='./ckpts/stage1.ckpt', help='Path to the checkpoint of Stage1')
+    parser.add_argument('--stage2_checkpoint_path', type=str, default='./ckpts/stage2_audio_only_hubert.ckpt', help='Path to the checkpoint of Stage2')
+    parser.add_argument('--hubert_model_path', type=str, default='./ckpts/chinese-hubert-large', help='Path to the hubert weight')
+    parser.add_argument('--masses', type=float, nargs='+', default=[0.8, 0.9, 0.95, 0.98, 0.99], help='Weight-mass thresholds to compare')
+    parser.add_argument('--sampler', type=str, default='ddim', choices=['ddpm', 'ddim', 'dpmsolver++'], help='Sampler of the motion diffusion')
+    parser.add_argument('--step_T', type=int, default=50, help='Diffusion steps')
+    parser.add_argument('--seed', type=int, default=0, help='Noise seed, shared by every run')
+    parser.add_argument('--device', type=str, default='cuda:0' if torch.cuda.is_available() else 'cpu', help='Device for computation')
+    parser.add_argument('--motion_dim', type=int, default=20, help='Dimension of motion. Do not change.')
+    parser.add_argument('--decoder_layers', type=int, default=2, help='Layer number for the conformer.')
+    parser.add_argument('--image_size', type=int, default=256, help='Size of the image. Do not change.')
+    args = parser.parse_args()
+
+    weights = load_hal_weights(args.stage2_checkpoint_path)
+    cumulative = torch.cumsum(weights, dim=0)
+    print(f'{"state":>5s} {"weight":>8s} {"cumulative":>10s}')
+    for i, (weight, total) in enumerate(zip(weights.tolist(), cumulative.tolist())):
+        print(f'{i:5d} {weight:8.4f} {total:10.4f}')
+    print()
+    for mass in args.masses:
+        print(f'mass {mass:.3f}: {hal_layers_for_mass(weights, mass)} of {weights.numel()} hidden states')
+
+    if not (args.test_image_path and args.test_audio_path):
+        sys.exit(0)
+
+    print()
+    engine = AvatarEngine(args.stage1_checkpoint_path, args.stage2_checkpoint_path, infer_type=args.infer_type,
+                          device=args.device, hubert_model_path=args.hubert_model_path, motion_dim=args.motion_dim,
+                          decoder_layers=args.decoder_layers, image_size=args.image_size)
+    start, direction, _ = engine.encode_image(args.test_image_path)
+    audio, _ = librosa.load(args.test_audio_path, sr=16000)
+
+    def motion_inputs(features):
+        frame_end = features.size(0) // 2
+        audio_driven = features[:frame_end * 2].unsqueeze(0).float().to(engine.device)
+        return start, direction, audio_driven, frame_end, engine.make_control_signals(frame_end)
+
+    reference, reference_seconds = extract_features(engine, audio)
+    reference_motion, _ = sample_motion(engine, motion_inputs(reference), args.seed, args.step_T, args.sampler)
+    print(f'reference: {weights.numel()} hidden states, hubert {reference_seconds:.2f} s')
+
+    print(f'{"mass":>6s} {"states":>6s} {"feat_rel":>9s} {"rmse":>9s} {"vel_rmse":>9s} {"vel_cos":>8s} {"seconds":>8s}')
+    for mass in args.masses:
+        engine.set_hubert_weight_mass(mass)
+        features, seconds = extract_features(engine, audio)
+        feat_rel = ((features - reference).norm() / reference.norm()).item()
+        motion, _ = sample_motion(engine, motion_inputs(features), args.seed, args.step_T, args.sampler)
+        errors = trajectory_errors(reference_motion, motion)
+        print(f'{mass:6.3f} {engine.hal_weights.numel():6d} {feat_rel:9.4f} {errors["rmse"]:9.4f} '
+              f'{errors["vel_rmse"]:9.4f} {errors["vel_cos"]:8.4f} {seconds:8.2f}')
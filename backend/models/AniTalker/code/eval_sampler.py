@@ -0,0 +1,87 @@
+import argparse
+import time
+
+import torch
+
+from engine import AvatarEngine
+
+# Compares the motion trajectories of few-step samplers against 50-step DDIM on fixed seeds.
+# For every seed, all samplers start from the same noise, so the difference is only the solver.
+#
+#   python eval_sampler.py --infer_type hubert_audio_only --stage2_checkpoint_path ./ckpts/stage2_audio_only_hubert.ckpt \
+#       --test_image_path ../test_demos/portraits/monalisa.jpg --test_audio_path ../test_demos/audios/english_female.wav \
+#       --samplers ddim dpmsolver++ --steps 8 10 12 15 --seeds 0 1 2
+#
+# Reported per configuration, averaged over the seeds:
+#   rmse      root mean square error of the motion codes (T x motion_dim) against the reference
+#   vel_rmse  the same for the frame-to-frame motion (what the mouth and head movement look like)
+#   vel_cos   cosine similarity of the frame-to-frame motion, 1 is identical timing
+#   seconds   wall time of the diffusion alone
+
+
+@torch.no_grad()
+def sample_motion(engine, inputs, seed, step_T, sampler):
+    start, direction, audio_driven, frame_end, controls = inputs
+    generator = torch.Generator().manual_seed(seed)
+    noisyT = torch.randn((1, frame_end, engine.motion_dim), generator=generator).to(engine.device)
+    start_time = time.time()
+    directions = engine.model.render(start, direction, audio_driven, *controls, noisyT, step_T, control_flag=False,
+                                     gen_type=sampler)
+    return directions[0].float().cpu(), time.time() - start_time
+
+
+def trajectory_errors(ref, out):
+    ref_vel, out_vel = ref[1:] - ref[:-1], out[1:] - out[:-1]
+    return {
+        'rmse': (ref - out).pow(2).mean().sqrt().item(),
+        'vel_rmse': (ref_vel - out_vel).pow(2).mean().sqrt().item(),
+        'vel_cos': torch.nn.functional.cosine_similarity(ref_vel.flatten(), out_vel.flatten(), dim=0).item(),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--infer_type', type=str, default='hubert_audio_only', help='Type of inference')
+    parser.add_argument('--test_image_path', type=str, required=True, help='Path to the portrait')
+    parser.add_argument('--test_audio_path', type=str, required=True, help='Path to the driven audio')
+    parser.add_argument('--test_hubert_path', type=str, default='', help='Path to precomputed hubert features (optional)')
+    parser.add_argument('--stage1_checkpoint_path', type=str, default='./ckpts/stage1.ckpt', help='Path to the checkpoint of Stage1')
+    parser.add_argument('--stage2_checkpoint_path', type=str, default='./ckpts/stage2_audio_only_hubert.ckpt', help='Path to the checkpoint of Stage2')
+    parser.add_argument('--hubert_model_path', type=str, default='./ckpts/chinese-hubert-large', help='Path to the hubert weight. Not needed for MFCC')
+    parser.add_argument('--reference_steps', type=int, default=50, help='Steps of the DDIM reference')
+    parser.add_argument('--samplers', type=str, nargs='+', default=['ddim', 'dpmsolver++'], help='Samplers to compare')
+    parser.add_argument('--steps', type=int, nargs='+', default=[8, 10, 12, 15, 20], help='Step counts to compare')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0, 1, 2], help='Noise seeds')
+    parser.add_argument('--device', type=str, default='cuda:0' if torch.cuda.is_available() else 'cpu', help='Device for computation')
+    parser.add_argument('--motion_dim', type=int, default=20, help='Dimension of motion. Do not change.')
+    parser.add_argument('--decoder_layers', type=int, default=2, help='Layer number for the conformer.')
+    parser.add_argument('--image_size', type=int, default=256, help='Size of the image. Do not change.')
+    args = parser.parse_args()
+
+    engine = AvatarEngine(args.stage1_checkpoint_path, args.stage2_checkpoint_path, infer_type=args.infer_type,
+                          device=args.device, hubert_model_path=args.hubert_model_path, motion_dim=args.motion_dim,
+                          decoder_layers=args.decoder_layers, image_size=args.image_size)
+
+    start, direction, _ = engine.encode_image(args.test_image_path)
+    audio_driven, frame_end = engine.extract_audio_features(args.test_audio_path, args.test_hubert_path or None)
+    inputs = (start, direction, audio_driven, frame_end, engine.make_control_signals(frame_end))
+
+    references = {}
+    reference_seconds = 0.0
+    for seed in args.seeds:
+        references[seed], seconds = sample_motion(engine, inputs, seed, args.reference_steps, 'ddim')
+        reference_seconds += seconds / len(args.seeds)
+    print(f'reference: ddim {args.reference_steps} steps, {frame_end} frames, {reference_seconds:.2f} s')
+
+    print(f'{"sampler":12s} {"steps":>5s} {"rmse":>9s} {"vel_rmse":>9s} {"vel_cos":>8s} {"seconds":>8s}')
+    for sampler in args.samplers:
+        for step_T in args.steps:
+            totals = {'rmse': 0.0, 'vel_rmse': 0.0, 'vel_cos': 0.0, 'seconds': 0.0}
+            for seed in args.seeds:
+                out, seconds = sample_motion(engine, inputs, seed, step_T, sampler)
+                errors = trajectory_errors(references[seed], out)
+                errors['seconds'] = seconds
+                for key in totals:
+                    totals[key] += errors[key] / len(args.seeds)
+            print(f'{sampler:12s} {step_T:5d} {totals["rmse"]:9.4f} {totals["vel_rmse"]:9.4f} '
+                  f'{totals["vel_cos"]:8.4f} {totals["seconds"]:8.2f}')
@@ -35,6 +35,7 @@ class LitModel(pl.LightningModule):
 
         self.sampler = conf.make_diffusion_conf().make_sampler()
         self.eval_sampler = conf.make_eval_diffusion_conf().make_sampler()
+        self.samplers = {}  # (step_T, gen_type, device) -> sampler, see get_sampler
 
         # this is shared for both model and latent
         self.T_sampler = conf.make_T_sampler()
@@ -54,15 +55,31 @@ class LitModel(pl.LightningModule):
             torch.randn(conf.sample_size, 3, conf.img_size, conf.img_size))
 
 
-    def render(self, start, motion_direction_start, audio_driven, face_location, face_scale, ypr_info, noisyT, step_T, control_flag):
-        if step_T is None:
+    def get_sampler(self, step_T, device, gen_type=None):
+        # Samplers are memoized by (step_T, gen_type, device): building one re-spaces the timesteps
+        # and recomputes the whole schedule, and its coefficients are then kept on the device.
+        gen_type = GenerativeType(gen_type) if gen_type is not None else self.conf.beatgans_gen_type
+        key = (step_T, gen_type, torch.device(device))
+        sampler = self.samplers.get(key)
+        if sampler is None:
+            sampler = self.conf._make_diffusion_conf(step_T, gen_type=gen_type).make_sampler()
+            sampler.schedule_on(device)
+            self.samplers[key] = sampler
+        return sampler
+
+    def render(self, start, motion_direction_start, audio_driven, face_location, face_scale, ypr_info, noisyT, step_T, control_flag, callback=None,
+               gen_type=None):
+        # noisyT may hold N samples (e.g. N seeds): the control signals then have batch 1 (shared) or N,
+        # and the audio condition is encoded once for the whole batch
+        if step_T is None and gen_type is None:
             sampler = self.eval_sampler
         else:
-            sampler = self.conf._make_diffusion_conf(step_T).make_sampler()
+            sampler = self.get_sampler(step_T if step_T is not None else self.conf.T_eval, noisyT.device, gen_type)
 
         pred_img = render_condition(self.conf,
                                         self.ema_model,
-                                        sampler, start, motion_direction_start, audio_driven, face_location, face_scale, ypr_info, noisyT, control_flag)
+                                        sampler, start, motion_direction_start, audio_driven, face_location, face_scale, ypr_info, noisyT, control_flag,
+                                        callback=callback)
         return pred_img
 
     def forward(self, noise=None, x_start=None, ema_model: bool = False):
@@ -0,0 +1,77 @@
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+
+class FeatureCache:
+    """
+    Size-bounded on-disk cache of audio features.
+
+    Entries are plain `.npy` files named after their key and are opened with
+    `mmap_mode='r'`, so a hit costs a page-in rather than a full read. The least
+    recently used files (by mtime, refreshed on every hit) are evicted once the
+    directory grows past `max_bytes`.
+    """
+    def __init__(self, root, max_bytes=4 * 1024 ** 3):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def make_key(wav, *parts):
+        """Hash of the waveform samples plus any extra identifying strings (model path, sample rate...)."""
+        h = hashlib.sha256()
+        for part in parts:
+            h.update(str(part).encode())
+            h.update(b'\0')
+        h.update(np.ascontiguousarray(wav, dtype=np.float32).tobytes())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, f'{key}.npy')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            feats = np.load(path, mmap_mode='r')
+        except (FileNotFoundError, ValueError):
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            pass  # evicted by another request in between, the mapping stays valid
+        return feats
+
+    def put(self, key, feats):
+        path = self._path(key)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, feats)
+        os.replace(tmp_path, path)
+        self.evict()
+        return path
+
+    def evict(self):
+        with self.lock:
+            entries = []
+            for name in os.listdir(self.root):
+                if not name.endswith('.npy'):
+                    continue
+                try:
+                    st = os.stat(os.path.join(self.root, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, name))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.root, name))
+                except FileNotFoundError:
+                    pass
+                total -= size
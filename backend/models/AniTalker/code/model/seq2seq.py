@@ -15,6 +15,12 @@ class LSTM(nn.Module):
         x, _ = self.lstm(x)
         return self.fc(x)
 
+def broadcast_batch(x, batch):
+    # Expand a batch-1 tensor to `batch` as a view, without copying
+    if x.size(0) == 1 and batch > 1:
+        return x.expand(batch, *x.shape[1:])
+    return x
+
 class DiffusionPredictor(BaseModule):
     def __init__(self, conf):
         super(DiffusionPredictor, self).__init__()
@@ -73,24 +79,58 @@ class DiffusionPredictor(BaseModule):
         self.out_proj = nn.Linear(decoder_dim, conf.motion_dim)
 
     
-    def forward(self, initial_code, direction_code, seq_input_vector, face_location, face_scale, yaw_pitch_roll, noisy_x, t_emb, control_flag=False):
-        
+    def forward(self, initial_code, direction_code, seq_input_vector, face_location, face_scale, yaw_pitch_roll, noisy_x, t_emb, control_flag=False, condition=None):
+        # `condition` (from encode_condition) can be passed in to skip re-encoding the same inputs on every denoising step
+        if condition is None:
+            condition = self.encode_condition(initial_code, direction_code, seq_input_vector, face_location, face_scale, yaw_pitch_roll, control_flag)
+        outputs = self.denoise(condition, noisy_x, t_emb)
+        return outputs, condition['predicted_location'], condition['predicted_scale'], condition['predicted_pose']
+
+    def hal_weights(self):
+        """Softmax weights blending the HuBERT hidden layers (HAL_layers,) into one speech feature."""
+        return F.softmax(self.weights, dim=-1)
+
+    def encode_condition(self, initial_code, direction_code, seq_input_vector, face_location, face_scale, yaw_pitch_roll, control_flag=False):
+        """
+        Everything that depends only on the reference image and the audio / control signals,
+        not on the noisy motion or the timestep: the speech features with the variance
+        adapters applied and the projected initial / direction codes.
+        """
         if self.infer_type.startswith('mfcc'):
             x = self.mfcc_speech_downsample(seq_input_vector)
         elif self.infer_type.startswith('hubert'):
-            norm_weights = F.softmax(self.weights, dim=-1)
-            weighted_feature = (norm_weights.unsqueeze(0).unsqueeze(-1).unsqueeze(-1) * seq_input_vector).sum(dim=1)
+            if seq_input_vector.dim() == 3:
+                # (B, T, 1024): the layers were already blended at extraction, see hal_weights
+                weighted_feature = seq_input_vector
+            else:
+                norm_weights = self.hal_weights()
+                weighted_feature = (norm_weights.unsqueeze(0).unsqueeze(-1).unsqueeze(-1) * seq_input_vector).sum(dim=1)
             # print(f"norm_weights shape: {norm_weights.shape}")
             # print(f"seq_input_vector shape: {seq_input_vector.shape}")
             x = self.down_sample1(weighted_feature.transpose(1,2)).transpose(1,2)
             x, _ = self.speech_encoder(x, masks=None)
         predicted_location, predicted_scale, predicted_pose = face_location, face_scale, yaw_pitch_roll
         if self.infer_type != 'hubert_audio_only':
+            # One audio with N control sets: the speech is encoded once and shared by every set
+            # (copied, since the variance adapters run LSTMs over it)
+            x = broadcast_batch(x, yaw_pitch_roll.size(0)).contiguous()
             print(f'pose controllable. control_flag: {control_flag}')
             x, predicted_location, predicted_scale, predicted_pose = self.adjust_features(x, face_location, face_scale, yaw_pitch_roll, control_flag)
-        concatenated_features = self.combine_features(x, initial_code, direction_code, noisy_x, t_emb) # initial_code and direction_code serve as a motion guide extracted from the reference image. This aims to tell the model what the starting motion should be.
-        outputs = self.decode_features(concatenated_features)
-        return outputs, predicted_location, predicted_scale, predicted_pose
+        # initial_code and direction_code serve as a motion guide extracted from the reference image. This aims to tell the model what the starting motion should be.
+        init_code_proj = self.init_code_proj(initial_code).unsqueeze(1).repeat(1, x.size(1), 1)
+        direction_code_feature = self.encoder_direction_code(direction_code).unsqueeze(1).repeat(1, x.size(1), 1)
+        return {
+            'speech': x,
+            'direction_code_feature': direction_code_feature,
+            'init_code_proj': init_code_proj,
+            'predicted_location': predicted_location,
+            'predicted_scale': predicted_scale,
+            'predicted_pose': predicted_pose,
+        }
+
+    def denoise(self, condition, noisy_x, t_emb):
+        concatenated_features = self.combine_features(condition, noisy_x, t_emb)
+        return self.decode_features(concatenated_features)
 
     def mfcc_speech_downsample(self, seq_input_vector):
         x = self.down_sample1(seq_input_vector.transpose(1,2))
@@ -131,12 +171,14 @@ class DiffusionPredictor(BaseModule):
             predicted_pose = self.pose_predictor(x)
         return self.pose_encoder(predicted_pose), predicted_pose
 
-    def combine_features(self, x, initial_code, direction_code, noisy_x, t_emb):
-        init_code_proj = self.init_code_proj(initial_code).unsqueeze(1).repeat(1, x.size(1), 1)
+    def combine_features(self, condition, noisy_x, t_emb):
+        # A condition of batch 1 is shared by a batch of N noisy samples (e.g. N seeds)
+        batch = noisy_x.size(0)
+        x = broadcast_batch(condition['speech'], batch)
         noisy_feature = self.noisy_encoder(noisy_x)
         t_emb_feature = self.t_encoder(t_emb.unsqueeze(1).float()).unsqueeze(1).repeat(1, x.size(1), 1)
-        direction_code_feature = self.encoder_direction_code(direction_code).unsqueeze(1).repeat(1, x.size(1), 1)
-        return torch.cat((x, direction_code_feature, init_code_proj, noisy_feature, t_emb_feature), dim=-1)
+        return torch.cat((x, broadcast_batch(condition['direction_code_feature'], batch),
+                          broadcast_batch(condition['init_code_proj'], batch), noisy_feature, t_emb_feature), dim=-1)
 
     def decode_features(self, concatenated_features):
         outputs, _ = self.coarse_decoder(concatenated_features, masks=None)
@@ -43,6 +43,50 @@ def upfirdn2d(input, kernel, up=1, down=1, pad=(0, 0)):
     return upfirdn2d_native(input, kernel, up, up, down, down, pad[0], pad[1], pad[0], pad[1])
 
 
+def separable_factors(kernel):
+    """Column and row 1D factors of a rank-1 2D FIR kernel (what make_kernel builds from a 1D kernel), else None."""
+    col = kernel.sum(1)
+    row = kernel.sum(0) / kernel.sum()
+    if kernel.shape[0] != kernel.shape[1] or not torch.allclose(col[:, None] * row[None, :], kernel, atol=1e-7):
+        return None
+    return col, row
+
+
+def upfirdn2d_depthwise(input, kernel_col, kernel_row, up=1, down=1, pad=(0, 0)):
+    """
+    `upfirdn2d(input, kernel_col[:, None] * kernel_row[None, :], up, down, pad)` as two depthwise
+    1D convolutions instead of one single-channel 2D convolution over batch * channel images.
+    Upsampling is fused into strided `conv_transpose2d`, so the inserted zeros are never multiplied.
+    """
+    channel = input.size(1)
+    kernel_size = kernel_col.numel()
+    pad0, pad1 = pad
+    col = kernel_col.to(input.dtype).view(1, 1, kernel_size, 1).expand(channel, 1, kernel_size, 1)
+    row = kernel_row.to(input.dtype).view(1, 1, 1, kernel_size).expand(channel, 1, 1, kernel_size)
+
+    if up > 1:
+        # conv_transpose2d(x, k, stride=up, padding=P) is zero insertion followed by the flipped-kernel
+        # correlation of upfirdn2d, shifted by P = kernel_size - 1 - pad0; the crop only matches for this pad1
+        padding = kernel_size - 1 - pad0
+        if down != 1 or padding < 0 or pad1 != pad0 - up + 1:
+            return upfirdn2d(input, kernel_col[:, None] * kernel_row[None, :], up=up, down=down, pad=pad)
+        out = F.conv_transpose2d(input, col, stride=(up, 1), padding=(padding, 0), groups=channel)
+        return F.conv_transpose2d(out, row, stride=(1, up), padding=(0, padding), groups=channel)
+
+    out = F.pad(input, [pad0, pad1, pad0, pad1])
+    out = F.conv2d(out, col.flip(2), stride=(down, 1), groups=channel)
+    return F.conv2d(out, row.flip(3), stride=(1, down), groups=channel)
+
+
+def register_separable_kernel(module, kernel):
+    # 1D factors for upfirdn2d_depthwise; derived from `kernel`, so they stay out of the state dict
+    factors = separable_factors(kernel)
+    module.separable = factors is not None
+    if module.separable:
+        module.register_buffer('kernel_col', factors[0], persistent=False)
+        module.register_buffer('kernel_row', factors[1], persistent=False)
+
+
 def make_kernel(k):
     k = torch.tensor(k, dtype=torch.float32)
 
@@ -64,10 +108,13 @@ class Blur(nn.Module):
             kernel = kernel * (upsample_factor ** 2)
 
         self.register_buffer('kernel', kernel)
+        register_separable_kernel(self, kernel)
 
         self.pad = pad
 
     def forward(self, input):
+        if self.separable:
+            return upfirdn2d_depthwise(input, self.kernel_col, self.kernel_row, pad=self.pad)
         return upfirdn2d(input, self.kernel, pad=self.pad)
 
 
@@ -339,6 +386,16 @@ class Encoder(nn.Module):
 
         return h_motion
     
+    def encode_for_inference(self, img):
+        """
+        Inference-time equivalent of `forward(img, img, img, img)`: runs the appearance
+        encoder and the motion branch of the decoupler once and returns only what
+        `Synthesis` needs, i.e. (h_source, h_motion, feats).
+        """
+        h_source, feats = self.net_app(img)
+        h_motion = self.fc(self.net_decouping.identity_excluded_net(h_source))
+        return h_source, h_motion, feats
+
     def encode_image_obj(self, image_obj):
         feat, _ = self.net_app(image_obj)
         id_emb, idrm_emb, id_density_emb = self.net_decouping(feat)
@@ -45,6 +45,50 @@ def upfirdn2d(input, kernel, up=1, down=1, pad=(0, 0)):
     return upfirdn2d_native(input, kernel, up, up, down, down, pad[0], pad[1], pad[0], pad[1])
 
 
+def separable_factors(kernel):
+    """Column and row 1D factors of a rank-1 2D FIR kernel (what make_kernel builds from a 1D kernel), else None."""
+    col = kernel.sum(1)
+    row = kernel.sum(0) / kernel.sum()
+    if kernel.shape[0] != kernel.shape[1] or not torch.allclose(col[:, None] * row[None, :], kernel, atol=1e-7):
+        return None
+    return col, row
+
+
+def upfirdn2d_depthwise(input, kernel_col, kernel_row, up=1, down=1, pad=(0, 0)):
+    """
+    `upfirdn2d(input, kernel_col[:, None] * kernel_row[None, :], up, down, pad)` as two depthwise
+    1D convolutions instead of one single-channel 2D convolution over batch * channel images.
+    Upsampling is fused into strided `conv_transpose2d`, so the inserted zeros are never multiplied.
+    """
+    channel = input.size(1)
+    kernel_size = kernel_col.numel()
+    pad0, pad1 = pad
+    col = kernel_col.to(input.dtype).view(1, 1, kernel_size, 1).expand(channel, 1, kernel_size, 1)
+    row = kernel_row.to(input.dtype).view(1, 1, 1, kernel_size).expand(channel, 1, 1, kernel_size)
+
+    if up > 1:
+        # conv_transpose2d(x, k, stride=up, padding=P) is zero insertion followed by the flipped-kernel
+        # correlation of upfirdn2d, shifted by P = kernel_size - 1 - pad0; the crop only matches for this pad1
+        padding = kernel_size - 1 - pad0
+        if down != 1 or padding < 0 or pad1 != pad0 - up + 1:
+            return upfirdn2d(input, kernel_col[:, None] * kernel_row[None, :], up=up, down=down, pad=pad)
+        out = F.conv_transpose2d(input, col, stride=(up, 1), padding=(padding, 0), groups=channel)
+        return F.conv_transpose2d(out, row, stride=(1, up), padding=(0, padding), groups=channel)
+
+    out = F.pad(input, [pad0, pad1, pad0, pad1])
+    out = F.conv2d(out, col.flip(2), stride=(down, 1), groups=channel)
+    return F.conv2d(out, row.flip(3), stride=(1, down), groups=channel)
+
+
+def register_separable_kernel(module, kernel):
+    # 1D factors for upfirdn2d_depthwise; derived from `kernel`, so they stay out of the state dict
+    factors = separable_factors(kernel)
+    module.separable = factors is not None
+    if module.separable:
+        module.register_buffer('kernel_col', factors[0], persistent=False)
+        module.register_buffer('kernel_row', factors[1], persistent=False)
+
+
 class PixelNorm(nn.Module):
     def __init__(self):
         super().__init__()
@@ -86,8 +130,11 @@ class Upsample(nn.Module):
         pad1 = p // 2
 
         self.pad = (pad0, pad1)
+        register_separable_kernel(self, kernel)
 
     def forward(self, input):
+        if self.separable:
+            return upfirdn2d_depthwise(input, self.kernel_col, self.kernel_row, up=self.factor, down=1, pad=self.pad)
         return upfirdn2d(input, self.kernel, up=self.factor, down=1, pad=self.pad)
 
 
@@ -105,8 +152,11 @@ class Downsample(nn.Module):
         pad1 = p // 2
 
         self.pad = (pad0, pad1)
+        register_separable_kernel(self, kernel)
 
     def forward(self, input):
+        if self.separable:
+            return upfirdn2d_depthwise(input, self.kernel_col, self.kernel_row, up=1, down=self.factor, pad=self.pad)
         return upfirdn2d(input, self.kernel, up=1, down=self.factor, pad=self.pad)
 
 
@@ -120,10 +170,13 @@ class Blur(nn.Module):
             kernel = kernel * (upsample_factor ** 2)
 
         self.register_buffer('kernel', kernel)
+        register_separable_kernel(self, kernel)
 
         self.pad = pad
 
     def forward(self, input):
+        if self.separable:
+            return upfirdn2d_depthwise(input, self.kernel_col, self.kernel_row, pad=self.pad)
         return upfirdn2d(input, self.kernel, pad=self.pad)
 
 
@@ -272,6 +325,39 @@ class ModulatedConv2d(nn.Module):
 
         return out
 
+    def demod_gram(self):
+        # G[o, i] = scale^2 * sum_k W[o, i, k]^2, so that demod = rsqrt(style^2 @ G.T + eps)
+        return (self.scale * self.weight[0]).pow(2).sum([2, 3])
+
+    def forward_modulated(self, input, style, demod=None):
+        """
+        Same result as `forward(input, latent)` for `style = self.modulation(latent)`, computed as
+        one shared-weight convolution over the whole batch: the per-sample style scales the input
+        channels and the demodulation scales the output channels, instead of building a
+        per-sample weight and running a grouped convolution.
+        """
+        batch = input.size(0)
+        weight = self.scale * self.weight[0]
+
+        if self.demodulate and demod is None:
+            demod = torch.rsqrt(style.pow(2) @ self.demod_gram().T + 1e-8)
+
+        input = input * style.view(batch, self.in_channel, 1, 1)
+
+        if self.upsample:
+            out = F.conv_transpose2d(input, weight.transpose(0, 1), padding=0, stride=2)
+            out = self.blur(out)
+        elif self.downsample:
+            input = self.blur(input)
+            out = F.conv2d(input, weight, padding=0, stride=2)
+        else:
+            out = F.conv2d(input, weight, padding=self.padding)
+
+        if self.demodulate:
+            out = out * demod.view(batch, self.out_channel, 1, 1)
+
+        return out
+
 
 class NoiseInjection(nn.Module):
     def __init__(self):
@@ -325,6 +411,13 @@ class StyledConv(nn.Module):
 
         return out
 
+    def forward_modulated(self, input, style, demod=None, noise=None):
+        out = self.conv.forward_modulated(input, style, demod)
+        out = self.noise(out, noise=noise)
+        out = self.activate(out)
+
+        return out
+
 
 class ConvLayer(nn.Sequential):
     def __init__(
@@ -398,23 +491,44 @@ class ToFlow(nn.Module):
         self.in_channel = in_channel
         self.conv = ModulatedConv2d(in_channel, 3, 1, style_dim, demodulate=False)
         self.bias = nn.Parameter(torch.zeros(1, 3, 1, 1))
+        self.grids = {}  # (size, device, dtype) -> warping grid
+
+    def grid(self, size, device, dtype):
+        """
+        The identity sampling grid (1 x size x size x 2, broadcast over the batch) of F.grid_sample,
+        built once per (size, device, dtype) instead of in numpy on every call.
+        """
+        key = (size, device, dtype)
+        grid = self.grids.get(key)
+        if grid is None:
+            xs = np.linspace(-1, 1, size)
+            xs = np.stack(np.meshgrid(xs, xs), 2)
+            grid = torch.from_numpy(xs).float().unsqueeze(0).to(device=device, dtype=dtype)
+            self.grids[key] = grid
+        return grid
 
     def forward(self, input, style, feat, skip=None): # input 是来自上一层的 feature， style 是 512 的 condition， feat 是来自于 unet 的跳层
         out = self.conv(input, style)
+        return self.warp(input, out, feat, skip)
+
+    def forward_modulated(self, input, style, feat, skip=None):
+        out = self.conv.forward_modulated(input, style)
+        return self.warp(input, out, feat, skip)
+
+    def warp(self, input, out, feat, skip=None):
         out = out + self.bias
 
         # warping
-        xs = np.linspace(-1, 1, input.size(2))
-        
-        xs = np.meshgrid(xs, xs)
-        xs = np.stack(xs, 2)
-
-        xs = torch.tensor(xs, requires_grad=False).float().unsqueeze(0).repeat(input.size(0), 1, 1, 1).to(input.device)
+        xs = self.grid(input.size(2), input.device, out.dtype)
         # import pdb;pdb.set_trace()
         if skip is not None:
             skip = self.upsample(skip)
             out = out + skip
 
+        if feat.size(0) != out.size(0):
+            # feats of one source image shared by a batch of frames: broadcast as a view, no copy
+            feat = feat.expand(out.size(0), -1, -1, -1)
+
         sampler = torch.tanh(out[:, 0:2, :, :])
         mask = torch.sigmoid(out[:, 2:3, :, :])
         flow = sampler.permute(0, 2, 3, 1) + xs # xs在这里相当于一个 location 的位置
@@ -430,11 +544,33 @@ class Direction(nn.Module):
 
         self.weight = nn.Parameter(torch.randn(512, motion_dim))
 
-    def forward(self, input):
-        # input: (bs*t) x 512
+        # inference mode: keep Q between calls instead of re-running the QR for every frame
+        self.cache_basis = False
+        self._basis = None
+        self._basis_key = None
 
+    def basis(self):
         weight = self.weight + 1e-8
         Q, R = torch.qr(weight)  # get eignvector, orthogonal [n1, n2, n3, n4]
+        return Q
+
+    def cached_basis(self):
+        # Any in-place update (load_state_dict, optimizer step) bumps _version, and .to() changes data_ptr
+        key = (self.weight.data_ptr(), self.weight._version, self.weight.device, self.weight.dtype)
+        if self._basis_key != key:
+            with torch.no_grad():
+                self._basis = self.basis()
+            self._basis_key = key
+        return self._basis
+
+    def forward(self, input):
+        # input: (bs*t) x 512
+
+        if self.cache_basis and not (torch.is_grad_enabled() and self.weight.requires_grad):
+            Q = self.cached_basis()
+            return Q if input is None else torch.matmul(input, Q.T)  # sum_i alpha_i * q_i
+
+        Q = self.basis()
 
         if input is None:
             return Q
@@ -495,6 +631,51 @@ class Synthesis(nn.Module):
 
         self.n_latent = self.log_size * 2 - 2
         
+    def set_inference(self, enabled=True):
+        """Cache the motion basis of `direction` for frozen-weight inference (see Direction.cache_basis)."""
+        self.direction.cache_basis = enabled
+        return self
+
+    def modulated_convs(self):
+        """Every ModulatedConv2d in the order forward uses them: conv1, then (conv, conv, to_flow) per resolution."""
+        convs = [self.conv1.conv]
+        for conv1, conv2, to_flow in zip(self.convs[::2], self.convs[1::2], self.to_flows):
+            convs += [conv1.conv, conv2.conv, to_flow.conv]
+        return convs
+
+    @torch.no_grad()
+    def precompute_styles(self, source_before_decoupling, fold_demod=False):
+        """
+        Fold one avatar's `wa`, the motion basis Q and every layer's modulation into a single
+        affine map from the motion code alpha to all the style vectors.
+        See `forward_precomputed`.
+        """
+        return PrecomputedStyles(self, source_before_decoupling, fold_demod)
+
+    def forward_precomputed(self, styles, target_motion, feats):
+        """`forward(wa, target_motion, feats)` for the `wa` that `styles` was precomputed from."""
+        layer_styles, demods = styles(target_motion)
+        layers = iter(zip(layer_styles, demods))
+
+        out = self.input(target_motion)
+        out = self.conv1.forward_modulated(out, *next(layers))
+
+        for conv1, conv2, to_rgb, to_flow, feat in zip(self.convs[::2], self.convs[1::2], self.to_rgbs,
+                                                       self.to_flows, feats):
+            out = conv1.forward_modulated(out, *next(layers))
+            out = conv2.forward_modulated(out, *next(layers))
+            flow_style, _ = next(layers)
+            if out.size(2) == 8:
+                out_warp, out, skip_flow = to_flow.forward_modulated(out, flow_style, feat)
+                skip = to_rgb(out_warp)
+            else:
+                out_warp, out, skip_flow = to_flow.forward_modulated(out, flow_style, feat, skip_flow)
+                skip = to_rgb(out_warp, skip)
+
+        img = skip
+
+        return img
+
     def forward(self, source_before_decoupling, target_motion, feats):
 
         directions = self.direction(target_motion)
@@ -525,3 +706,63 @@ class Synthesis(nn.Module):
         
         
 
+
+class PrecomputedStyles:
+    """
+    Per-avatar styles of every modulated layer of a Synthesis as one affine function of alpha.
+
+    With latent = wa + alpha @ Q.T and each modulation an affine EqualLinear,
+    style_l = (wa @ W_l.T + b_l) + alpha @ (Q.T @ W_l.T), so all layers together reduce to
+    `bias + alpha @ weight` with a motion_dim x sum(C) weight: one small matmul per batch of frames.
+
+    With `fold_demod`, the demodulation is folded too: sum_i G[o, i] * style_i^2 is a quadratic
+    form in alpha, evaluated from a motion_dim x motion_dim matrix per output channel.
+    """
+    def __init__(self, synthesis, wa, fold_demod=False):
+        convs = synthesis.modulated_convs()
+        Q = synthesis.direction.cached_basis() if synthesis.direction.cache_basis else synthesis.direction.basis()
+
+        weights, biases = [], []
+        for conv in convs:
+            mod = conv.modulation
+            mod_weight = mod.weight * mod.scale
+            mod_bias = mod.bias * mod.lr_mul
+            weights.append(Q.T @ mod_weight.T)  # motion_dim x C
+            biases.append(F.linear(wa, mod_weight, bias=mod_bias))  # 1 x C
+
+        self.sizes = [w.size(1) for w in weights]
+        self.weight = torch.cat(weights, dim=1)
+        self.bias = torch.cat(biases, dim=1)
+        self.demodulate = [conv.demodulate for conv in convs]
+        self.fold_demod = fold_demod
+
+        # Demodulation terms, only for the layers that demodulate
+        self.grams = [conv.demod_gram() if conv.demodulate else None for conv in convs]
+        self.quadratic = None
+        if fold_demod:
+            self.quadratic = []
+            for gram, A, c in zip(self.grams, weights, biases):
+                if gram is None:
+                    self.quadratic.append(None)
+                    continue
+                c = c[0]
+                # sum_i G[o,i] (c_i + alpha.A_i)^2 = const_o + alpha . lin_o + alpha^T H_o alpha
+                const = gram @ c.pow(2)
+                lin = 2 * (A * c) @ gram.T  # motion_dim x C_out
+                H = torch.einsum('oi,mi,ni->omn', gram, A, A)  # C_out x motion_dim x motion_dim
+                self.quadratic.append((const, lin, H))
+
+    def __call__(self, alpha):
+        """Styles and demodulation factors of every layer for a batch of motion codes alpha (N x motion_dim)."""
+        styles = torch.addmm(self.bias, alpha, self.weight).split(self.sizes, dim=1)
+        demods = []
+        for i, style in enumerate(styles):
+            if not self.demodulate[i]:
+                demods.append(None)
+            elif self.fold_demod:
+                const, lin, H = self.quadratic[i]
+                energy = const + alpha @ lin + torch.einsum('bm,omn,bn->bo', alpha, H, alpha)
+                demods.append(torch.rsqrt(energy + 1e-8))
+            else:
+                demods.append(torch.rsqrt(style.pow(2) @ self.grams[i].T + 1e-8))
+        return styles, demods
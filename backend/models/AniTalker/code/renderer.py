@@ -6,6 +6,7 @@ def render_condition(
     sampler, start, motion_direction_start, audio_driven, \
         face_location, face_scale, \
         yaw_pitch_roll, noisyT, control_flag,
+    callback=None,
 ):
     if conf.train_mode == TrainMode.diffusion:
         assert conf.model_type.has_autoenc()
@@ -20,6 +21,7 @@ def render_condition(
                                   'face_location': face_location,
                                   'face_scale': face_scale,
                                   'control_flag': control_flag
-                              })
+                              },
+                              callback=callback)
     else:
         raise NotImplementedError()
@@ -0,0 +1,178 @@
+import queue
+import shutil
+import subprocess
+import threading
+import time
+
+import numpy as np
+import torch
+
+
+def get_ffmpeg_exe():
+    # moviepy already depends on imageio-ffmpeg, which ships its own ffmpeg binary
+    try:
+        import imageio_ffmpeg # type: ignore
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except (ImportError, RuntimeError):
+        ffmpeg = shutil.which('ffmpeg')
+        if ffmpeg is None:
+            raise RuntimeError('ffmpeg not found, please install imageio-ffmpeg or put ffmpeg on the PATH')
+        return ffmpeg
+
+
+def to_uint8_frames(imgs):
+    """N x 3 x H x W float images in [0, 1] -> N x H x W x 3 uint8, rounded the way ToPILImage does."""
+    return imgs.mul(255).byte().permute(0, 2, 3, 1).contiguous().cpu()
+
+
+class VideoWriter:
+    """
+    Streams raw RGB frames into an ffmpeg process that encodes them with libx264 and,
+    if `audio_path` is given, muxes the audio track in the same pass.
+
+        with VideoWriter(output_path, 256, 256, fps=25, audio_path=audio) as writer:
+            for chunk in frames:
+                writer.write(to_uint8_frames(chunk))
+    """
+    def __init__(self, output_path, width, height, fps=25, audio_path=None, crf=18, preset='medium'):
+        self.output_path = output_path
+        self.width = width
+        self.height = height
+        self.num_frames = 0
+
+        command = [
+            get_ffmpeg_exe(), '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+        ]
+        if audio_path is not None:
+            command += ['-i', audio_path, '-map', '0:v:0', '-map', '1:a:0', '-c:a', 'aac', '-shortest']
+        command += ['-c:v', 'libx264', '-preset', preset, '-crf', str(crf), '-pix_fmt', 'yuv420p', output_path]
+
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def write(self, frames):
+        """Append N x H x W x 3 uint8 frames (tensor or array)."""
+        if isinstance(frames, torch.Tensor):
+            frames = frames.numpy()
+        frames = np.ascontiguousarray(frames, dtype=np.uint8)
+        if frames.ndim == 3:
+            frames = frames[None]
+        if frames.shape[1:] != (self.height, self.width, 3):
+            raise ValueError(f'Expected frames of shape (N, {self.height}, {self.width}, 3), got {frames.shape}')
+        try:
+            self.process.stdin.write(frames.tobytes())
+        except BrokenPipeError:
+            self._close_process()  # ffmpeg exited early, raises with its error output
+        self.num_frames += frames.shape[0]
+
+    def close(self):
+        self._close_process()
+
+    def _close_process(self):
+        if self.process is None:
+            return
+        process, self.process = self.process, None
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        stderr = process.stderr.read().decode(errors='ignore')
+        process.stderr.close()
+        if process.wait() != 0:
+            raise RuntimeError(f'ffmpeg failed to encode {self.output_path}: {stderr.strip()}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+
+
+class StageCounter:
+    """Throughput of one pipeline stage: frames handled, time spent working and time spent waiting on the other stage."""
+    def __init__(self, name):
+        self.name = name
+        self.frames = 0
+        self.busy = 0.0
+        self.waiting = 0.0
+
+    def to_dict(self):
+        return {
+            'frames': self.frames,
+            'busy_seconds': round(self.busy, 3),
+            'waiting_seconds': round(self.waiting, 3),
+            'fps': round(self.frames / self.busy, 2) if self.busy else None,
+        }
+
+    def __str__(self):
+        fps = f'{self.frames / self.busy:.2f}' if self.busy else '-'
+        return f'{self.name}: {self.frames} frames, {fps} frames/sec busy, {self.busy:.2f}s busy, {self.waiting:.2f}s waiting'
+
+
+class PipelinedVideoWriter(VideoWriter):
+    """
+    VideoWriter whose pipe writes happen on a background thread.
+
+    `write` only enqueues the frames into a queue of at most `queue_size` chunks, so the
+    renderer keeps computing while ffmpeg encodes, and memory stays bounded by the queue
+    depth. `stats['render']` / `stats['encode']` count each side's throughput: if render
+    spends its time waiting, the encoder is the bottleneck, and vice versa. The producer
+    reports its own work time through `add_render_time`.
+    """
+    def __init__(self, output_path, width, height, fps=25, audio_path=None, crf=18, preset='medium', queue_size=4):
+        super().__init__(output_path, width, height, fps=fps, audio_path=audio_path, crf=crf, preset=preset)
+        self.stats = {'render': StageCounter('render'), 'encode': StageCounter('encode')}
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self._drain, name='video-encode', daemon=True)
+        self.thread.start()
+
+    def add_render_time(self, frames, seconds):
+        self.stats['render'].frames += frames
+        self.stats['render'].busy += seconds
+
+    def write(self, frames):
+        if self.error is not None:
+            raise RuntimeError(f'ffmpeg failed to encode {self.output_path}') from self.error
+        start_time = time.time()
+        self.queue.put(frames)
+        self.stats['render'].waiting += time.time() - start_time
+
+    def _drain(self):
+        encode = self.stats['encode']
+        while True:
+            start_time = time.time()
+            frames = self.queue.get()
+            encode.waiting += time.time() - start_time
+            if frames is None:
+                return
+            if self.error is not None:
+                continue  # keep draining so the producer never blocks on a dead encoder
+            start_time = time.time()
+            try:
+                super().write(frames)
+                encode.frames += len(frames)
+            except Exception as e:
+                self.error = e
+            encode.busy += time.time() - start_time
+
+    def _stop_thread(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def close(self):
+        self._stop_thread()
+        super().close()
+        if self.error is not None:
+            raise RuntimeError(f'ffmpeg failed to encode {self.output_path}') from self.error
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop_thread()
+        super().__exit__(exc_type, exc, tb)
@@ -1,7 +1,8 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file
 from flask_cors import CORS
 import sys
 import os
+import io
 
 import torch._dynamo
 torch._dynamo.config.suppress_errors = True
@@ -21,13 +22,29 @@ import torchaudio
 from zonos.model import Zonos
 from zonos.conditioning import make_cond_dict
 from zonos.utils import DEFAULT_DEVICE as device
+from zonos.voice_bank import VoiceBank
+from zonos.scheduler import GenerationScheduler
+from zonos.long_form import synthesize_long
+from zonos.streaming import stream_generate, stream_wav
 
 app = Flask(__name__)
 CORS(app)
 
+LONG_TEXT_CHARS = int(os.environ.get("ZONOS_LONG_TEXT_CHARS", 250))
+
 try:
     print("Downloading model...")
     model = Zonos.from_pretrained("Zyphra/Zonos-v0.1-transformer", device=device)
+    voice_bank = VoiceBank(model, root=os.path.abspath(os.environ.get("ZONOS_VOICE_BANK_DIR", "voice_bank")))
+    # Concurrent /inf requests share one decode batch of up to this many utterances
+    # and reuse the K/V of conditioning prefixes seen before (ZONOS_PREFIX_CACHE_MB, 0 disables it);
+    # the shared KV cache grows with the requests up to ZONOS_MAX_SEQLEN positions
+    tts_scheduler = GenerationScheduler(
+        model,
+        max_batch_size=int(os.environ.get("ZONOS_MAX_BATCH_SIZE", 8)),
+        max_seqlen=int(os.environ.get("ZONOS_MAX_SEQLEN", 4096)),
+        prefix_cache_bytes=int(os.environ.get("ZONOS_PREFIX_CACHE_MB", 256)) * 1024**2,
+    )
     print("\nModel download and integrated succesfully!!!\n")
 
 except:
@@ -38,41 +55,96 @@ def check_active():
     return jsonify({"status": "active"})
 
 
-if not os.path.exists("outputs"):
-    os.makedirs("outputs")
+@app.route("/voices", methods=["POST"])
+def add_voice():
+    if "audio" not in request.files:
+        return jsonify({"error": "Please provide an audio file"}), 400
+
+    try:
+        wav, sampling_rate = torchaudio.load(request.files["audio"])
+        voice_id = voice_bank.add(wav, sampling_rate)
+    except Exception as e:
+        return jsonify({"status": f"Error in sampling: {str(e)}"}), 500
+
+    return jsonify({"voice_id": voice_id}), 201
+
+
+@app.route("/voices/<voice_id>", methods=["GET"])
+def voice_status(voice_id):
+    if voice_id not in voice_bank:
+        return jsonify({"error": "Voice not found"}), 404
+    return jsonify({"voice_id": voice_id})
 
 
 @app.route("/inf", methods=["POST"])
 def TTS():
     print(request.form)
-    if "audio" not in request.files or "text" not in request.form:
-        return jsonify({"error": "Please provide both an audio file and text"}), 400
+    voice_id = request.form.get("voice_id")
+    if ("audio" not in request.files and not voice_id) or "text" not in request.form:
+        return jsonify({"error": "Please provide an audio file (or voice_id) and text"}), 400
 
-    audio_file = request.files["audio"]
     text = request.form["text"]
 
     try:
-        wav, sampling_rate = torchaudio.load(audio_file)
-        speaker = model.make_speaker_embedding(wav, sampling_rate) 
-
-        cond_dict = make_cond_dict(text=text, speaker=speaker, language="en-us")
-        conditioning = model.prepare_conditioning(cond_dict)
+        if voice_id:
+            speaker = voice_bank.get(voice_id)
+            if speaker is None:
+                return jsonify({"error": f"Unknown voice_id: {voice_id}"}), 404
+        else:
+            wav, sampling_rate = torchaudio.load(request.files["audio"])
+            _, speaker = voice_bank.embed(wav, sampling_rate)
+
+        if len(text) <= LONG_TEXT_CHARS:
+            cond_dict = make_cond_dict(text=text, speaker=speaker, language="en-us")
+            conditioning = model.prepare_conditioning(cond_dict)
 
     except Exception as e:
         return jsonify({"status": f"Error in sampling: {str(e)}"}), 500
 
     try:
-        codes = model.generate(conditioning)
-        wavs = model.autoencoder.decode(codes).cpu()
+        if len(text) > LONG_TEXT_CHARS:
+            # Long scripts are synthesized segment by segment, see zonos.long_form
+            wavs = synthesize_long(tts_scheduler, text, speaker, max_chars=LONG_TEXT_CHARS).unsqueeze(0)
+        else:
+            codes = tts_scheduler.generate(conditioning)
+            wavs = model.autoencoder.decode(codes).cpu()
 
     except Exception as e:
         return jsonify({"status": f"Error in generating: {str(e)}"}), 500
 
-    output_path = "./outputs/output.wav"
-    torchaudio.save(output_path, wavs[0], model.autoencoder.sampling_rate)
+    # Encode in memory so concurrent requests never overwrite each other's output file
+    buffer = io.BytesIO()
+    torchaudio.save(buffer, wavs[0], model.autoencoder.sampling_rate, format="wav")
+    buffer.seek(0)
+
+    return send_file(buffer, mimetype="audio/wav", as_attachment=True, download_name="output.wav")
+
+
+@app.route("/inf/stream", methods=["POST"])
+def TTS_stream():
+    # Same inputs as /inf; the WAV is sent in chunks while it is generated instead of at the end
+    voice_id = request.form.get("voice_id")
+    if ("audio" not in request.files and not voice_id) or "text" not in request.form:
+        return jsonify({"error": "Please provide an audio file (or voice_id) and text"}), 400
+
+    try:
+        if voice_id:
+            speaker = voice_bank.get(voice_id)
+            if speaker is None:
+                return jsonify({"error": f"Unknown voice_id: {voice_id}"}), 404
+        else:
+            wav, sampling_rate = torchaudio.load(request.files["audio"])
+            _, speaker = voice_bank.embed(wav, sampling_rate)
+
+        cond_dict = make_cond_dict(text=request.form["text"], speaker=speaker, language="en-us")
+        conditioning = model.prepare_conditioning(cond_dict)
+
+    except Exception as e:
+        return jsonify({"status": f"Error in sampling: {str(e)}"}), 500
 
-    return send_file(output_path, as_attachment=True)
+    chunks = stream_generate(tts_scheduler.generate, model.autoencoder, conditioning)
+    return Response(stream_wav(chunks, model.autoencoder.sampling_rate), mimetype="audio/wav")
 
 
 if __name__ == "__main__":
-    app.run(port=1234,threaded=False)
\ No newline at end of file
+    app.run(port=1234,threaded=True)
\ No newline at end of file
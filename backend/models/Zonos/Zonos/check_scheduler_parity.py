@@ -0,0 +1,63 @@
+import argparse
+import sys
+
+import torch
+
+from zonos.conditioning import make_cond_dict
+from zonos.model import Zonos
+from zonos.scheduler import GenerationScheduler
+from zonos.utils import DEFAULT_DEVICE as device
+
+# Checks that a short request decoded in a batch next to a longer one (joining it mid-flight,
+# so their rows have different lengths in every ragged step) gets the same codes as alone.
+# Sampling is greedy (top_k=1) so both runs are deterministic.
+#
+#   python check_scheduler_parity.py --device cuda
+
+SHORT_TEXT = "Hello, world!"
+LONG_TEXT = "The quick brown fox jumps over the lazy dog, and then it runs all the way back home again."
+
+
+def conditioning(model, text):
+    return model.prepare_conditioning(make_cond_dict(text=text, language="en-us"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", type=str, default="Zyphra/Zonos-v0.1-transformer")
+    parser.add_argument("--join_step", type=int, default=20, help="Step of the long request at which the short one is submitted")
+    parser.add_argument("--max_new_tokens", type=int, default=86 * 5)
+    parser.add_argument("--disable_torch_compile", action="store_true")
+    parser.add_argument("--device", type=str, default=str(device))
+    args = parser.parse_args()
+
+    model = Zonos.from_pretrained(args.model, device=args.device)
+    model.requires_grad_(False).eval()
+    kwargs = dict(max_new_tokens=args.max_new_tokens, sampling_params=dict(top_k=1))
+    short_cond, long_cond = conditioning(model, SHORT_TEXT), conditioning(model, LONG_TEXT)
+
+    alone = GenerationScheduler(model, disable_torch_compile=args.disable_torch_compile).generate(short_cond, **kwargs)
+
+    scheduler = GenerationScheduler(model, disable_torch_compile=args.disable_torch_compile)
+    joined = {}
+
+    def join_short(frame, step, max_steps):
+        if step == args.join_step:
+            joined["short"] = scheduler.submit(short_cond, **kwargs)
+        return True
+
+    long_codes = scheduler.generate(long_cond, callback=join_short, **kwargs)
+    if "short" not in joined:
+        print(f"MISMATCH: the long request stopped before step {args.join_step}, lower --join_step")
+        sys.exit(1)
+    batched = joined["short"].result()
+
+    frames = min(alone.shape[2], batched.shape[2])
+    matching = (alone[..., :frames] == batched[..., :frames]).all(dim=1).float().mean().item()
+    print(f"long={long_codes.shape[2]} frames, short alone={alone.shape[2]} frames, batched={batched.shape[2]} frames, "
+          f"matching frames={matching:.1%}")
+    if torch.equal(alone, batched):
+        print("OK: the short request gets the same codes batched as alone")
+    else:
+        print("MISMATCH: the short request's codes depend on the batch it was decoded in")
+        sys.exit(1)
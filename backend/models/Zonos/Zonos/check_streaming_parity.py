@@ -0,0 +1,90 @@
+import argparse
+import sys
+
+import torch
+import torchaudio
+
+from zonos.autoencoder import DACAutoencoder
+from zonos.codebook_pattern import apply_delay_pattern
+from zonos.streaming import StreamingDecoder
+
+# Checks that the chunks of StreamingDecoder, concatenated, match DACAutoencoder.decode of the
+# whole utterance: with context/lookahead margins covering the decoder's receptive field the
+# joins between chunks must not differ from the rest of the audio.
+#
+#   python check_streaming_parity.py --wav voices/output.wav --device cuda
+
+
+def stream_chunks(autoencoder, codes, **decoder_kwargs):
+    """Feed delayed frames one by one, as `Zonos.generate`'s callback does (from the first sampled one)."""
+    decoder = StreamingDecoder(autoencoder, **decoder_kwargs)
+    delayed = apply_delay_pattern(codes, mask_token=1025)
+    chunks = []
+    for i in range(1, delayed.shape[2]):
+        chunk = decoder.push(delayed[..., i : i + 1])
+        if chunk is not None:
+            chunks.append(chunk)
+    chunk = decoder.flush()
+    if chunk is not None:
+        chunks.append(chunk)
+    return chunks
+
+
+@torch.inference_mode()
+def check_parity(autoencoder, codes, atol, **decoder_kwargs):
+    # the stream leaves out the last frame, as the codes returned by `Zonos.generate` do
+    reference = autoencoder.decode(codes)[0].cpu()
+    reference = reference[..., : reference.shape[-1] // codes.shape[2] * (codes.shape[2] - 1)]
+    chunks = stream_chunks(autoencoder, codes, **decoder_kwargs)
+    streamed = torch.cat(chunks, dim=-1)
+    if streamed.shape != reference.shape:
+        print(f"MISMATCH: streamed {tuple(streamed.shape)} samples, reference {tuple(reference.shape)}")
+        return False
+
+    diff = (streamed - reference).abs()
+    joins = torch.tensor([c.shape[-1] for c in chunks[:-1]]).cumsum(0).tolist()
+    join_diff = max((diff[..., max(j - 512, 0) : j + 512].max().item() for j in joins), default=0.0)
+    print(f"chunks={len(chunks)} samples={streamed.shape[-1]} max_abs_diff={diff.max().item():.3e} "
+          f"max_abs_diff_at_joins={join_diff:.3e}")
+    return diff.max().item() <= atol
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--wav", type=str, default="", help="Audio to encode into codes (random codes if empty)")
+    parser.add_argument("--frames", type=int, default=300, help="Length of the random codes, in frames")
+    parser.add_argument("--chunk_frames", type=int, default=32)
+    parser.add_argument("--first_chunk_frames", type=int, default=8)
+    parser.add_argument("--context_frames", type=int, default=16)
+    parser.add_argument("--lookahead_frames", type=int, default=12)
+    parser.add_argument("--atol", type=float, default=1e-3, help="Allowed difference (fp16 decode on GPU)")
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    autoencoder = DACAutoencoder()
+    autoencoder.dac.to(args.device)
+
+    if args.wav:
+        wav, sr = torchaudio.load(args.wav)
+        wav = autoencoder.preprocess(wav.mean(0, keepdim=True), sr).unsqueeze(0).to(args.device)
+        with torch.inference_mode():
+            codes = autoencoder.encode(wav)
+    else:
+        codes = torch.randint(0, 1024, (1, 9, args.frames), device=args.device)
+
+    ok = check_parity(
+        autoencoder,
+        codes,
+        args.atol,
+        chunk_frames=args.chunk_frames,
+        first_chunk_frames=args.first_chunk_frames,
+        context_frames=args.context_frames,
+        lookahead_frames=args.lookahead_frames,
+    )
+    if ok:
+        print("OK: streamed chunks match the full decode")
+    else:
+        print("MISMATCH: streamed chunks differ from the full decode")
+        sys.exit(1)
@@ -6,16 +6,17 @@ from os import getenv
 from zonos.model import Zonos, DEFAULT_BACKBONE_CLS as ZonosBackbone
 from zonos.conditioning import make_cond_dict, supported_language_codes
 from zonos.utils import DEFAULT_DEVICE as device
+from zonos.voice_bank import VoiceBank
 
 CURRENT_MODEL_TYPE = None
 CURRENT_MODEL = None
 
+VOICE_BANK = None
 SPEAKER_EMBEDDING = None
-SPEAKER_AUDIO_PATH = None
 
 
 def load_model_if_needed(model_choice: str):
-    global CURRENT_MODEL_TYPE, CURRENT_MODEL
+    global CURRENT_MODEL_TYPE, CURRENT_MODEL, VOICE_BANK
     if CURRENT_MODEL_TYPE != model_choice:
         if CURRENT_MODEL is not None:
             del CURRENT_MODEL
@@ -24,6 +25,11 @@ def load_model_if_needed(model_choice: str):
         CURRENT_MODEL = Zonos.from_pretrained(model_choice, device=device)
         CURRENT_MODEL.requires_grad_(False).eval()
         CURRENT_MODEL_TYPE = model_choice
+        # Speaker embeddings don't depend on the backbone, so the bank survives model switches
+        if VOICE_BANK is None:
+            VOICE_BANK = VoiceBank(CURRENT_MODEL, root=getenv("ZONOS_VOICE_BANK_DIR"))
+        else:
+            VOICE_BANK.model = CURRENT_MODEL
         print(f"{model_choice} model loaded successfully!")
     return CURRENT_MODEL
 
@@ -135,20 +141,16 @@ def generate_audio(
     seed = int(seed)
     max_new_tokens = 86 * 30
 
-    # This is a bit ew, but works for now.
-    global SPEAKER_AUDIO_PATH, SPEAKER_EMBEDDING
+    global SPEAKER_EMBEDDING
 
     if randomize_seed:
         seed = torch.randint(0, 2**32 - 1, (1,)).item()
     torch.manual_seed(seed)
 
     if speaker_audio is not None and "speaker" not in unconditional_keys:
-        if speaker_audio != SPEAKER_AUDIO_PATH:
-            print("Recomputed speaker embedding")
-            wav, sr = torchaudio.load(speaker_audio)
-            SPEAKER_EMBEDDING = selected_model.make_speaker_embedding(wav, sr)
-            SPEAKER_EMBEDDING = SPEAKER_EMBEDDING.to(device, dtype=torch.bfloat16)
-            SPEAKER_AUDIO_PATH = speaker_audio
+        wav, sr = torchaudio.load(speaker_audio)
+        _, SPEAKER_EMBEDDING = VOICE_BANK.embed(wav, sr)
+        SPEAKER_EMBEDDING = SPEAKER_EMBEDDING.to(device, dtype=torch.bfloat16)
 
     audio_prefix_codes = None
     if prefix_audio is not None:
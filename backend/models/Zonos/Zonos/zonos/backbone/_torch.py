@@ -44,6 +44,13 @@ def _update_kv_cache(
     assert batch_end <= kv_cache.shape[0]
     assert sequence_end <= kv_cache.shape[1]
     assert kv_cache is not None
+    if inference_params.ragged:
+        rows = torch.arange(k.shape[0], device=k.device).unsqueeze(-1)
+        positions = inference_params.lengths_per_sample.unsqueeze(-1) + torch.arange(k.shape[1], device=k.device)
+        batch_cache = kv_cache[batch_start:batch_end]
+        batch_cache[rows, positions, 0] = k
+        batch_cache[rows, positions, 1] = v
+        return batch_cache[:, :sequence_end, ...]
     kv_cache[batch_start:batch_end, sequence_start:sequence_end, 0, ...] = k
     kv_cache[batch_start:batch_end, sequence_start:sequence_end, 1, ...] = v
     return kv_cache[batch_start:batch_end, :sequence_end, ...]
@@ -63,8 +70,10 @@ class TorchZonosBackbone(nn.Module):
 
     def allocate_inference_cache(self, batch_size: int, max_seqlen: int, dtype: torch.dtype = torch.bfloat16):
         # TODO: This function should be pure
-        head_dim = self.config.d_model // self.config.attn_cfg["num_heads"]
-        self.freqs_cis = precompute_freqs_cis(16384, head_dim)
+        # The rotary table only depends on the config, it is rebuilt only when the device changes
+        if getattr(self, "freqs_cis", None) is None or self.freqs_cis.device != torch.empty(0).device:
+            head_dim = self.config.d_model // self.config.attn_cfg["num_heads"]
+            self.freqs_cis = precompute_freqs_cis(16384, head_dim)
         return {
             i: layer.allocate_inference_cache(batch_size, max_seqlen, dtype=dtype)
             for i, layer in enumerate(self.layers)
@@ -75,8 +84,13 @@ class TorchZonosBackbone(nn.Module):
         input_pos = input_pos + inference_params.lengths_per_sample.unsqueeze(-1)
 
         freqs_cis = self.freqs_cis[input_pos].expand(hidden_states.shape[0], -1, -1, -1)
+        attn_mask = None
+        if inference_params.ragged:
+            # every row attends to its own positions only: (batch, 1, seqlen, keys)
+            key_pos = torch.arange(inference_params.seqlen_offset + hidden_states.shape[1], device=hidden_states.device)
+            attn_mask = (key_pos <= input_pos.unsqueeze(-1)).unsqueeze(1)
         for i, layer in enumerate(self.layers):
-            hidden_states = layer(hidden_states, inference_params, freqs_cis)
+            hidden_states = layer(hidden_states, inference_params, freqs_cis, attn_mask)
         return self.norm_f(hidden_states)
 
 
@@ -96,8 +110,14 @@ class TransformerBlock(nn.Module):
     def allocate_inference_cache(self, batch_size: int, max_seqlen: int, dtype: torch.dtype = torch.bfloat16):
         return torch.empty(batch_size, max_seqlen, 2, self.num_heads_kv, self.head_dim, dtype=dtype), None
 
-    def forward(self, x: torch.Tensor, inference_params: InferenceParams, freqs_cis: torch.Tensor) -> torch.Tensor:
-        x = x + self.mixer(self.norm(x), inference_params, freqs_cis)
+    def forward(
+        self,
+        x: torch.Tensor,
+        inference_params: InferenceParams,
+        freqs_cis: torch.Tensor,
+        attn_mask: torch.Tensor | None = None,
+    ) -> torch.Tensor:
+        x = x + self.mixer(self.norm(x), inference_params, freqs_cis, attn_mask)
         x = x + self.mlp(self.norm2(x))
         return x
 
@@ -114,7 +134,13 @@ class Attention(nn.Module):
         self.in_proj = nn.Linear(config.d_model, total_head_dim, bias=False)
         self.out_proj = nn.Linear(self.num_heads * self.head_dim, config.d_model, bias=False)
 
-    def forward(self, x: torch.Tensor, inference_params: InferenceParams, freqs_cis: torch.Tensor) -> torch.Tensor:
+    def forward(
+        self,
+        x: torch.Tensor,
+        inference_params: InferenceParams,
+        freqs_cis: torch.Tensor,
+        attn_mask: torch.Tensor | None = None,
+    ) -> torch.Tensor:
         batch_size, seqlen, _ = x.shape
 
         q_size = self.num_heads * self.head_dim
@@ -133,7 +159,9 @@ class Attention(nn.Module):
 
         q, k, v = map(lambda x: x.transpose(1, 2), (q, k, v))
 
-        y = F.scaled_dot_product_attention(q, k, v, is_causal=seqlen > 1, enable_gqa=True)
+        y = F.scaled_dot_product_attention(
+            q, k, v, attn_mask=attn_mask, is_causal=attn_mask is None and seqlen > 1, enable_gqa=True
+        )
 
         y = y.transpose(1, 2).contiguous().view(batch_size, seqlen, q_size)
 
@@ -0,0 +1,70 @@
+import threading
+from collections import OrderedDict
+
+import torch
+import torch.nn as nn
+
+from zonos.config import InferenceParams
+from zonos.utils import find_multiple
+
+# DAC code frames per second of audio, and a slow speaking rate in phonemes per second
+# (`make_cond_dict` defaults to 15), so the estimate rarely falls short
+FRAME_RATE = 86
+MIN_PHONEME_RATE = 10.0
+
+
+def estimate_audio_tokens(num_phonemes: int, phoneme_rate: float = MIN_PHONEME_RATE, margin_seconds: float = 2.0) -> int:
+    """Code frames an utterance of `num_phonemes` phonemes is expected to fit in."""
+    return int(FRAME_RATE * (max(num_phonemes, 0) / phoneme_rate + margin_seconds))
+
+
+class KVCachePool:
+    """
+    Preallocated KV caches of the torch backbone, reused across `generate` calls.
+
+    Caches are bucketed by (batch size, capacity), with capacities rounded up to a multiple
+    of `capacity_step` positions; `acquire` hands out a free cache of the bucket or allocates
+    one, `release` returns it. Free caches are kept up to `max_bytes`, least recently
+    released first out. Only for backbones whose cache holds nothing but K/V (stale rows past
+    `seqlen_offset` are never read), not for the mamba-ssm states.
+    """
+
+    def __init__(self, backbone: nn.Module, capacity_step: int = 256, max_bytes: int = 1024**3):
+        self.backbone = backbone
+        self.capacity_step = capacity_step
+        self.max_bytes = max_bytes
+        self._free: OrderedDict[int, tuple[tuple, dict]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _nbytes(key_value_memory_dict: dict) -> int:
+        return sum(kv.numel() * kv.element_size() for kv, _ in key_value_memory_dict.values())
+
+    def acquire(self, batch_size: int, max_seqlen: int, dtype: torch.dtype = torch.bfloat16) -> InferenceParams:
+        """A cache for `batch_size` rows and at least `max_seqlen` positions, on the default device."""
+        capacity = find_multiple(max_seqlen, self.capacity_step)
+        key = (batch_size, capacity, dtype, str(torch.empty(0).device))  # indexed, like the cached tensors
+        key_value_memory_dict = None
+        with self._lock:
+            for token, (free_key, cache) in self._free.items():
+                if free_key == key:
+                    key_value_memory_dict = cache
+                    del self._free[token]
+                    self._bytes -= self._nbytes(cache)
+                    break
+        if key_value_memory_dict is None:
+            key_value_memory_dict = self.backbone.allocate_inference_cache(batch_size, capacity, dtype=dtype)
+        lengths_per_sample = torch.full((batch_size,), 0, dtype=torch.int32)
+        return InferenceParams(capacity, batch_size, 0, 0, key_value_memory_dict, lengths_per_sample)
+
+    def release(self, inference_params: InferenceParams):
+        cache = inference_params.key_value_memory_dict
+        kv_cache, _ = next(iter(cache.values()))
+        key = (inference_params.max_batch_size, inference_params.max_seqlen, kv_cache.dtype, str(kv_cache.device))
+        with self._lock:
+            self._free[id(cache)] = (key, cache)
+            self._bytes += self._nbytes(cache)
+            while self._bytes > self.max_bytes and self._free:
+                _, (_, evicted) = self._free.popitem(last=False)
+                self._bytes -= self._nbytes(evicted)
@@ -16,6 +16,10 @@ class InferenceParams:
     batch_size_offset: int = 0
     key_value_memory_dict: dict = field(default_factory=dict)
     lengths_per_sample: torch.Tensor | None = None
+    # Rows sit at different positions (continuous batching): each row writes its K/V at its own
+    # `lengths_per_sample` and only attends to its own positions; `seqlen_offset` is then the
+    # length of the longest row
+    ragged: bool = False
 
     def reset(self, max_seqlen, max_batch_size):
         self.max_seqlen = max_seqlen
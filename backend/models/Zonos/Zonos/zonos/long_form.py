@@ -0,0 +1,135 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+import torch
+
+from zonos.autoencoder import DACAutoencoder
+from zonos.conditioning import make_cond_dict
+from zonos.scheduler import GenerationScheduler
+
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?。！？])\s+|\s*\n+\s*")
+_CLAUSE_BREAK = re.compile(r"(?<=[,;:，；：—–])\s+")
+
+
+def _pack(pieces: list[str], max_chars: int) -> list[str]:
+    """Join consecutive pieces while they fit in `max_chars`."""
+    packed = []
+    for piece in pieces:
+        if packed and len(packed[-1]) + 1 + len(piece) <= max_chars:
+            packed[-1] = f"{packed[-1]} {piece}"
+        else:
+            packed.append(piece)
+    return packed
+
+
+def _split_sentence(sentence: str, max_chars: int) -> list[str]:
+    if len(sentence) <= max_chars:
+        return [sentence]
+    pieces = []
+    for clause in _CLAUSE_BREAK.split(sentence):
+        pieces.extend([clause] if len(clause) <= max_chars else clause.split())
+    return _pack(pieces, max_chars)
+
+
+def split_text(text: str, max_chars: int = 250) -> list[str]:
+    """
+    Split a script into segments of at most `max_chars` (a single word may exceed it):
+    at sentence ends first, then at clause boundaries, then between words. Short
+    consecutive sentences are packed together so every segment keeps some prosodic context.
+    """
+    pieces = []
+    for sentence in _SENTENCE_BREAK.split(text.strip()):
+        if sentence:
+            pieces.extend(_split_sentence(sentence, max_chars))
+    return _pack(pieces, max_chars)
+
+
+def crossfade(first: torch.Tensor, second: torch.Tensor, overlap: int) -> torch.Tensor:
+    """Concatenate [1, samples] waveforms, blending the last `overlap` samples of `first` into the start of `second`."""
+    overlap = min(overlap, first.shape[-1], second.shape[-1])
+    if overlap == 0:
+        return torch.cat([first, second], dim=-1)
+    ramp = torch.linspace(0, 1, overlap + 2, dtype=first.dtype)[1:-1]
+    blended = first[..., -overlap:] * (1 - ramp) + second[..., :overlap] * ramp
+    return torch.cat([first[..., :-overlap], blended, second[..., overlap:]], dim=-1)
+
+
+@torch.inference_mode()
+def _decode(autoencoder: DACAutoencoder, codes: torch.Tensor) -> torch.Tensor:
+    return autoencoder.decode(codes)[0].cpu()
+
+
+def synthesize_long(
+    scheduler: GenerationScheduler,
+    text: str,
+    speaker: torch.Tensor | None = None,
+    language: str = "en-us",
+    max_chars: int = 250,
+    continuity: bool = True,
+    prefix_frames: int = 43,
+    crossfade_ms: float = 50.0,
+    max_new_tokens: int = 86 * 30,
+    cfg_scale: float = 2.0,
+    sampling_params: dict = dict(min_p=0.1),
+    progress_callback: Callable[[int, int], object] | None = None,
+    **cond_kwargs,
+) -> torch.Tensor:
+    """
+    Synthesize a script of any length as one waveform [1, samples].
+
+    The text is cut by `split_text` and every segment is generated on its own, so no
+    generation runs into the `max_new_tokens` cap or attends over a whole script. The DAC
+    decode of a segment runs on a separate thread while the next segment is generated.
+
+    With `continuity`, each segment continues from the last `prefix_frames` codes of the
+    previous one (`audio_prefix_codes`), which keeps voice and pace consistent; the segments
+    are then generated in order and their shared frames are crossfaded. Without it the
+    segments are independent and are all submitted at once, so the scheduler generates them
+    as one batch; they are joined with a `crossfade_ms` crossfade.
+
+    `progress_callback(done, total)` is called after each generated segment; any other keyword
+    (emotion, speaking_rate, ...) goes to `make_cond_dict`.
+    """
+    model = scheduler.model
+    segments = split_text(text, max_chars)
+    if not segments:
+        raise ValueError("No text to synthesize")
+
+    def conditioning(segment: str) -> torch.Tensor:
+        cond_dict = make_cond_dict(text=segment, speaker=speaker, language=language, **cond_kwargs)
+        return model.prepare_conditioning(cond_dict)
+
+    generate_kwargs = dict(max_new_tokens=max_new_tokens, cfg_scale=cfg_scale, sampling_params=sampling_params)
+    decoded = []  # (future of the waveform, its frames, frames shared with the previous segment)
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="zonos-decode") as decoder:
+        if continuity:
+            prefix = None
+            for i, segment in enumerate(segments):
+                codes = scheduler.generate(conditioning(segment), audio_prefix_codes=prefix, **generate_kwargs)
+                shared_frames = 0 if prefix is None else prefix.shape[2]
+                decoded.append((decoder.submit(_decode, model.autoencoder, codes), codes.shape[2], shared_frames))
+                prefix = codes[..., -prefix_frames:] if prefix_frames > 0 else None
+                if progress_callback is not None:
+                    progress_callback(i + 1, len(segments))
+        else:
+            futures = [scheduler.submit(conditioning(segment), **generate_kwargs) for segment in segments]
+            for i, future in enumerate(futures):
+                codes = future.result()
+                decoded.append((decoder.submit(_decode, model.autoencoder, codes), codes.shape[2], 0))
+                if progress_callback is not None:
+                    progress_callback(i + 1, len(segments))
+
+        wav = None
+        for future, frames, shared_frames in decoded:
+            audio = future.result()
+            if wav is None:
+                wav = audio
+                continue
+            if shared_frames:
+                # the segment starts with the audio of the previous segment's tail: blend over all of it
+                overlap = shared_frames * (audio.shape[-1] // frames)
+            else:
+                overlap = int(crossfade_ms * model.autoencoder.sampling_rate / 1000)
+            wav = crossfade(wav, audio, overlap)
+    return wav
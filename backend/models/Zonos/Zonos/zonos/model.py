@@ -1,5 +1,5 @@
 import json
-from typing import Callable
+from typing import Callable, Iterator
 
 import safetensors
 import torch
@@ -9,11 +9,13 @@ from tqdm import tqdm
 
 from zonos.autoencoder import DACAutoencoder
 from zonos.backbone import BACKBONES
+from zonos.cache_pool import KVCachePool, estimate_audio_tokens
 from zonos.codebook_pattern import apply_delay_pattern, revert_delay_pattern
 from zonos.conditioning import PrefixConditioner
 from zonos.config import InferenceParams, ZonosConfig
 from zonos.sampling import sample_from_logits
 from zonos.speaker_cloning import SpeakerEmbeddingLDA
+from zonos.streaming import stream_generate
 from zonos.utils import DEFAULT_DEVICE, find_multiple, pad_weight_
 
 DEFAULT_BACKBONE_CLS = next(iter(BACKBONES.values()))
@@ -43,6 +45,9 @@ class Zonos(nn.Module):
         self._cg_inference_params = None
         self._cg_scale = None
 
+        # KV caches of the torch backbone are pooled, sized from the text and grown on demand
+        self.cache_pool = KVCachePool(self.backbone) if self.can_grow_cache() else None
+
         if config.pad_vocab_to_multiple_of:
             self.register_load_state_dict_post_hook(self._pad_embeddings_and_heads)
 
@@ -197,10 +202,37 @@ class Zonos(nn.Module):
 
     def setup_cache(self, batch_size: int, max_seqlen: int, dtype: torch.dtype = torch.bfloat16) -> InferenceParams:
         max_seqlen = find_multiple(max_seqlen, 8)
+        if self.cache_pool is not None:
+            return self.cache_pool.acquire(batch_size, max_seqlen, dtype=dtype)
         key_value_memory_dict = self.backbone.allocate_inference_cache(batch_size, max_seqlen, dtype=dtype)
         lengths_per_sample = torch.full((batch_size,), 0, dtype=torch.int32)
         return InferenceParams(max_seqlen, batch_size, 0, 0, key_value_memory_dict, lengths_per_sample)
 
+    def release_cache(self, inference_params: InferenceParams):
+        """Hand a cache from `setup_cache` back to the pool once it is no longer used."""
+        if self.cache_pool is not None:
+            self.cache_pool.release(inference_params)
+
+    def _grow_cache(self, inference_params: InferenceParams, max_seqlen: int) -> InferenceParams:
+        """Move a cache whose reserved length ran out into a larger one, keeping its contents."""
+        with torch.device(self.device):
+            grown = self.setup_cache(inference_params.max_batch_size, max_seqlen)
+        for i, (kv_cache, _) in inference_params.key_value_memory_dict.items():
+            grown.key_value_memory_dict[i][0][:, : inference_params.seqlen_offset] = kv_cache[:, : inference_params.seqlen_offset]
+        grown.seqlen_offset = inference_params.seqlen_offset
+        grown.lengths_per_sample.copy_(inference_params.lengths_per_sample)
+        self.release_cache(inference_params)
+        self._cg_graph = None  # captured with the old cache
+        return grown
+
+    def estimate_new_tokens(self, prefix_conditioning: torch.Tensor) -> int:
+        """
+        Code frames the utterance is expected to need, from its phoneme count: every
+        conditioner but espeak adds one position to the prefix.
+        """
+        num_phonemes = prefix_conditioning.shape[1] - (len(self.prefix_conditioner.conditioners) - 1)
+        return estimate_audio_tokens(num_phonemes)
+
     def prepare_conditioning(self, cond_dict: dict, uncond_dict: dict | None = None) -> torch.Tensor:
         if uncond_dict is None:
             uncond_dict = {k: cond_dict[k] for k in self.prefix_conditioner.required_keys}
@@ -211,6 +243,10 @@ class Zonos(nn.Module):
             ]
         )
 
+    def can_grow_cache(self) -> bool:
+        # Only the torch backbone's cache is plain K/V that can be copied into a larger one
+        return "_torch" in str(self.backbone.__class__)
+
     def can_use_cudagraphs(self) -> bool:
         # Only the mamba-ssm backbone supports CUDA Graphs at the moment
         return self.device.type == "cuda" and "_mamba_ssm" in str(self.backbone.__class__)
@@ -240,9 +276,13 @@ class Zonos(nn.Module):
         unknown_token = -1
         audio_seq_len = prefix_audio_len + max_new_tokens
         seq_len = prefix_conditioning.shape[1] + audio_seq_len + 9
+        # Reserve only what the text is expected to need; the cache grows if the audio runs longer
+        reserved_len = seq_len
+        if self.can_grow_cache():
+            reserved_len = min(seq_len, seq_len - max_new_tokens + self.estimate_new_tokens(prefix_conditioning))
 
         with torch.device(device):
-            inference_params = self.setup_cache(batch_size=batch_size * 2, max_seqlen=seq_len)
+            inference_params = self.setup_cache(batch_size=batch_size * 2, max_seqlen=reserved_len)
             codes = torch.full((batch_size, 9, audio_seq_len), unknown_token)
 
         if audio_prefix_codes is not None:
@@ -272,8 +312,14 @@ class Zonos(nn.Module):
         progress = tqdm(total=max_steps, desc="Generating", disable=not progress_bar)
         cfg_scale = torch.tensor(cfg_scale)
 
+        # step 0 reports the frame sampled by the prefill, so a callback sees every frame
+        if callback is not None and not callback(frame, 0, max_steps):
+            remaining_steps.zero_()
+
         step = 0
         while torch.max(remaining_steps) > 0:
+            if inference_params.seqlen_offset >= inference_params.max_seqlen:
+                inference_params = self._grow_cache(inference_params, min(2 * inference_params.max_seqlen, seq_len))
             offset += 1
             input_ids = delayed_codes[..., offset - 1 : offset]
             logits = decode_one_token(input_ids, inference_params, cfg_scale, allow_cudagraphs=cg)
@@ -311,5 +357,27 @@ class Zonos(nn.Module):
         out_codes = out_codes[..., : offset - 9]
 
         self._cg_graph = None  # reset cuda graph to avoid cache changes
+        self.release_cache(inference_params)
 
         return out_codes
+
+    def stream(
+        self,
+        prefix_conditioning: torch.Tensor,  # [2, cond_seq_len, d_model], one utterance
+        chunk_frames: int = 32,
+        first_chunk_frames: int = 8,
+        **kwargs,
+    ) -> Iterator[torch.Tensor]:
+        """
+        `generate` one utterance and yield its audio as PCM chunks [1, samples] while it is
+        being generated, see `zonos.streaming.stream_generate`.
+        """
+        return stream_generate(
+            self.generate,
+            self.autoencoder,
+            prefix_conditioning,
+            chunk_frames=chunk_frames,
+            first_chunk_frames=first_chunk_frames,
+            progress_bar=False,
+            **kwargs,
+        )
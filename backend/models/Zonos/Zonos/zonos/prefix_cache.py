@@ -0,0 +1,76 @@
+import hashlib
+from collections import OrderedDict
+
+import torch
+
+
+class PrefixCache:
+    """
+    Per-layer K/V of conditioning prefixes already prefilled, shared across requests.
+
+    A conditioning row (one CFG branch of `prepare_conditioning`) is split into blocks of
+    `block_size` positions, each keyed by a hash chained over all the blocks before it, so a
+    key identifies the whole leading prefix up to that block. With causal attention the K/V
+    of those positions depend on nothing else, so a request whose leading blocks were seen
+    before copies their K/V into its cache rows and only prefills the rest: the same text
+    again (retries, several voices for one script) or a shared opening sentence.
+
+    Blocks are kept in an LRU of at most `max_bytes`. Not thread-safe; the scheduler's worker
+    thread is its only user.
+    """
+
+    def __init__(self, block_size: int = 16, max_bytes: int = 256 * 1024**2):
+        self.block_size = block_size
+        self.max_bytes = max_bytes
+        self._blocks: OrderedDict[str, torch.Tensor] = OrderedDict()
+        self._bytes = 0
+
+    def block_hashes(self, prefix: torch.Tensor) -> list[str]:
+        """Chained hashes of the full blocks of one conditioning row, [cond_seq_len, d_model]."""
+        data = prefix.detach().to("cpu").contiguous()
+        if data.dtype == torch.bfloat16:
+            data = data.view(torch.int16)  # numpy has no bfloat16, only the bytes matter
+        data = data.numpy()
+
+        h = hashlib.blake2b(digest_size=16)
+        h.update(str(tuple(data.shape[1:])).encode())
+        hashes = []
+        for start in range(0, data.shape[0] - self.block_size + 1, self.block_size):
+            h.update(data[start : start + self.block_size].tobytes())
+            hashes.append(h.copy().hexdigest())
+        return hashes
+
+    def match(self, hashes: list[str]) -> int:
+        """Number of leading blocks held by the cache."""
+        count = 0
+        for key in hashes:
+            if key not in self._blocks:
+                break
+            self._blocks.move_to_end(key)
+            count += 1
+        return count
+
+    def load(self, hashes: list[str], key_value_memory_dict: dict, row: int):
+        """Copy the K/V of the given (cached) leading blocks into positions [0, len * block_size) of a cache row."""
+        if not hashes:
+            return
+        blocks = torch.cat([self._blocks[key] for key in hashes], dim=1)
+        for i, (kv_cache, _) in key_value_memory_dict.items():
+            kv_cache[row, : blocks.shape[1]] = blocks[i]
+
+    def store(self, hashes: list[str], key_value_memory_dict: dict, row: int, start: int = 0):
+        """Keep the K/V of blocks `start:` of a freshly prefilled cache row."""
+        if start >= len(hashes):
+            return
+        begin, end = start * self.block_size, len(hashes) * self.block_size
+        # [n_layer, positions, 2, num_heads_kv, head_dim]
+        layers = torch.stack([kv_cache[row, begin:end] for kv_cache, _ in key_value_memory_dict.values()])
+        for key, block in zip(hashes[start:], layers.split(self.block_size, dim=1)):
+            if key in self._blocks:
+                continue
+            block = block.clone()
+            self._blocks[key] = block
+            self._bytes += block.numel() * block.element_size()
+        while self._bytes > self.max_bytes and self._blocks:
+            _, block = self._blocks.popitem(last=False)
+            self._bytes -= block.numel() * block.element_size()
@@ -0,0 +1,383 @@
+import threading
+from concurrent.futures import Future
+from typing import Callable
+
+import torch
+
+from zonos.backbone._torch import TorchZonosBackbone
+from zonos.codebook_pattern import apply_delay_pattern, revert_delay_pattern
+from zonos.config import InferenceParams
+from zonos.model import Zonos
+from zonos.prefix_cache import PrefixCache
+from zonos.sampling import sample_from_logits
+
+
+class _Sequence:
+    """Decode state of one request: its delayed codes, KV cache slot and stopping bookkeeping."""
+
+    def __init__(
+        self,
+        prefix_conditioning: torch.Tensor,
+        audio_prefix_codes: torch.Tensor | None,
+        max_new_tokens: int,
+        cfg_scale: float,
+        sampling_params: dict,
+        callback: Callable[[torch.Tensor, int, int], bool] | None,
+    ):
+        self.prefix_conditioning = prefix_conditioning
+        self.audio_prefix_codes = audio_prefix_codes
+        self.max_new_tokens = max_new_tokens
+        self.cfg_scale = cfg_scale
+        self.sampling_params = sampling_params
+        self.sampling_key = tuple(sorted(sampling_params.items()))
+        self.callback = callback
+        self.future = Future()
+
+        self.codes = None  # delayed codes, [1, 9, audio_seq_len + 9]
+        self.offset = 0  # index of the last frame written into `codes`
+        self.length = 0  # positions of this sequence held in its KV cache rows
+        self.step = 0
+        self.max_steps = 0
+        self.remaining_steps = 0
+        self.stopping = False
+
+    @property
+    def prefix_audio_len(self) -> int:
+        return 0 if self.audio_prefix_codes is None else self.audio_prefix_codes.shape[2]
+
+    @property
+    def seq_len(self) -> int:
+        return self.prefix_conditioning.shape[1] + self.prefix_audio_len + self.max_new_tokens + 9
+
+    def reserved_len(self, estimated_new_tokens: int) -> int:
+        """Positions the sequence is expected to need, for an estimate of its audio length."""
+        return self.seq_len - self.max_new_tokens + min(self.max_new_tokens, estimated_new_tokens)
+
+
+class GenerationScheduler:
+    """
+    Continuous batching for `Zonos.generate`.
+
+    Requests from any number of threads are decoded together by one worker thread. A new
+    request is prefilled into a free slot of a shared KV cache at the next step boundary and
+    joins the running decode batch; a finished one returns its codes and frees its slot at
+    once, instead of waiting for the longest sequence of a fixed batch.
+
+    Slot `s` holds the conditional and unconditional CFG rows `2s` and `2s + 1` of the cache.
+    Active slots are kept packed at the front (a finished slot is refilled with the last
+    one), so every decode step runs over one contiguous range of rows, with per-row positions
+    (`InferenceParams.ragged`).
+
+    The cache is not allocated for `max_batch_size` rows of `max_seqlen` positions up front: it
+    holds as many slots as were in use at once, and as many positions as the active requests
+    are expected to need (`Zonos.estimate_new_tokens`, from the phoneme count). When a request
+    needs more of either, the cache is regrown, doubling up to those limits, and the K/V
+    written so far is copied over. Caches come from and return to the model's `KVCachePool`;
+    the cache is released whenever the scheduler runs idle.
+
+    Conditioning blocks already prefilled by an earlier request are copied from a
+    `PrefixCache` of `prefix_cache_bytes` (0 disables it) instead of being recomputed.
+
+    The forward of a decode step is wrapped in `torch.compile` like `Zonos.generate`'s
+    (dynamic shapes, the batch changes size as requests come and go), unless
+    `disable_torch_compile`.
+
+    Only the pure torch backbone keeps per-row positions; with any other backbone requests
+    fall back to `Zonos.generate`, one at a time.
+    """
+
+    def __init__(
+        self,
+        model: Zonos,
+        max_batch_size: int = 8,
+        max_seqlen: int = 4096,
+        prefix_cache_bytes: int = 256 * 1024**2,
+        disable_torch_compile: bool = False,
+    ):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_seqlen = max_seqlen
+        self.supported = isinstance(model.backbone, TorchZonosBackbone)
+        self.prefix_cache = PrefixCache(max_bytes=prefix_cache_bytes) if prefix_cache_bytes else None
+        self.eos_token_id = model.eos_token_id
+        self.masked_token_id = model.masked_token_id
+        self._step_logits = torch.compile(self._compute_step_logits, dynamic=True, disable=disable_torch_compile)
+
+        self._pending: list[_Sequence] = []
+        self._active: list[_Sequence] = []
+        self._cache = None
+        self._cache_params = None  # as returned by `setup_cache`, to release the cache
+        self._cache_slots = 0
+        self._cache_seqlen = 0
+        self._condition = threading.Condition()
+        self._fallback_lock = threading.Lock()
+        self._worker = None
+
+    def submit(
+        self,
+        prefix_conditioning: torch.Tensor,  # [2, cond_seq_len, d_model], from `prepare_conditioning`
+        audio_prefix_codes: torch.Tensor | None = None,  # [1, 9, prefix_audio_seq_len]
+        max_new_tokens: int = 86 * 30,
+        cfg_scale: float = 2.0,
+        sampling_params: dict = dict(min_p=0.1),
+        callback: Callable[[torch.Tensor, int, int], bool] | None = None,
+    ) -> Future:
+        """Queue one utterance; the future resolves to its codes, as returned by `Zonos.generate`."""
+        assert cfg_scale != 1, "TODO: add support for cfg_scale=1"
+        if prefix_conditioning.shape[0] != 2:
+            raise ValueError("The scheduler takes one utterance per request (conditional and unconditional prefix)")
+        seq = _Sequence(prefix_conditioning, audio_prefix_codes, max_new_tokens, cfg_scale, sampling_params, callback)
+        if seq.seq_len > self.max_seqlen:
+            raise ValueError(f"Request needs {seq.seq_len} positions, the scheduler holds {self.max_seqlen}")
+
+        with self._condition:
+            self._pending.append(seq)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="zonos-scheduler", daemon=True)
+                self._worker.start()
+            self._condition.notify()
+        return seq.future
+
+    def generate(self, prefix_conditioning: torch.Tensor, **kwargs) -> torch.Tensor:
+        """Blocking `submit`, a drop-in for `Zonos.generate` with batch size 1."""
+        return self.submit(prefix_conditioning, **kwargs).result()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._active:
+                    self._condition.wait()
+                if self.supported:
+                    admitted = self._pending[: self.max_batch_size - len(self._active)]
+                else:
+                    admitted = self._pending[:1]
+                del self._pending[: len(admitted)]
+
+            if not self.supported:
+                self._run_unbatched(admitted[0])
+                continue
+
+            with torch.inference_mode():
+                for seq in admitted:
+                    self._admit(seq)
+                if self._active:
+                    try:
+                        self._decode_step()
+                    except Exception as e:
+                        for seq in self._active:
+                            if not seq.future.done():  # not already failed by its callback
+                                seq.future.set_exception(e)
+                        self._active = []
+                if not self._active and self._cache is not None:
+                    self.model.release_cache(self._cache_params)
+                    self._cache = self._cache_params = None
+                    self._cache_slots = self._cache_seqlen = 0
+
+    def _run_unbatched(self, seq: _Sequence):
+        try:
+            with self._fallback_lock:
+                codes = self.model.generate(
+                    seq.prefix_conditioning,
+                    seq.audio_prefix_codes,
+                    max_new_tokens=seq.max_new_tokens,
+                    cfg_scale=seq.cfg_scale,
+                    sampling_params=seq.sampling_params,
+                    progress_bar=False,
+                    callback=seq.callback,
+                )
+            seq.future.set_result(codes)
+        except Exception as e:
+            seq.future.set_exception(e)
+
+    def _inference_params(self, batch_size_offset: int, lengths_per_sample: torch.Tensor, **kwargs) -> InferenceParams:
+        return InferenceParams(
+            self._cache_seqlen,
+            2 * self._cache_slots,
+            batch_size_offset=batch_size_offset,
+            key_value_memory_dict=self._cache,
+            lengths_per_sample=lengths_per_sample,
+            **kwargs,
+        )
+
+    def _ensure_cache(self, slots: int, seqlen: int):
+        """Make the cache hold at least `slots` slots of `seqlen` positions, keeping the active sequences."""
+        if self._cache is not None and slots <= self._cache_slots and seqlen <= self._cache_seqlen:
+            return
+        if self._cache is not None:
+            # grow geometrically, so a long sequence is not copied over at every step
+            if slots > self._cache_slots:
+                slots = max(slots, min(2 * self._cache_slots, self.max_batch_size))
+            if seqlen > self._cache_seqlen:
+                seqlen = max(seqlen, min(2 * self._cache_seqlen, self.max_seqlen))
+        slots = max(slots, self._cache_slots)
+        seqlen = max(seqlen, self._cache_seqlen)
+
+        with torch.device(self.model.device):
+            params = self.model.setup_cache(2 * slots, seqlen)
+        if self._cache is not None:
+            rows = 2 * len(self._active)
+            length = max((seq.length for seq in self._active), default=0)
+            for i, (kv_cache, _) in self._cache.items():
+                params.key_value_memory_dict[i][0][:rows, :length] = kv_cache[:rows, :length]
+                params.key_value_memory_dict[i][0][:rows, length:].zero_()
+            self.model.release_cache(self._cache_params)
+        self._cache = params.key_value_memory_dict
+        self._cache_params = params
+        self._cache_slots = params.max_batch_size // 2
+        self._cache_seqlen = params.max_seqlen
+
+    def _admit(self, seq: _Sequence):
+        """Prefill a new request into the next free slot and sample its first frame."""
+        try:
+            device = self.model.device
+            self._ensure_cache(len(self._active) + 1, seq.reserved_len(self.model.estimate_new_tokens(seq.prefix_conditioning)))
+
+            unknown_token = -1
+            prefix_audio_len = seq.prefix_audio_len
+            audio_seq_len = prefix_audio_len + seq.max_new_tokens
+            codes = torch.full((1, 9, audio_seq_len), unknown_token, device=device)
+            if seq.audio_prefix_codes is not None:
+                codes[..., :prefix_audio_len] = seq.audio_prefix_codes
+            seq.codes = apply_delay_pattern(codes, self.masked_token_id)
+
+            slot = len(self._active)
+            rows = (2 * slot, 2 * slot + 1)
+            # A ragged step reads every row up to the longest sequence, masking the positions past
+            # a row's own length; they must hold finite values (caches come uninitialized), as a
+            # NaN or inf there still turns the row's attention output into NaN.
+            for kv_cache, _ in self._cache.values():
+                kv_cache[2 * slot : 2 * slot + 2].zero_()
+
+            # Leading conditioning blocks seen before are copied in, only the rest is prefilled
+            start, cached_blocks = 0, 0
+            if self.prefix_cache is not None:
+                hashes = [self.prefix_cache.block_hashes(prefix) for prefix in seq.prefix_conditioning]
+                cached_blocks = min(self.prefix_cache.match(row_hashes) for row_hashes in hashes)
+                for row, row_hashes in zip(rows, hashes):
+                    self.prefix_cache.load(row_hashes[:cached_blocks], self._cache, row)
+                start = cached_blocks * self.prefix_cache.block_size
+
+            delayed_prefix_audio_codes = seq.codes[..., : prefix_audio_len + 1]
+            lengths = torch.full((2,), start, dtype=torch.int32, device=device)
+            logits = self.model._prefill(
+                seq.prefix_conditioning[:, start:],
+                delayed_prefix_audio_codes,
+                self._inference_params(2 * slot, lengths, seqlen_offset=start, ragged=start > 0),
+                seq.cfg_scale,
+            )
+            if self.prefix_cache is not None:
+                for row, row_hashes in zip(rows, hashes):
+                    self.prefix_cache.store(row_hashes, self._cache, row, cached_blocks)
+
+            next_token = sample_from_logits(logits, **seq.sampling_params)
+
+            seq.offset = delayed_prefix_audio_codes.shape[2]
+            frame = seq.codes[..., seq.offset : seq.offset + 1]
+            frame.masked_scatter_(frame == unknown_token, next_token)
+
+            seq.length = seq.prefix_conditioning.shape[1] + prefix_audio_len + 1
+            seq.max_steps = seq.codes.shape[2] - seq.offset
+            seq.remaining_steps = seq.max_steps
+        except Exception as e:
+            seq.future.set_exception(e)
+            return
+        self._active.append(seq)
+        if not self._notify(seq, frame):
+            self._finish(seq)
+
+    def _notify(self, seq: _Sequence, frame: torch.Tensor) -> bool:
+        """
+        Report a new frame to the request's callback; False once the sequence should stop. A
+        callback that raises fails its own request only, the rest of the batch keeps decoding.
+        """
+        if seq.callback is None:
+            return True
+        try:
+            return bool(seq.callback(frame, seq.step, seq.max_steps))
+        except Exception as e:
+            seq.future.set_exception(e)
+            return False
+
+    def _decode_step(self):
+        """One token for every active sequence, as one batch over their packed cache rows."""
+        active = self._active
+        device = self.model.device
+        self._ensure_cache(len(active), max(seq.length for seq in active) + 1)
+
+        input_ids = torch.cat([seq.codes[..., seq.offset : seq.offset + 1] for seq in active])
+        hidden_states = self.model.embed_codes(input_ids).repeat_interleave(2, dim=0)
+        lengths = torch.tensor([seq.length for seq in active], dtype=torch.int32, device=device).repeat_interleave(2)
+        inference_params = self._inference_params(0, lengths, seqlen_offset=max(seq.length for seq in active), ragged=True)
+        cfg_scale = torch.tensor([seq.cfg_scale for seq in active], device=device).view(-1, 1, 1)
+        logits = self._step_logits(hidden_states, inference_params, cfg_scale)
+        logits[:, 1:, self.eos_token_id] = -torch.inf  # only allow codebook 0 to predict EOS
+
+        next_token = self._sample(active, logits)
+        eos_in_cb0 = (next_token[:, 0, 0] == self.eos_token_id).tolist()
+
+        finished = []
+        for i, seq in enumerate(active):
+            if eos_in_cb0[i]:
+                seq.remaining_steps = min(seq.remaining_steps, 9)
+                seq.stopping = True
+            if seq.stopping:
+                idx = min(9 - seq.remaining_steps, 9 - 1)
+                next_token[i, :idx] = self.masked_token_id
+                next_token[i, idx] = self.eos_token_id
+
+            seq.offset += 1
+            seq.length += 1
+            seq.step += 1
+            seq.remaining_steps -= 1
+            frame = seq.codes[..., seq.offset : seq.offset + 1]
+            frame.masked_scatter_(frame == -1, next_token[i : i + 1])
+
+            if seq.remaining_steps <= 0 or not self._notify(seq, frame):
+                finished.append(seq)
+
+        for seq in finished:
+            self._finish(seq)
+
+    def _compute_step_logits(
+        self, hidden_states: torch.Tensor, inference_params: InferenceParams, cfg_scale: torch.Tensor
+    ) -> torch.Tensor:
+        """Guided logits of interleaved CFG rows, with a per-sequence `cfg_scale` [batch, 1, 1]."""
+        last_hidden_states = self.model.backbone(hidden_states, inference_params)[:, -1, :].unsqueeze(1)
+        logits = self.model.apply_heads(last_hidden_states).squeeze(2).float()
+        cond_logits, uncond_logits = logits.view(-1, 2, *logits.shape[1:]).unbind(1)
+        logits = uncond_logits + (cond_logits - uncond_logits) * cfg_scale
+        logits[..., 1025:].fill_(-torch.inf)  # ensures padding is ignored
+        return logits
+
+    def _sample(self, active: list[_Sequence], logits: torch.Tensor) -> torch.Tensor:
+        """Sample every sequence with its own parameters; sequences sharing them are sampled as one batch."""
+        groups = {}
+        for i, seq in enumerate(active):
+            window = seq.sampling_params.get("repetition_penalty_window", 2)
+            groups.setdefault((seq.sampling_key, min(window, seq.offset + 1)), []).append(i)
+
+        next_token = torch.empty(*logits.shape[:2], 1, dtype=torch.int64, device=logits.device)
+        for (_, width), indices in groups.items():
+            generated_tokens = torch.cat([active[i].codes[..., active[i].offset + 1 - width : active[i].offset + 1] for i in indices])
+            index = torch.tensor(indices, device=logits.device)
+            next_token[index] = sample_from_logits(
+                logits[index], generated_tokens=generated_tokens, **active[indices[0]].sampling_params
+            )
+        return next_token
+
+    def _finish(self, seq: _Sequence):
+        """Resolve a sequence and move the last active slot into its rows."""
+        slot = self._active.index(seq)
+        last = len(self._active) - 1
+        if slot != last:
+            moved = self._active[last]
+            for kv_cache, _ in self._cache.values():
+                kv_cache[2 * slot : 2 * slot + 2, : moved.length] = kv_cache[2 * last : 2 * last + 2, : moved.length]
+            self._active[slot] = moved
+        self._active.pop()
+
+        if seq.future.done():  # failed in its callback
+            return
+        out_codes = revert_delay_pattern(seq.codes)
+        out_codes.masked_fill_(out_codes >= 1024, 0)
+        seq.future.set_result(out_codes[..., : seq.offset - 9])
@@ -0,0 +1,170 @@
+import queue
+import struct
+import threading
+from typing import Callable, Iterator
+
+import torch
+
+from zonos.autoencoder import DACAutoencoder
+
+
+class StreamingDecoder:
+    """
+    Turns the delayed frames reported by `Zonos.generate`'s callback into PCM chunks.
+
+    Frame `i` of the audio is complete once the delayed frame `i + 8` has arrived (codebook
+    `k` is delayed by `k` frames). Complete frames are decoded by the DAC in windows that
+    overlap the neighbouring chunks: `context_frames` already sent frames on the left and
+    `lookahead_frames` not yet sent ones on the right are decoded along with the chunk and
+    trimmed off. The DAC decoder's receptive field reaches about 10 code frames to each side
+    (first conv, dilated residual units and transposed convs), so with both margins at least
+    that wide no sample that is sent depends on a window edge and the chunks join as if the
+    whole utterance had been decoded at once (`check_streaming_parity.py`). Narrower margins
+    cut latency at the cost of small discontinuities at the joins.
+    """
+
+    def __init__(
+        self,
+        autoencoder: DACAutoencoder,
+        eos_token_id: int = 1024,
+        chunk_frames: int = 32,
+        first_chunk_frames: int = 8,
+        context_frames: int = 16,
+        lookahead_frames: int = 12,
+    ):
+        self.autoencoder = autoencoder
+        self.eos_token_id = eos_token_id
+        self.chunk_frames = chunk_frames
+        self.first_chunk_frames = first_chunk_frames
+        self.context_frames = context_frames
+        self.lookahead_frames = lookahead_frames
+
+        self.delayed_frames: list[torch.Tensor] = []  # [9] each, on the host
+        self.frames: list[torch.Tensor] = []  # complete frames, [9] each
+        self.end = None  # number of frames before EOS, once it was sampled
+        self.sent = 0
+
+    def push(self, frame: torch.Tensor) -> torch.Tensor | None:
+        """Add the next delayed frame, [1, 9, 1]; returns a PCM chunk [1, samples] when one is ready."""
+        if frame.shape[0] != 1:
+            raise ValueError("Streaming supports one utterance at a time")
+        self.delayed_frames.append(frame[0, :, 0].to("cpu"))
+        self._update_frames()
+
+        target = self.first_chunk_frames if self.sent == 0 else self.chunk_frames
+        ready = len(self.frames)
+        if self.end is not None:
+            ready = min(ready, self.end)
+        if ready - self.lookahead_frames - self.sent < target:
+            return None
+        return self._decode(ready - self.lookahead_frames)
+
+    def flush(self) -> torch.Tensor | None:
+        """The rest of the audio once generation has finished."""
+        # `Zonos.generate` drops the last complete frame, which holds EOS or ran out of steps
+        total = max(len(self.delayed_frames) - 9, 0)
+        if self.end is not None:
+            total = min(total, self.end)
+        if total <= self.sent:
+            return None
+        return self._decode(total)
+
+    def _update_frames(self):
+        # revert_delay_pattern for the newest column: codebook k of frame i arrived in delayed frame i + k
+        i = len(self.delayed_frames) - 9
+        if i < 0:
+            return
+        frame = torch.stack([self.delayed_frames[i + k][k] for k in range(9)])
+        if self.end is None and frame[0].item() == self.eos_token_id:
+            self.end = i
+        self.frames.append(frame)
+
+    @torch.inference_mode()
+    def _decode(self, end: int) -> torch.Tensor:
+        start = max(self.sent - self.context_frames, 0)
+        stop = min(end + self.lookahead_frames, len(self.frames))
+        if self.end is not None:
+            stop = min(stop, self.end)
+        codes = torch.stack(self.frames[start:stop], dim=1).unsqueeze(0)
+        codes = codes.masked_fill(codes >= 1024, 0).to(self.autoencoder.dac.device)
+        audio = self.autoencoder.decode(codes)[0].cpu()
+        samples_per_frame = audio.shape[-1] // codes.shape[2]
+        chunk = audio[..., (self.sent - start) * samples_per_frame : (end - start) * samples_per_frame]
+        self.sent = end
+        return chunk
+
+
+def stream_generate(
+    generate: Callable[..., torch.Tensor],
+    autoencoder: DACAutoencoder,
+    prefix_conditioning: torch.Tensor,
+    chunk_frames: int = 32,
+    first_chunk_frames: int = 8,
+    context_frames: int = 16,
+    lookahead_frames: int = 12,
+    callback: Callable[[torch.Tensor, int, int], bool] | None = None,
+    **kwargs,
+) -> Iterator[torch.Tensor]:
+    """
+    Yield PCM chunks [1, samples] of one utterance while it is being generated.
+
+    `generate` is `Zonos.generate` or `GenerationScheduler.generate`; it runs on a separate
+    thread, so the DAC decode of a chunk overlaps the generation of the next frames. Closing
+    the iterator early (e.g. the client went away) stops the generation at the next step.
+    """
+    frames = queue.Queue()
+    cancelled = threading.Event()
+    done = object()
+
+    def on_frame(frame: torch.Tensor, step: int, max_steps: int) -> bool:
+        frames.put(frame.clone())
+        if callback is not None and not callback(frame, step, max_steps):
+            return False
+        return not cancelled.is_set()
+
+    def run():
+        try:
+            generate(prefix_conditioning, callback=on_frame, **kwargs)
+            frames.put(done)
+        except Exception as e:
+            frames.put(e)
+
+    decoder = StreamingDecoder(
+        autoencoder,
+        chunk_frames=chunk_frames,
+        first_chunk_frames=first_chunk_frames,
+        context_frames=context_frames,
+        lookahead_frames=lookahead_frames,
+    )
+    threading.Thread(target=run, name="zonos-stream", daemon=True).start()
+    try:
+        while True:
+            frame = frames.get()
+            if frame is done:
+                break
+            if isinstance(frame, Exception):
+                raise frame
+            chunk = decoder.push(frame)
+            if chunk is not None:
+                yield chunk
+        chunk = decoder.flush()
+        if chunk is not None:
+            yield chunk
+    finally:
+        cancelled.set()
+
+
+def stream_wav(chunks: Iterator[torch.Tensor], sample_rate: int) -> Iterator[bytes]:
+    """16-bit mono WAV bytes for a chunked HTTP response; the header leaves the length open."""
+    try:
+        # RIFF and data sizes are unknown while streaming, 0xFFFFFFFF is read as "until EOF"
+        yield (
+            b"RIFF" + struct.pack("<I", 0xFFFFFFFF) + b"WAVE"
+            + b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16)
+            + b"data" + struct.pack("<I", 0xFFFFFFFF)
+        )  # fmt: skip
+        for chunk in chunks:
+            pcm = (chunk.clamp(-1, 1) * 32767).to(torch.int16)
+            yield pcm.numpy().tobytes()
+    finally:
+        chunks.close()
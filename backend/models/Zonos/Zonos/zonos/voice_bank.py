@@ -0,0 +1,90 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import torch
+from safetensors.torch import load_file, save_file
+
+from zonos.model import Zonos
+
+_VOICE_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+def hash_audio(wav: torch.Tensor, sr: int) -> str:
+    """Content hash of a decoded clip, so re-encoded uploads of the same samples map to one voice."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(sr).encode())
+    h.update(str(tuple(wav.shape)).encode())
+    h.update(wav.detach().to("cpu", torch.float32).contiguous().numpy().tobytes())
+    return h.hexdigest()
+
+
+class VoiceBank:
+    """
+    Speaker embeddings of reference voices, computed once and then reused by ID.
+
+    `add(wav, sr)` runs `Zonos.make_speaker_embedding` only for audio it has not seen
+    before and returns the voice ID (a hash of the decoded samples). Embeddings are kept
+    in an in-memory LRU of `max_cached` entries and, if `root` is given, persisted there
+    as `<voice_id>.safetensors` so they survive restarts.
+    """
+
+    def __init__(self, model: Zonos, root: str | None = None, max_cached: int = 64):
+        self.model = model
+        self.root = root
+        self.max_cached = max_cached
+        self._cache: OrderedDict[str, torch.Tensor] = OrderedDict()
+        self._lock = threading.Lock()
+        if root is not None:
+            os.makedirs(root, exist_ok=True)
+
+    def _path(self, voice_id: str) -> str:
+        return os.path.join(self.root, f"{voice_id}.safetensors")
+
+    def _remember(self, voice_id: str, embedding: torch.Tensor):
+        with self._lock:
+            self._cache[voice_id] = embedding
+            self._cache.move_to_end(voice_id)
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+
+    def get(self, voice_id: str) -> torch.Tensor | None:
+        """Embedding of a stored voice, shaped like `make_speaker_embedding` output, or None if unknown."""
+        if not _VOICE_ID_RE.match(voice_id):
+            return None
+        with self._lock:
+            embedding = self._cache.get(voice_id)
+            if embedding is not None:
+                self._cache.move_to_end(voice_id)
+                return embedding
+
+        if self.root is None or not os.path.exists(self._path(voice_id)):
+            return None
+        embedding = load_file(self._path(voice_id))["speaker"].to(self.model.device, torch.bfloat16)
+        self._remember(voice_id, embedding)
+        return embedding
+
+    def __contains__(self, voice_id: str) -> bool:
+        return self.get(voice_id) is not None
+
+    def add(self, wav: torch.Tensor, sr: int) -> str:
+        """Register a reference clip and return its voice ID."""
+        return self.embed(wav, sr)[0]
+
+    def embed(self, wav: torch.Tensor, sr: int) -> tuple[str, torch.Tensor]:
+        """Return `(voice_id, embedding)` for a clip, computing the embedding only on a miss."""
+        voice_id = hash_audio(wav, sr)
+        embedding = self.get(voice_id)
+        if embedding is not None:
+            return voice_id, embedding
+
+        embedding = self.model.make_speaker_embedding(wav, sr)
+        if self.root is not None:
+            # Write to a temp name first so a concurrent reader never sees a partial file
+            tmp_path = self._path(voice_id) + f".{threading.get_ident()}.tmp"
+            save_file({"speaker": embedding.to("cpu", torch.float32).contiguous()}, tmp_path)
+            os.replace(tmp_path, self._path(voice_id))
+        self._remember(voice_id, embedding)
+        return voice_id, embedding
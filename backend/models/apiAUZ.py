@@ -1,5 +1,8 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file
 from flask_cors import CORS
+import io
+import json
+import zipfile
 import os
 import sys
 import subprocess
@@ -20,51 +23,110 @@ warnings.filterwarnings("ignore", category=UserWarning)
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), 'Zonos', 'Zonos')))
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), 'AniTalker','code')))
 
+import numpy as np
 import torch
 import torchaudio
 from AniTalker.code.demo import main, get_arg_parser
+from AniTalker.code.engine import AvatarEngine
+from AniTalker.code.avatar_store import AvatarStore
 from Zonos.Zonos.zonos.model import Zonos
 from Zonos.Zonos.zonos.conditioning import make_cond_dict
 from Zonos.Zonos.zonos.utils import DEFAULT_DEVICE as device
+from Zonos.Zonos.zonos.voice_bank import VoiceBank
+from Zonos.Zonos.zonos.scheduler import GenerationScheduler
+from Zonos.Zonos.zonos.long_form import synthesize_long
+from Zonos.Zonos.zonos.streaming import stream_generate, stream_wav
+from jobs import JobQueue
+from workspace import Workspace
 
 app = Flask(__name__)
 CORS(app)
 
-UPLOAD_FOLDER = os.path.abspath("uploadsAZ")
-OUTPUT_FOLDER = os.path.abspath("outputs")
-
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+# Every request gets its own directory under here, see workspace.Workspace
+WORKSPACE_ROOT = os.path.abspath(os.environ.get("AVATAR_WORKSPACE_ROOT", "workspaces"))
+os.makedirs(WORKSPACE_ROOT, exist_ok=True)
+
+# Speaker embeddings of every reference voice seen so far, see zonos.voice_bank.VoiceBank
+VOICE_BANK_DIR = os.path.abspath(os.environ.get("ZONOS_VOICE_BANK_DIR", "voice_bank"))
+
+# Motion diffusion sampler and its number of steps; dpmsolver++ gives comparable motion in 8-15 steps
+AVATAR_SAMPLERS = ("ddpm", "ddim", "dpmsolver++")
+AVATAR_SAMPLER = os.environ.get("AVATAR_SAMPLER", "ddim")
+AVATAR_STEP_T = int(os.environ.get("AVATAR_STEP_T", 50))
+# Most takes one /runBatch request may denoise (and render) at once
+AVATAR_MAX_TAKES = int(os.environ.get("AVATAR_MAX_TAKES", 8))
+
+# Concurrent TTS requests share one Zonos decode batch of up to this many utterances, see zonos.scheduler
+ZONOS_MAX_BATCH_SIZE = int(os.environ.get("ZONOS_MAX_BATCH_SIZE", 8))
+# Texts longer than this are synthesized segment by segment, see zonos.long_form
+ZONOS_LONG_TEXT_CHARS = int(os.environ.get("ZONOS_LONG_TEXT_CHARS", 250))
+# K/V of conditioning prefixes (same text, shared opening) reused across TTS requests; 0 disables it
+ZONOS_PREFIX_CACHE_MB = int(os.environ.get("ZONOS_PREFIX_CACHE_MB", 256))
+# Longest utterance (positions) the shared TTS KV cache may grow to; it is sized per request below that
+ZONOS_MAX_SEQLEN = int(os.environ.get("ZONOS_MAX_SEQLEN", 4096))
+
+# Number of avatar jobs allowed to run at the same time
+MAX_CONCURRENT_JOBS = int(os.environ.get("AVATAR_MAX_CONCURRENT_JOBS", 1))
+job_queue = JobQueue(max_workers=MAX_CONCURRENT_JOBS)
 
 # Load Zonos model (your original code)
 try:
     print("Downloading model(ZONOS)...")
     model = Zonos.from_pretrained("Zyphra/Zonos-v0.1-transformer", device=device)
+    voice_bank = VoiceBank(model, root=VOICE_BANK_DIR)
+    tts_scheduler = GenerationScheduler(model, max_batch_size=ZONOS_MAX_BATCH_SIZE, max_seqlen=ZONOS_MAX_SEQLEN,
+                                        prefix_cache_bytes=ZONOS_PREFIX_CACHE_MB * 1024 ** 2)
     print("\nModel download and integrated succesfully!!!\n")
 except:
     print("Error in downloading model...")
 
+AVATAR_BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), 'AniTalker'))
+AVATAR_CKPT_DIR = os.path.join(AVATAR_BASE_DIR, "ckpts")
+
+# Encoded portraits, so a returning avatar skips enhancement and the encoder
+avatar_store = AvatarStore(os.path.join(AVATAR_BASE_DIR, "avatars"))
+
+# AniTalker checkpoints stay resident; every avatar request reuses this engine
+avatar_engine = None
+try:
+    print("Loading model(AniTalker)...")
+    avatar_engine = AvatarEngine(
+        stage1_checkpoint_path=os.path.join(AVATAR_CKPT_DIR, "stage1.ckpt"),
+        stage2_checkpoint_path=os.path.join(AVATAR_CKPT_DIR, "stage2_audio_only_hubert.ckpt"),
+        infer_type="hubert_audio_only",
+        device="cpu",
+        hubert_model_path=os.path.join(AVATAR_CKPT_DIR, "chinese-hubert-large"),
+        feature_cache_dir=os.path.join(AVATAR_BASE_DIR, "hubert_cache"),
+        feature_cache_max_bytes=int(os.environ.get("AVATAR_HUBERT_CACHE_MB", 4096)) * 1024 ** 2,
+        # long narrations are diffused in windows of this many frames (0 disables it), bounding memory
+        motion_window=int(os.environ.get("AVATAR_MOTION_WINDOW", 0)),
+        motion_window_mode=os.environ.get("AVATAR_MOTION_WINDOW_MODE", "chained"),
+        # HuBERT stops after the layers holding this share of the HAL weight (1.0 runs all of them)
+        hubert_weight_mass=float(os.environ.get("AVATAR_HUBERT_WEIGHT_MASS", 1.0)),
+    )
+    print("\nModel loaded succesfully!!!\n")
+except Exception as e:
+    print(f"Error in loading model(AniTalker): {e}")
+
 @app.route("/")  
 def check_active():
     return jsonify({"status": "active"})
 
-def enhance_image(image_filename):
+def enhance_image(input_path, output_dir):
     print("Upscaling the Image...")
     REAL_ESRGAN_DIR = os.path.abspath("Real-ESRGAN")
-    INPUT_PATH = os.path.join(UPLOAD_FOLDER, image_filename)
-    OUTPUT_DIR = OUTPUT_FOLDER
 
-    if not os.path.exists(INPUT_PATH):
-        return False, f"Input image not found: {INPUT_PATH}"
+    if not os.path.exists(input_path):
+        return False, f"Input image not found: {input_path}"
 
     command = [
         sys.executable,
         os.path.join(REAL_ESRGAN_DIR, "inference_realesrgan.py"),
         "-n", "RealESRGAN_x4plus",
-        "-i", INPUT_PATH,
+        "-i", input_path,
         "--face_enhance",
         "--fp32",
-        "-o", OUTPUT_DIR
+        "-o", output_dir
     ]
 
     result = subprocess.run(command, capture_output=True, text=True, cwd=REAL_ESRGAN_DIR)
@@ -72,8 +134,8 @@ def enhance_image(image_filename):
     if result.returncode != 0:
         return False, f"Enhancement failed. STDERR: {result.stderr}"
 
-    input_base = os.path.splitext(os.path.basename(image_filename))[0]
-    output_pattern = os.path.join(OUTPUT_DIR, f"{input_base}_out.png")
+    input_base = os.path.splitext(os.path.basename(input_path))[0]
+    output_pattern = os.path.join(output_dir, f"{input_base}_out.png")
     matching_files = glob.glob(output_pattern)
 
     if not matching_files:
@@ -83,6 +145,12 @@ def enhance_image(image_filename):
     print("Upscaling completed...")
     return True, output_path
 
+def send_and_cleanup(ws, path, **kwargs):
+    # The workspace is removed once the response body has been streamed to the client
+    response = send_file(path, **kwargs)
+    response.call_on_close(ws.cleanup)
+    return response
+
 @app.route('/enhance-image', methods=['POST'])
 def api_enhance_image():
     if 'image' not in request.files:
@@ -92,28 +160,35 @@ def api_enhance_image():
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
 
-    # Save uploaded file
-    filename = file.filename
-    save_path = os.path.join(UPLOAD_FOLDER, filename)
-    file.save(save_path)
+    ws = Workspace(WORKSPACE_ROOT)
+    save_path = ws.save(file, "image")
 
-    success, result = enhance_image(filename)
+    success, result = enhance_image(save_path, ws.dir)
     if not success:
+        ws.cleanup()
         return jsonify({"error": result}), 500
 
     # Return the enhanced image file
-    return send_file(result, mimetype='image/png')
+    return send_and_cleanup(ws, result, mimetype='image/png')
 
-def generate_tts_audio(audio_file_path, text, output_path="./outputs/output.wav"):
+def generate_tts_audio(audio_file_path, text, output_path="./outputs/output.wav", callback=None, voice_id=None):
     try:
         print("Creating audio file...")
-        wav, sampling_rate = torchaudio.load(audio_file_path)
-        speaker = model.make_speaker_embedding(wav, sampling_rate)
+        speaker, error = speaker_for(audio_file_path, voice_id)
+        if error:
+            return None, error
+
+        if len(text) > ZONOS_LONG_TEXT_CHARS:
+            progress = (lambda done, total: callback(None, done, total)) if callback is not None else None
+            wav = synthesize_long(tts_scheduler, text, speaker, max_chars=ZONOS_LONG_TEXT_CHARS,
+                                  progress_callback=progress)
+            torchaudio.save(output_path, wav, model.autoencoder.sampling_rate)
+            return output_path, None
 
         cond_dict = make_cond_dict(text=text, speaker=speaker, language="en-us")
         conditioning = model.prepare_conditioning(cond_dict)
 
-        codes = model.generate(conditioning)
+        codes = tts_scheduler.generate(conditioning, callback=callback)
         wavs = model.autoencoder.decode(codes).cpu()
 
         torchaudio.save(output_path, wavs[0], model.autoencoder.sampling_rate)
@@ -121,43 +196,90 @@ def generate_tts_audio(audio_file_path, text, output_path="./outputs/output.wav"
     except Exception as e:
         return None, str(e)
 
+def speaker_for(audio_file_path, voice_id=None):
+    # A saved voice skips the speaker encoder; a new upload is embedded once and then saved
+    if voice_id:
+        speaker = voice_bank.get(voice_id)
+        if speaker is None:
+            return None, f"Unknown voice_id: {voice_id}"
+        return speaker, None
+    wav, sampling_rate = torchaudio.load(audio_file_path)
+    _, speaker = voice_bank.embed(wav, sampling_rate)
+    return speaker, None
+
+@app.route('/voices', methods=['POST'])
+def add_voice():
+    audio_file = request.files.get('audio')
+    if not audio_file:
+        return jsonify({'error': 'Audio file is required'}), 400
+
+    try:
+        wav, sampling_rate = torchaudio.load(audio_file)
+        voice_id = voice_bank.add(wav, sampling_rate)
+    except Exception as e:
+        return jsonify({'error': f'Could not create voice: {e}'}), 500
+
+    return jsonify({'voice_id': voice_id}), 201
+
+@app.route('/voices/<voice_id>', methods=['GET'])
+def voice_status(voice_id):
+    if voice_id not in voice_bank:
+        return jsonify({'error': 'Voice not found'}), 404
+    return jsonify({'voice_id': voice_id})
+
 @app.route("/inf", methods=["POST"])
 def TTS():
     print(request.form)
-    if "audio" not in request.files or "text" not in request.form:
-        return jsonify({"error": "Please provide both an audio file and text"}), 400
+    voice_id = request.form.get("voice_id")
+    if ("audio" not in request.files and not voice_id) or "text" not in request.form:
+        return jsonify({"error": "Please provide an audio file (or voice_id) and text"}), 400
 
-    audio_file = request.files["audio"]
     text = request.form["text"]
 
-    audio_path = os.path.join(UPLOAD_FOLDER, audio_file.filename)
-    audio_file.save(audio_path)
+    ws = Workspace(WORKSPACE_ROOT)
+    audio_path = ws.save(request.files["audio"], "reference") if not voice_id else None
 
-    output_path = os.path.join(OUTPUT_FOLDER, "output.wav")
-    result_path, error = generate_tts_audio(audio_path, text, output_path)
+    result_path, error = generate_tts_audio(audio_path, text, ws.path("output.wav"), voice_id=voice_id)
 
     if error:
+        ws.cleanup()
         return jsonify({"status": f"TTS generation failed: {error}"}), 500
     print("Successfully generated audio")
 
-    return send_file(result_path, as_attachment=True)
+    return send_and_cleanup(ws, result_path, as_attachment=True)
+
+@app.route("/inf/stream", methods=["POST"])
+def TTS_stream():
+    # Same inputs as /inf; the WAV is sent in chunks while it is generated instead of at the end
+    voice_id = request.form.get("voice_id")
+    if ("audio" not in request.files and not voice_id) or "text" not in request.form:
+        return jsonify({"error": "Please provide an audio file (or voice_id) and text"}), 400
 
-def generate_avatar_video(image_file, audio_path, infer_type="hubert_audio_only", seed=0):
+    try:
+        speaker, error = speaker_for(request.files.get("audio"), voice_id)
+        if error:
+            return jsonify({"error": error}), 404
+        cond_dict = make_cond_dict(text=request.form["text"], speaker=speaker, language="en-us")
+        conditioning = model.prepare_conditioning(cond_dict)
+    except Exception as e:
+        return jsonify({"status": f"TTS generation failed: {e}"}), 500
+
+    chunks = stream_generate(tts_scheduler.generate, model.autoencoder, conditioning)
+    return Response(stream_wav(chunks, model.autoencoder.sampling_rate), mimetype="audio/wav")
+
+def generate_avatar_video(image_path, audio_path, output_dir, infer_type="hubert_audio_only", seed=0, progress_callback=None,
+                          profile=None, sampler=None, step_T=None):
     try:
         print("Creating Avatar...")
-        image_filename = os.path.splitext(image_file.filename)[0]
+        image_filename = os.path.splitext(os.path.basename(image_path))[0]
         audio_filename = os.path.splitext(os.path.basename(audio_path))[0]
 
-        image_path = os.path.join(UPLOAD_FOLDER, image_file.filename)
-        image_file.save(image_path)
+        if avatar_engine is None:
+            return None, "Avatar model is not loaded"
+        if infer_type != avatar_engine.infer_type:
+            return None, f"infer_type {infer_type} is not supported, the server is loaded for {avatar_engine.infer_type}"
 
         parser = get_arg_parser()
-        base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'AniTalker'))
-        ckpt_dir = os.path.join(base_dir, "ckpts")
-        output_dir = os.path.join(base_dir, "output")
-
-        stage1_ckpt = os.path.join(ckpt_dir, "stage1.ckpt")
-        stage2_ckpt = os.path.join(ckpt_dir, "stage2_audio_only_hubert.ckpt")
 
         args_list = [
             "--test_image_path", image_path,
@@ -165,13 +287,13 @@ def generate_avatar_video(image_file, audio_path, infer_type="hubert_audio_only"
             "--infer_type", infer_type,
             "--seed", str(seed),
             "--device", "cpu",
-            "--stage1_checkpoint_path", stage1_ckpt,
-            "--stage2_checkpoint_path", stage2_ckpt,
-            "--result_path", output_dir
+            "--result_path", output_dir,
+            "--sampler", sampler or AVATAR_SAMPLER,
+            "--step_T", str(step_T or AVATAR_STEP_T)
         ]
 
         args = parser.parse_args(args_list)
-        main(args)
+        main(args, engine=avatar_engine, progress_callback=progress_callback, profile=profile)
 
         output_filename = f"{image_filename}-{audio_filename}.mp4"
         output_filepath = os.path.join(output_dir, output_filename)
@@ -183,6 +305,55 @@ def generate_avatar_video(image_file, audio_path, infer_type="hubert_audio_only"
     except Exception as e:
         return None, str(e)
 
+def prepare_avatar(ws, image_path, avatar_id=None, enhance=False, job=None):
+    # A portrait seen before (same bytes, same preprocessing) reuses its stored encoding
+    if avatar_engine is None:
+        raise RuntimeError("Avatar model is not loaded")
+
+    if not avatar_id:
+        avatar_id = AvatarStore.make_id(image_path, "enhance" if enhance else "original")
+    elif avatar_id not in avatar_store:
+        raise RuntimeError(f'Unknown avatar_id: {avatar_id}')
+
+    profile = avatar_store.get(avatar_id, device=avatar_engine.device)
+    if profile is not None:
+        print("Using stored avatar...")
+        return profile
+
+    if enhance:
+        if job is not None:
+            job.update("enhance")
+        success, enhanced_image_path_or_err = enhance_image(image_path, ws.dir)
+        if not success:
+            raise RuntimeError(f'Image enhancement failed: {enhanced_image_path_or_err}')
+        image_path = enhanced_image_path_or_err
+
+    start, direction, feats = avatar_engine.encode_image(image_path)
+    return avatar_store.put(avatar_id, image_path, start, direction, feats, image_size=avatar_engine.image_size)
+
+@app.route('/avatars', methods=['POST'])
+def add_avatar():
+    image_file = request.files.get('image')
+    enhance = request.form.get('enhance', 'false').lower() == 'true'
+    if not image_file:
+        return jsonify({'error': 'Image file is required'}), 400
+
+    ws = Workspace(WORKSPACE_ROOT)
+    try:
+        profile = prepare_avatar(ws, ws.save(image_file, "image"), enhance=enhance)
+    except Exception as e:
+        return jsonify({'error': f'Could not create avatar: {e}'}), 500
+    finally:
+        ws.cleanup()
+
+    return jsonify({'avatar_id': profile.avatar_id}), 201
+
+@app.route('/avatars/<avatar_id>', methods=['GET'])
+def avatar_status(avatar_id):
+    if avatar_id not in avatar_store:
+        return jsonify({'error': 'Avatar not found'}), 404
+    return jsonify({'avatar_id': avatar_id})
+
 @app.route('/run', methods=['POST'])
 def run_inference():
     image_file = request.files.get('image')
@@ -193,15 +364,111 @@ def run_inference():
 
     infer_type = request.form.get('infer_type', 'hubert_audio_only')
     seed = int(request.form.get('seed', 0))
+    sampler = request.form.get('sampler', AVATAR_SAMPLER)
+    step_T = int(request.form.get('step_T', AVATAR_STEP_T))
+    if sampler not in AVATAR_SAMPLERS:
+        return jsonify({'error': f'sampler must be one of {", ".join(AVATAR_SAMPLERS)}'}), 400
+
+    ws = Workspace(WORKSPACE_ROOT)
+    image_path = ws.save(image_file, "image")
+    audio_path = ws.save(audio_file, "audio")
 
-    output_path, error = generate_avatar_video(image_file, audio_file, infer_type, seed)
+    output_path, error = generate_avatar_video(image_path, audio_path, ws.dir, infer_type, seed, sampler=sampler,
+                                               step_T=step_T)
 
     if error:
+        ws.cleanup()
         return jsonify({'error': error}), 500
 
     print("Avatar created")
 
-    return send_file(output_path, mimetype='video/mp4', as_attachment=True, download_name=os.path.basename(output_path))
+    return send_and_cleanup(ws, output_path, mimetype='video/mp4', as_attachment=True,
+                            download_name=os.path.basename(output_path))
+
+
+CONTROL_KEYS = ("pose_yaw", "pose_pitch", "pose_roll", "face_location", "face_scale")
+
+def generate_avatar_takes(image_path, audio_path, output_dir, seeds, controls=None, render=True, sampler=None,
+                          step_T=None):
+    # Several takes of one portrait and audio denoised as one batch, see AvatarEngine.generate_batch.
+    # Returns a zip with the N x T x motion_dim trajectories (motions.npy) and, if rendered, the N videos.
+    try:
+        print("Creating Avatar takes...")
+        if avatar_engine is None:
+            return None, "Avatar model is not loaded"
+
+        image_filename = os.path.splitext(os.path.basename(image_path))[0]
+        audio_filename = os.path.splitext(os.path.basename(audio_path))[0]
+        num_takes = max(len(seeds), len(controls or [None]))
+        output_paths = None
+        if render:
+            output_paths = [os.path.join(output_dir, f"{image_filename}-{audio_filename}_{i}.mp4") for i in range(num_takes)]
+
+        # Explicit control sets only steer the motion with control_flag; without it they are predicted
+        motions, video_paths = avatar_engine.generate_batch(image_path, audio_path, output_paths, seeds=seeds,
+                                                            controls=controls, control_flag=bool(controls),
+                                                            step_T=step_T or AVATAR_STEP_T,
+                                                            sampler=sampler or AVATAR_SAMPLER)
+
+        archive_path = os.path.join(output_dir, "takes.zip")
+        with zipfile.ZipFile(archive_path, "w") as archive:
+            buffer = io.BytesIO()
+            np.save(buffer, motions)
+            archive.writestr("motions.npy", buffer.getvalue())
+            for path in video_paths or []:
+                archive.write(path, os.path.basename(path))
+        return archive_path, None
+
+    except Exception as e:
+        return None, str(e)
+
+
+@app.route('/runBatch', methods=['POST'])
+def run_batch_inference():
+    image_file = request.files.get('image')
+    audio_file = request.files.get('audio')
+
+    if not image_file or not audio_file:
+        return jsonify({'error': 'Both image and audio files are required'}), 400
+
+    # seeds: "0,1,2"; controls: a JSON list of {pose_yaw, pose_pitch, pose_roll, face_location, face_scale}
+    try:
+        seeds = [int(seed) for seed in request.form.get('seeds', '0').split(',')]
+        controls = json.loads(request.form['controls']) if request.form.get('controls') else None
+    except ValueError as e:
+        return jsonify({'error': f'Invalid seeds or controls: {e}'}), 400
+    if controls is not None and (not isinstance(controls, list) or
+                                 not all(isinstance(c, dict) and set(c) <= set(CONTROL_KEYS) for c in controls)):
+        return jsonify({'error': f'controls must be a list of objects with keys among {", ".join(CONTROL_KEYS)}'}), 400
+    if controls and avatar_engine is not None and avatar_engine.infer_type == 'hubert_audio_only':
+        return jsonify({'error': 'controls are not supported by the hubert_audio_only avatar model, vary the seeds instead'}), 400
+    # a single seed or control set is shared by all the takes, see AvatarEngine.sample_motion
+    num_takes = max(len(seeds), len(controls or [None]))
+    if len(seeds) not in (1, num_takes) or len(controls or [None]) not in (1, num_takes):
+        return jsonify({'error': f'Got {len(seeds)} seeds for {len(controls)} control sets'}), 400
+    if num_takes > AVATAR_MAX_TAKES:
+        return jsonify({'error': f'At most {AVATAR_MAX_TAKES} takes per request'}), 400
+    render = request.form.get('render', 'true').lower() == 'true'
+    sampler = request.form.get('sampler', AVATAR_SAMPLER)
+    step_T = int(request.form.get('step_T', AVATAR_STEP_T))
+    if sampler not in AVATAR_SAMPLERS:
+        return jsonify({'error': f'sampler must be one of {", ".join(AVATAR_SAMPLERS)}'}), 400
+
+    ws = Workspace(WORKSPACE_ROOT)
+    image_path = ws.save(image_file, "image")
+    audio_path = ws.save(audio_file, "audio")
+
+    archive_path, error = generate_avatar_takes(image_path, audio_path, ws.dir, seeds, controls, render=render,
+                                                sampler=sampler, step_T=step_T)
+
+    if error:
+        ws.cleanup()
+        return jsonify({'error': error}), 500
+
+    print("Avatar takes created")
+
+    return send_and_cleanup(ws, archive_path, mimetype='application/zip', as_attachment=True,
+                            download_name='takes.zip')
 
 
 @app.route('/createAvatar', methods=['POST'])
@@ -210,28 +477,25 @@ def create_avatar():
     reference_audio = request.files.get('audio')
     text = request.form.get('text')
 
-    if not image_file or not reference_audio or not text:
-        return jsonify({'error': 'Image, audio, and text are required'}), 400
-
-    temp_ref_audio_path = os.path.join(UPLOAD_FOLDER, reference_audio.filename)
-    reference_audio.save(temp_ref_audio_path)
+    voice_id = request.form.get('voice_id')
+    avatar_id = request.form.get('avatar_id')
 
-    # Generate TTS audio
-    temp_tts_audio_path = os.path.join(OUTPUT_FOLDER, "output.wav")
-    tts_audio_path, tts_error = generate_tts_audio(temp_ref_audio_path, text, temp_tts_audio_path)
+    if not (image_file or avatar_id) or not (reference_audio or voice_id) or not text:
+        return jsonify({'error': 'Image (or avatar_id), audio (or voice_id), and text are required'}), 400
 
-    if tts_error:
-        return jsonify({'error': f'TTS generation failed: {tts_error}'}), 500
-
-    print("Successfully generated audio...")
-    output_video_path, video_error = generate_avatar_video(image_file, tts_audio_path)
-
-    if video_error:
-        return jsonify({'error': f'Avatar generation failed: {video_error}'}), 500
+    ws = Workspace(WORKSPACE_ROOT)
+    ref_audio_path = ws.save(reference_audio, "reference") if not voice_id else None
+    image_path = ws.save(image_file, "image") if not avatar_id else None
+    try:
+        output_video_path = run_avatar_pipeline(ws, image_path, ref_audio_path, text, enhance=False,
+                                                voice_id=voice_id, avatar_id=avatar_id)
+    except RuntimeError as e:
+        ws.cleanup()
+        return jsonify({'error': str(e)}), 500
 
     print("Avatar created")
-    return send_file(output_video_path, mimetype='video/mp4', as_attachment=True,
-                     download_name=os.path.basename(output_video_path))
+    return send_and_cleanup(ws, output_video_path, mimetype='video/mp4', as_attachment=True,
+                            download_name=os.path.basename(output_video_path))
 
 @app.route('/createAvatarFullPipeline', methods=['POST'])
 def create_avatar_full_pipeline():
@@ -239,39 +503,100 @@ def create_avatar_full_pipeline():
     reference_audio = request.files.get('audio')
     text = request.form.get('text')
 
-    if not image_file or not reference_audio or not text:
-        return jsonify({'error': 'Image, audio, and text are required'}), 400
-
-    ref_audio_path = os.path.join(UPLOAD_FOLDER, reference_audio.filename)
-    reference_audio.save(ref_audio_path)
+    voice_id = request.form.get('voice_id')
+    avatar_id = request.form.get('avatar_id')
 
-    input_image_path = os.path.join(UPLOAD_FOLDER, image_file.filename)
-    image_file.save(input_image_path)
+    if not (image_file or avatar_id) or not (reference_audio or voice_id) or not text:
+        return jsonify({'error': 'Image (or avatar_id), audio (or voice_id), and text are required'}), 400
 
-    tts_audio_path = os.path.join(OUTPUT_FOLDER, "output_tts.wav")
-    tts_audio, tts_error = generate_tts_audio(ref_audio_path, text, tts_audio_path)
+    ws = Workspace(WORKSPACE_ROOT)
+    ref_audio_path = ws.save(reference_audio, "reference") if not voice_id else None
+    image_path = ws.save(image_file, "image") if not avatar_id else None
+    try:
+        output_video_path = run_avatar_pipeline(ws, image_path, ref_audio_path, text, enhance=True,
+                                                voice_id=voice_id, avatar_id=avatar_id)
+    except RuntimeError as e:
+        ws.cleanup()
+        return jsonify({'error': str(e)}), 500
+
+    return send_and_cleanup(ws, output_video_path, mimetype='video/mp4', as_attachment=True,
+                            download_name=os.path.basename(output_video_path))
+
+def run_avatar_pipeline(ws, image_path, ref_audio_path, text, enhance, job=None, voice_id=None, avatar_id=None):
+    update = job.update if job is not None else None
+
+    if job is not None:
+        job.update("tts")
+    tts_audio, tts_error = generate_tts_audio(
+        ref_audio_path, text, ws.path("output_tts.wav"),
+        callback=(lambda _frame, step, max_steps: job.update("tts", step, max_steps)) if job is not None else None,
+        voice_id=voice_id)
     if tts_error:
-        return jsonify({'error': f'TTS generation failed: {tts_error}'}), 500
+        raise RuntimeError(f'TTS generation failed: {tts_error}')
 
-    success, enhanced_image_path_or_err = enhance_image(image_file.filename)
-    if not success:
-        return jsonify({'error': f'Image enhancement failed: {enhanced_image_path_or_err}'}), 500
+    profile = prepare_avatar(ws, image_path, avatar_id, enhance, job=job)
 
-    from werkzeug.datastructures import FileStorage
-    with open(enhanced_image_path_or_err, 'rb') as f:
-        enhanced_file = FileStorage(f, filename=os.path.basename(enhanced_image_path_or_err))
+    output_video_path, video_error = generate_avatar_video(profile.image_path, tts_audio, ws.dir, progress_callback=update,
+                                                           profile=profile)
+    if video_error:
+        raise RuntimeError(f'Avatar generation failed: {video_error}')
 
-        output_video_path, video_error = generate_avatar_video(enhanced_file, tts_audio)
+    return output_video_path
 
-        if video_error:
-            return jsonify({'error': f'Avatar generation failed: {video_error}'}), 500
+def run_avatar_job(job, ws, image_path, ref_audio_path, text, enhance, voice_id=None, avatar_id=None):
+    output_video_path = run_avatar_pipeline(ws, image_path, ref_audio_path, text, enhance, job=job, voice_id=voice_id,
+                                            avatar_id=avatar_id)
+    job.update("done")
+    return output_video_path
 
-    return send_file(output_video_path, mimetype='video/mp4', as_attachment=True,
-                     download_name=os.path.basename(output_video_path))
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    image_file = request.files.get('image')
+    reference_audio = request.files.get('audio')
+    text = request.form.get('text')
+    enhance = request.form.get('enhance', 'true').lower() == 'true'
+    voice_id = request.form.get('voice_id')
+    avatar_id = request.form.get('avatar_id')
+
+    if not (image_file or avatar_id) or not (reference_audio or voice_id) or not text:
+        return jsonify({'error': 'Image (or avatar_id), audio (or voice_id), and text are required'}), 400
+    if voice_id and voice_id not in voice_bank:
+        return jsonify({'error': f'Unknown voice_id: {voice_id}'}), 404
+    if avatar_id and avatar_id not in avatar_store:
+        return jsonify({'error': f'Unknown avatar_id: {avatar_id}'}), 404
+
+    ws = Workspace(WORKSPACE_ROOT)
+    ref_audio_path = ws.save(reference_audio, "reference") if not voice_id else None
+    image_path = ws.save(image_file, "image") if not avatar_id else None
+
+    # The workspace outlives the request; the queue removes it when the finished job is evicted
+    job = job_queue.submit(run_avatar_job, ws, image_path, ref_audio_path, text, enhance, voice_id=voice_id,
+                           avatar_id=avatar_id, cleanup=ws.cleanup)
+    return jsonify(job.to_dict()), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job.status == "failed":
+        return jsonify({'error': job.error}), 500
+    if job.status != "done":
+        return jsonify(job.to_dict()), 409
+
+    return send_file(job.result_path, mimetype='video/mp4', as_attachment=True,
+                     download_name=os.path.basename(job.result_path), conditional=True)
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    app.run(debug=True, threaded=True)
 
 
 
@@ -0,0 +1,91 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job:
+    """State of one queued avatar request, as reported by `GET /jobs/<id>`."""
+
+    def __init__(self, job_id, cleanup=None):
+        self.id = job_id
+        self.cleanup = cleanup
+        self.status = "queued"
+        self.stage = None
+        self.step = 0
+        self.total = 0
+        self.result_path = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def update(self, stage, step=0, total=0):
+        self.stage = stage
+        self.step = step
+        self.total = total
+        # Returning True lets this be used directly as a Zonos `generate` callback
+        return True
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "step": self.step,
+            "total": self.total,
+            "progress": round(self.step / self.total, 4) if self.total else None,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    """
+    Runs long avatar pipelines on a bounded pool of worker threads.
+
+    `submit(fn, *args)` returns a Job immediately; `fn(job, *args)` runs on the pool,
+    reports its progress through `job.update` and returns the path of the result file.
+    `cleanup`, if given, is called when the finished job is evicted, which is the
+    last point at which its result can still be downloaded.
+    """
+
+    def __init__(self, max_workers=1, max_finished=256):
+        self.max_workers = max_workers
+        self.max_finished = max_finished
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="avatar-job")
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, fn, *args, cleanup=None, **kwargs):
+        job = Job(uuid.uuid4().hex, cleanup=cleanup)
+        with self.lock:
+            self._forget_finished()
+            self.jobs[job.id] = job
+        self.executor.submit(self._run, job, fn, *args, **kwargs)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def _run(self, job, fn, *args, **kwargs):
+        job.status = "running"
+        try:
+            job.result_path = fn(job, *args, **kwargs)
+            job.status = "done"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+
+    def _forget_finished(self):
+        finished = [job for job in self.jobs.values() if job.finished_at is not None]
+        if len(finished) < self.max_finished:
+            return
+        finished.sort(key=lambda job: job.finished_at)
+        for job in finished[: len(finished) - self.max_finished + 1]:
+            del self.jobs[job.id]
+            if job.cleanup is not None:
+                job.cleanup()
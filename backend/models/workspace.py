@@ -0,0 +1,32 @@
+import os
+import shutil
+import uuid
+
+from werkzeug.utils import secure_filename
+
+
+class Workspace:
+    """
+    Private scratch directory for one request.
+
+    Uploads, TTS audio, enhanced images, rendered frames and the final video of a
+    request all live under `<root>/<uuid>/`, so concurrent requests never share a path.
+    """
+
+    def __init__(self, root):
+        self.id = uuid.uuid4().hex
+        self.dir = os.path.join(os.path.abspath(root), self.id)
+        os.makedirs(self.dir)
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def save(self, file_storage, stem):
+        """Save an uploaded file as `<stem><ext>`; the client-supplied name only provides the extension."""
+        _, ext = os.path.splitext(secure_filename(file_storage.filename or ""))
+        path = self.path(stem + ext.lower())
+        file_storage.save(path)
+        return path
+
+    def cleanup(self):
+        shutil.rmtree(self.dir, ignore_errors=True)